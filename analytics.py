@@ -0,0 +1,222 @@
+# Analisi dei dettagli mensili con NumPy: sforamento delle ore (ore lavorate
+# meno ore preventivate), tariffa oraria realizzata (importo pagato diviso ore
+# lavorate) e tasso di incasso (importo pagato rispetto al prezzo concordato).
+#
+# ContractMonths impacchetta i ledger di tutti i contratti in colonne parallele,
+# una riga per ogni mese di ogni contratto: codici di contratto, cliente,
+# servizio, agente e mese (interi da 0, con le chiavi originali a parte) e i
+# valori numerici. Le colonne dei ledger sono già array('d'), quindi vengono
+# unite copiando i byte senza passare dai singoli valori.
+#
+# Somme e conteggi per gruppo sono un solo np.bincount per misura. Per i
+# percentili le righe vengono ordinate per tariffa una volta sola, quando le
+# colonne sono costruite; ogni raggruppamento le riordina in modo stabile per
+# codice di gruppo (così ogni blocco resta in ordine di tariffa) e legge le
+# posizioni dei quantili. Nessun ciclo Python per riga: su un milione di
+# mesi-contratto un raggruppamento richiede circa un decimo di secondo.
+#
+# NumPy è una dipendenza facoltativa: senza di essa AVAILABLE è False e il resto
+# dell'applicazione funziona normalmente.
+try:
+    import numpy as np
+except ImportError:     # pragma: no cover - dipende dall'ambiente
+    np = None
+
+AVAILABLE = np is not None
+
+# Dimensioni per cui si possono raggruppare i mesi-contratto
+DIMENSIONS = ('contract', 'client', 'service', 'agent', 'month')
+
+# Misure calcolate per ogni gruppo, nell'ordine delle colonne del risultato
+MEASURES = ('months', 'estimated_hours', 'hours_worked', 'overrun', 'overrun_months',
+            'amount_paid', 'billed', 'hourly_rate', 'collection_rate')
+
+# Quantili (in percentuale) della tariffa oraria mensile di ogni gruppo
+QUANTILES = (10, 50, 90)
+
+
+class ContractMonths:
+    """Mesi-contratto di tutti i servizi cliente in colonne NumPy."""
+
+    def __init__(self, client_services, agents=None, generation=None):
+        """
+        client_services: servizi cliente con i dettagli mensili; agents: id
+        cliente -> agente; generation: versione dei dati da cui sono stati letti.
+        """
+        agents = agents or {}
+        self.generation = generation
+        codes = {dimension: {} for dimension in ('client', 'service', 'agent')}
+        contract_ids, starts, lengths, prices = [], [], [], []
+        per_contract = {dimension: [] for dimension in codes}
+        columns = {'hours_worked': [], 'amount_paid': [], 'estimated_hours': []}
+        for client_service in client_services:
+            details = client_service['monthly_details']
+            if not details:
+                continue
+            contract_ids.append(client_service['id'])
+            starts.append(details.start)
+            lengths.append(len(details))
+            prices.append(client_service.get('subscribed_price') or 0.0)
+            for dimension, key in (('client', client_service['client_id']),
+                                   ('service', client_service['service_id']),
+                                   ('agent', agents.get(client_service['client_id'], ''))):
+                table = codes[dimension]
+                per_contract[dimension].append(table.setdefault(key, len(table)))
+            for field, parts in columns.items():
+                parts.append(getattr(details, field))
+
+        lengths = np.array(lengths, dtype=np.intp)
+        rows = int(lengths.sum())
+        contract = np.repeat(np.arange(len(lengths)), lengths)
+        # Mese di ogni riga: mese iniziale del contratto più la posizione nel ledger
+        first_rows = np.cumsum(lengths) - lengths
+        month = np.repeat(np.array(starts, dtype=np.intp) - first_rows, lengths) + np.arange(rows)
+        self.first_month = int(month.min()) if rows else 0
+
+        self.keys = {dimension: list(table) for dimension, table in codes.items()}
+        self.keys['contract'] = contract_ids
+        self.keys['month'] = list(range(self.first_month, int(month.max()) + 1 if rows else 0))
+        self.codes = {dimension: np.array(values, dtype=np.intp)[contract]
+                      for dimension, values in per_contract.items()}
+        self.codes['contract'] = contract
+        self.codes['month'] = month - self.first_month
+        self.month = month
+        self.price = np.repeat(np.array(prices, dtype=np.float64), lengths)
+        for field, parts in columns.items():
+            setattr(self, field, np.frombuffer(b''.join(parts), dtype=np.float64))
+
+        # Tariffa oraria dei mesi con ore lavorate e righe di quei mesi ordinate
+        # per tariffa: i percentili di ogni raggruppamento partono da qui
+        self._rates = np.full(rows, np.nan)
+        np.divide(self.amount_paid, self.hours_worked, out=self._rates, where=self.hours_worked > 0)
+        worked = np.flatnonzero(self.hours_worked > 0)
+        self._rate_rows = worked[np.argsort(self._rates[worked], kind='stable')]
+
+    def __len__(self):
+        return len(self.month)
+
+    def grouped(self, by, first=None, last=None):
+        """
+        Misure per gruppo sui mesi da first a last (numeri progressivi, estremi
+        inclusi, None = senza limite). Restituisce un dizionario con 'key' (le
+        chiavi dei gruppi con almeno un mese), una colonna per misura e 'p10',
+        'p50', 'p90' con i quantili della tariffa oraria dei singoli mesi.
+        Tariffe e tassi sono NaN dove il denominatore è zero.
+        """
+        if by not in DIMENSIONS:
+            raise ValueError(f'Dimensione non valida: {by}')
+        rows = self._rows(first, last)
+        codes = self.codes[by][rows]
+        size = len(self.keys[by])
+        hours_worked = self.hours_worked[rows]
+        amount_paid = self.amount_paid[rows]
+        estimated_hours = self.estimated_hours[rows]
+        overrun = hours_worked - estimated_hours
+
+        months = np.bincount(codes, minlength=size)
+        result = {
+            'months': months,
+            'estimated_hours': np.bincount(codes, estimated_hours, size),
+            'hours_worked': np.bincount(codes, hours_worked, size),
+            'overrun': np.bincount(codes, overrun, size),
+            'overrun_months': np.bincount(codes[overrun > 0], minlength=size),
+            'amount_paid': np.bincount(codes, amount_paid, size),
+            'billed': np.bincount(codes, self.price[rows], size),
+        }
+        result['hourly_rate'] = _ratio(result['amount_paid'], result['hours_worked'])
+        result['collection_rate'] = _ratio(result['amount_paid'], result['billed'])
+        # Tariffe dei mesi lavorati del periodo, già in ordine crescente
+        rated = self._rate_rows if isinstance(rows, slice) else self._rate_rows[rows[self._rate_rows]]
+        quantiles = grouped_percentiles(self.codes[by][rated], self._rates[rated], size, QUANTILES, presorted=True)
+        for quantile, values in zip(QUANTILES, quantiles):
+            result[f'p{quantile}'] = values
+
+        present = np.flatnonzero(months)
+        keys = self.keys[by]
+        result = {name: column[present] for name, column in result.items()}
+        result['key'] = [keys[code] for code in present.tolist()]
+        return result
+
+    def totals(self, first=None, last=None):
+        """Misure complessive sui mesi da first a last, con i quantili della tariffa oraria."""
+        rows = self._rows(first, last)
+        hours_worked = self.hours_worked[rows]
+        amount_paid = self.amount_paid[rows]
+        estimated_hours = self.estimated_hours[rows]
+        overrun = hours_worked - estimated_hours
+        totals = {
+            'months': int(len(hours_worked)),
+            'estimated_hours': float(estimated_hours.sum()),
+            'hours_worked': float(hours_worked.sum()),
+            'overrun': float(overrun.sum()),
+            'overrun_months': int((overrun > 0).sum()),
+            'amount_paid': float(amount_paid.sum()),
+            'billed': float(self.price[rows].sum()),
+        }
+        totals['hourly_rate'] = _scalar_ratio(totals['amount_paid'], totals['hours_worked'])
+        totals['collection_rate'] = _scalar_ratio(totals['amount_paid'], totals['billed'])
+        rates = self._rates[self._rate_rows if isinstance(rows, slice) else self._rate_rows[rows[self._rate_rows]]]
+        for quantile in QUANTILES:
+            totals[f'p{quantile}'] = float(np.percentile(rates, quantile)) if len(rates) else None
+        return totals
+
+    def _rows(self, first, last):
+        """Selezione delle righe dei mesi da first a last (slice se non c'è limite)."""
+        if first is None and last is None:
+            return slice(None)
+        mask = np.ones(len(self.month), dtype=bool)
+        if first is not None:
+            mask &= self.month >= first
+        if last is not None:
+            mask &= self.month <= last
+        return mask
+
+
+def top(grouped, measure, limit, descending=True):
+    """
+    Posizioni delle prime limit righe di un risultato di grouped() ordinate
+    per una misura (i NaN vanno in fondo). np.argpartition evita di ordinare
+    tutti i gruppi quando ne servono pochi.
+    """
+    values = grouped[measure].astype(np.float64)
+    values = np.where(np.isnan(values), -np.inf, values if descending else -values)
+    if limit < len(values):
+        candidates = np.argpartition(-values, limit)[:limit]
+    else:
+        candidates = np.arange(len(values))
+    return candidates[np.argsort(-values[candidates], kind='stable')].tolist()
+
+
+def grouped_percentiles(codes, values, size, quantiles, presorted=False):
+    """
+    Percentili (interpolazione lineare, come np.percentile) dei valori di
+    ogni gruppo: una riga per quantile e una colonna per codice di gruppo,
+    NaN per i gruppi senza valori. Con presorted=True i valori sono già in
+    ordine crescente e basta un ordinamento stabile dei codici (radix sort
+    quando i gruppi stanno in 16 bit) invece di np.lexsort.
+    """
+    if presorted:
+        order = np.argsort(codes.astype(np.uint16) if size <= 1 << 16 else codes, kind='stable')
+    else:
+        order = np.lexsort((values, codes))
+    values = values[order]
+    counts = np.bincount(codes, minlength=size)
+    starts = np.cumsum(counts) - counts
+    filled = np.flatnonzero(counts)
+    result = np.full((len(quantiles), size), np.nan)
+    for row, quantile in enumerate(quantiles):
+        position = starts[filled] + (counts[filled] - 1) * (quantile / 100)
+        lower = np.floor(position).astype(np.intp)
+        upper = np.ceil(position).astype(np.intp)
+        result[row, filled] = values[lower] + (values[upper] - values[lower]) * (position - lower)
+    return result
+
+
+def _ratio(numerator, denominator):
+    result = np.full(len(numerator), np.nan)
+    np.divide(numerator, denominator, out=result, where=denominator != 0)
+    return result
+
+
+def _scalar_ratio(numerator, denominator):
+    return numerator / denominator if denominator else None
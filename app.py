@@ -1,14 +1,53 @@
 # Importa le librerie necessarie di Flask
-from flask import Flask, render_template, request, redirect, url_for, flash
-import uuid
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context, abort
+import os
+import base64
+import json
+import math
+import threading
+import click
 # Importa le classi datetime e timedelta dal modulo datetime
 from datetime import datetime, timedelta
-# Importa il modulo calendar per i nomi dei mesi
-import calendar
-
-# Importa le librerie necessarie di Firebase Functions
-from firebase_functions import https_fn
-from firebase_functions.https import Request
+# Convertitori degli URL di Werkzeug
+from werkzeug.routing import BaseConverter, ValidationError
+
+# Livello di accesso ai dati con indici per chiave primaria e secondari
+from repository import Repository, IntegrityError, ORDERED_INDEXES, PAGE_SIZE, AUTOCOMPLETE_LIMIT
+# Dettagli mensili in forma colonnare, estesi fino al mese corrente per i contratti in corso
+from ledger import FIELDS as MONTH_FIELDS, MonthlyLedger, current_monthly_details
+# Record delle tabelle come classi con __slots__
+from records import Client, ClientService, Collaborator, Prospect, Service
+# Id interi ordinati nel tempo e loro forma testuale per URL e form
+from ids import format_id, new_id, parse_id
+# Tabella precalcolata dei mesi (numeri progressivi, nomi e confini)
+from months import ITALIAN_MONTHS, month_index, month_info, month_of, year_month
+# Backend persistente alternativo basato su instance/crm.db
+from sqlite_repository import SQLiteRepository
+# Journal delle modifiche per rendere persistente il repository in memoria
+from journal import Journal
+# Snapshot binari msgpack per l'avvio rapido
+from snapshots import load_snapshot, save_snapshot
+# Tabelle coperte dalla ricerca testuale
+from search import SEARCH_TABLES
+# Campi delle faccette dell'elenco clienti
+from facets import FACETS
+# Importazione in blocco dalle vecchie versioni del CRM
+from importer import BATCH_SIZE, Importer
+# Esportazioni CSV / NDJSON in streaming
+from exports import EXPORT_FIELDS, EXPORT_FORMATS, export_chunks
+# Coda delle scadenze per i promemoria di rinnovo
+from renewals import RenewalScheduler
+# Aggregati della dashboard aggiornati per differenza
+from rollups import Rollups
+# Analisi vettoriali dei dettagli mensili (facoltative, richiedono numpy)
+import analytics
+
+# Importa le librerie necessarie di Firebase Functions (facoltative: senza
+# l'SDK l'applicazione gira come normale app Flask, per esempio nei test)
+try:
+    from firebase_functions import https_fn
+except ImportError:     # pragma: no cover - dipende dall'ambiente
+    https_fn = None
 
 # Inizializza l'applicazione Flask
 # Abbiamo spostato l'inizializzazione qui, fuori dalla funzione,
@@ -16,6 +55,30 @@ from firebase_functions.https import Request
 app = Flask(__name__)
 # Imposta una chiave segreta per il funzionamento dei messaggi flash e delle sessioni
 app.secret_key = 'chiave_segreta_molto_sicura'
+# Backend dei dati: 'memory' (predefinito, dati di esempio) oppure 'sqlite' (instance/crm.db)
+app.config['CRM_BACKEND'] = os.environ.get('CRM_BACKEND', 'memory')
+app.config['CRM_DATABASE'] = os.environ.get('CRM_DATABASE', os.path.join(app.instance_path, 'crm.db'))
+# Cartella per journal e snapshot del backend in memoria (se vuota i dati restano solo in memoria)
+app.config['CRM_DATA_DIR'] = os.environ.get('CRM_DATA_DIR')
+# Snapshot msgpack di sola lettura da cui partire quando non c'è una cartella dati
+# (es. distribuito insieme alla Cloud Function per un avvio a freddo rapido)
+app.config['CRM_SNAPSHOT'] = os.environ.get('CRM_SNAPSHOT')
+
+# Convertitore 'id' per le rotte: negli URL l'id è testo, nelle funzioni un intero
+class IdConverter(BaseConverter):
+    def to_python(self, value):
+        record_id = parse_id(value)
+        if record_id is None:
+            raise ValidationError()
+        return record_id
+
+    def to_url(self, value):
+        return format_id(value)
+
+app.url_map.converters['id'] = IdConverter
+
+# Registra il filtro 'format_id' per Jinja (id nei form e negli URL composti a mano)
+app.add_template_filter(format_id)
 
 # Registra il filtro 'date' per Jinja
 @app.template_filter('date')
@@ -28,142 +91,377 @@ def date_format(value, format="%d/%m/%Y"):
 # Funzione helper per generare i dettagli mensili
 def generate_monthly_details(start_date, end_date):
     """
-    Genera una lista di dizionari, uno per ogni mese tra le due date.
-    Ogni dizionario include il mese, l'anno, il nome del mese, le note, le ore lavorate, l'importo pagato e le ore preventivate.
-    """
-    monthly_details = []
-    current_date = start_date
-    while current_date <= end_date:
-        monthly_details.append({
-            'month': current_date.month,
-            'year': current_date.year,
-            'month_name': calendar.month_name[current_date.month],
-            'notes': '',  # Inizializza le note come stringa vuota
-            'hours_worked': 0, # Campo per le ore lavorate
-            'amount_paid': 0.0, # Campo per l'importo pagato
-            'estimated_hours': 0 # Nuovo campo per le ore preventivate
-        })
-        # Sposta al primo giorno del mese successivo
-        if current_date.month == 12:
-            current_date = datetime(current_date.year + 1, 1, 1)
-        else:
-            current_date = datetime(current_date.year, current_date.month + 1, 1)
-    return monthly_details
+    Genera i dettagli mensili (MonthlyLedger) di un servizio cliente, con un mese
+    per ogni mese tra le due date e tutti i valori inizializzati a zero.
+    Ogni mese espone il mese, l'anno, il nome del mese, le note, le ore lavorate, l'importo pagato e le ore preventivate.
+    Il ledger vuoto di uno stesso intervallo di mesi viene calcolato una volta sola.
+    """
+    return MonthlyLedger.for_range(start_date, end_date)
+
+def merged_monthly_details(details, start_date, end_date):
+    """
+    Riallinea i dettagli mensili alle nuove date del contratto: i mesi ancora
+    coperti conservano note, ore e importi, quelli nuovi partono da zero.
+    """
+    start = month_index(start_date)
+    if end_date is not None:
+        end = month_index(end_date)
+    else:
+        # Contratto in corso: almeno fino al mese attuale, senza perdere mesi già registrati
+        end = max(month_index(datetime.now()), details.end if details else start - 1)
+    if not details:
+        return MonthlyLedger.empty(start, 0).reframed(start, end)
+    return details.reframed(start, end)
 
 # --- In-Memory Database (simulazione di un database) ---
-clients = [
-    {
-        'id': str(uuid.uuid4()),
-        'name': 'Azienda Alpha',
-        'contact': 'Mario Rossi',
-        'email': 'mario.rossi@alpha.it',
-        'phone': '011-1234567',
-        'vat_id': 'IT12345678901',
-        'address': 'Via Roma 10',
-        'city': 'Torino',
-        'zip': '10121',
-        'sdi_code': 'ABCDEFG',
-        'agent': 'Giuseppe Verdi',
-        'call_center': 'Call Center Nord',
-        'created_at': datetime(2023, 1, 1)
-    },
-    {
-        'id': str(uuid.uuid4()),
-        'name': 'Beta S.r.l.',
-        'contact': 'Giulia Bianchi',
-        'email': 'giulia.bianchi@beta.it',
-        'phone': '022-9876543',
-        'vat_id': 'IT98765432109',
-        'address': 'Corso Sempione 5',
-        'city': 'Milano',
-        'zip': '20145',
-        'sdi_code': 'HIJKLMN',
-        'agent': 'Anna Neri',
-        'call_center': 'Call Center Sud',
-        'created_at': datetime(2023, 2, 1)
-    },
-]
-
-# --- NUOVO: Elenco di dati di esempio per i potenziali clienti ---
-prospects = [
-    {
-        'id': str(uuid.uuid4()),
-        'name': 'Gamma S.p.A.',
-        'contact': 'Luca Verdi',
-        'email': 'luca.verdi@gamma.it',
-        'phone': '06-11223344',
-        'notes': 'Interessato a sviluppo app mobile.',
-        'preventivo': 'Preventivo iniziale per app iOS/Android inviato il 01/07/2024.',
-        'graphic_quote_link': 'https://drive.google.com/file/d/1aBcDeFgHiJkLmNoPqRsTuVwXyZ/view?usp=sharing' # Esempio di link
-    },
-    {
-        'id': str(uuid.uuid4()),
-        'name': 'Delta Tech',
-        'contact': 'Sara Neri',
-        'email': 'sara.neri@delta.com',
-        'phone': '081-55667788',
-        'notes': 'Richiesta di preventivo per campagna SEO.',
-        'preventivo': 'Preventivo per campagna SEO base inviato il 15/06/2024.',
-        'graphic_quote_link': '' # Nessun link per questo esempio
-    }
-]
-
-services = [
-    {'id': str(uuid.uuid4()), 'name': 'Sviluppo Sito Web', 'price': 1500, 'description': 'Creazione di un sito web responsivo.'},
-    {'id': str(uuid.uuid4()), 'name': 'Campagna Social Media', 'price': 800, 'description': 'Gestione di profili social e campagne pubblicitarie.'},
-]
-
-# --- NUOVO: Elenco di dati di esempio per i collaboratori ---
-collaborators = [
-    {'id': str(uuid.uuid4()), 'name': 'Mario Rossi', 'role': 'Sviluppatore', 'email': 'mario.rossi@example.com', 'phone': '333-1234567'},
-    {'id': str(uuid.uuid4()), 'name': 'Giulia Bianchi', 'role': 'Designer', 'email': 'giulia.bianchi@example.com', 'phone': '339-9876543'},
-]
-
-# --- STRUTTURA DATI PER COLLEGARE CLIENTI E SERVIZI ---
-client_services = [
-    {
-        'id': str(uuid.uuid4()),
-        'client_id': clients[0]['id'],
-        'service_id': services[0]['id'],
-        'subscribed_price': 1400.00,
-        'start_date': datetime(2023, 1, 15),
-        'end_date': datetime(2023, 12, 31),
-        'notes': 'Sconto applicato per l\'anno intero.',
-        # Aggiunta del campo monthly_details
-        'monthly_details': generate_monthly_details(datetime(2023, 1, 15), datetime(2023, 12, 31))
-    },
-    {
-        'id': str(uuid.uuid4()),
-        'client_id': clients[0]['id'],
-        'service_id': services[1]['id'],
-        'subscribed_price': 750.00,
-        'start_date': datetime(2023, 3, 1),
-        'end_date': None,
-        'notes': 'Contratto a tempo indeterminato.',
-        # Per i contratti a tempo indeterminato, calcoliamo i mesi fino ad oggi
-        'monthly_details': generate_monthly_details(datetime(2023, 3, 1), datetime.now())
+def load_sample_data(repo):
+    """Carica nel repository i dati di esempio usati in sviluppo."""
+    clients = [
+        {
+            'id': new_id(),
+            'name': 'Azienda Alpha',
+            'contact': 'Mario Rossi',
+            'email': 'mario.rossi@alpha.it',
+            'phone': '011-1234567',
+            'vat_id': 'IT12345678901',
+            'address': 'Via Roma 10',
+            'city': 'Torino',
+            'zip': '10121',
+            'sdi_code': 'ABCDEFG',
+            'agent': 'Giuseppe Verdi',
+            'call_center': 'Call Center Nord',
+            'created_at': datetime(2023, 1, 1)
+        },
+        {
+            'id': new_id(),
+            'name': 'Beta S.r.l.',
+            'contact': 'Giulia Bianchi',
+            'email': 'giulia.bianchi@beta.it',
+            'phone': '022-9876543',
+            'vat_id': 'IT98765432109',
+            'address': 'Corso Sempione 5',
+            'city': 'Milano',
+            'zip': '20145',
+            'sdi_code': 'HIJKLMN',
+            'agent': 'Anna Neri',
+            'call_center': 'Call Center Sud',
+            'created_at': datetime(2023, 2, 1)
+        },
+    ]
+
+    # --- NUOVO: Elenco di dati di esempio per i potenziali clienti ---
+    prospects = [
+        {
+            'id': new_id(),
+            'name': 'Gamma S.p.A.',
+            'contact': 'Luca Verdi',
+            'email': 'luca.verdi@gamma.it',
+            'phone': '06-11223344',
+            'notes': 'Interessato a sviluppo app mobile.',
+            'preventivo': 'Preventivo iniziale per app iOS/Android inviato il 01/07/2024.',
+            'graphic_quote_link': 'https://drive.google.com/file/d/1aBcDeFgHiJkLmNoPqRsTuVwXyZ/view?usp=sharing' # Esempio di link
+        },
+        {
+            'id': new_id(),
+            'name': 'Delta Tech',
+            'contact': 'Sara Neri',
+            'email': 'sara.neri@delta.com',
+            'phone': '081-55667788',
+            'notes': 'Richiesta di preventivo per campagna SEO.',
+            'preventivo': 'Preventivo per campagna SEO base inviato il 15/06/2024.',
+            'graphic_quote_link': '' # Nessun link per questo esempio
+        }
+    ]
+
+    services = [
+        {'id': new_id(), 'name': 'Sviluppo Sito Web', 'price': 1500, 'description': 'Creazione di un sito web responsivo.'},
+        {'id': new_id(), 'name': 'Campagna Social Media', 'price': 800, 'description': 'Gestione di profili social e campagne pubblicitarie.'},
+    ]
+
+    # --- NUOVO: Elenco di dati di esempio per i collaboratori ---
+    collaborators = [
+        {'id': new_id(), 'name': 'Mario Rossi', 'role': 'Sviluppatore', 'email': 'mario.rossi@example.com', 'phone': '333-1234567'},
+        {'id': new_id(), 'name': 'Giulia Bianchi', 'role': 'Designer', 'email': 'giulia.bianchi@example.com', 'phone': '339-9876543'},
+    ]
+
+    # --- STRUTTURA DATI PER COLLEGARE CLIENTI E SERVIZI ---
+    client_services = [
+        {
+            'id': new_id(),
+            'client_id': clients[0]['id'],
+            'service_id': services[0]['id'],
+            'subscribed_price': 1400.00,
+            'start_date': datetime(2023, 1, 15),
+            'end_date': datetime(2023, 12, 31),
+            'notes': 'Sconto applicato per l\'anno intero.',
+            # Aggiunta del campo monthly_details
+            'monthly_details': generate_monthly_details(datetime(2023, 1, 15), datetime(2023, 12, 31))
+        },
+        {
+            'id': new_id(),
+            'client_id': clients[0]['id'],
+            'service_id': services[1]['id'],
+            'subscribed_price': 750.00,
+            'start_date': datetime(2023, 3, 1),
+            'end_date': None,
+            'notes': 'Contratto a tempo indeterminato.',
+            # Per i contratti a tempo indeterminato, calcoliamo i mesi fino ad oggi
+            'monthly_details': generate_monthly_details(datetime(2023, 3, 1), datetime.now())
+        }
+    ]
+
+    with repo.transaction() as tx:
+        for table, records in (('clients', clients), ('prospects', prospects), ('services', services),
+                               ('collaborators', collaborators), ('client_services', client_services)):
+            for record in records:
+                tx.insert(table, record)
+
+
+# Tutte le rotte leggono e scrivono i dati attraverso il repository indicizzato
+if app.config['CRM_BACKEND'] == 'sqlite':
+    repo = SQLiteRepository(app.config['CRM_DATABASE'])
+else:
+    repo = Repository()
+    if app.config['CRM_DATA_DIR']:
+        # Riparte da snapshot + coda del journal; al primo avvio salva i dati di esempio
+        journal = Journal(app.config['CRM_DATA_DIR'])
+        if not journal.restore(repo):
+            load_sample_data(repo)
+            journal.checkpoint(repo.snapshot())
+        repo.attach_journal(journal)
+    elif app.config['CRM_SNAPSHOT']:
+        repo.load(*load_snapshot(app.config['CRM_SNAPSHOT']))
+    else:
+        load_sample_data(repo)
+
+
+# --- Promemoria di rinnovo dei contratti ---
+def renewal_due(client_service_id, end_date):
+    """Task di rinnovo: il contratto è entrato nel periodo di preavviso."""
+    app.logger.info('Contratto %s in scadenza il %s: da rinnovare', client_service_id, end_date.strftime('%d/%m/%Y'))
+
+# La coda delle scadenze parte dai contratti non ancora scaduti ed è poi
+# aggiornata dalle rotte dei servizi cliente
+renewals = RenewalScheduler(task=renewal_due)
+renewals.load(repo.client_services_ending(datetime.now(), datetime.max), datetime.now())
+
+@app.before_request
+def tick_renewals():
+    """Controlla la cima della coda delle scadenze (O(1) se non scade nulla)."""
+    renewals.tick(datetime.now())
+
+def cancel_cascaded_renewals(tx, table, record_id):
+    """
+    Toglie dalla coda delle scadenze, al commit di tx, i contratti che verranno
+    eliminati a cascata con il cliente o il servizio record_id.
+    """
+    if table == 'clients':
+        contracts = tx.client_services_for_client(record_id)
+    elif table == 'services':
+        contracts = tx.client_services_for_service(record_id)
+    else:
+        return
+    for client_service in contracts:
+        tx.on_commit(renewals.cancel, client_service['id'])
+
+
+# --- Aggregati della dashboard ---
+# Calcolati all'avvio in un thread separato (con molti contratti richiede
+# qualche secondo) e aggiornati per differenza dalle rotte che modificano
+# clienti, servizi cliente e dettagli mensili
+rollups = Rollups()
+
+def load_rollups():
+    # La coda degli aggiornamenti parte prima dello snapshot: nessun commit va perso
+    rollups.begin_load()
+    snapshot = repo.snapshot()
+    rollups.load(snapshot.iter_all('clients'), snapshot.iter_client_services())
+
+threading.Thread(target=load_rollups, name='rollups', daemon=True).start()
+
+# Colonne NumPy dei mesi-contratto per la pagina di analisi, costruite dalle
+# copie dei contratti tenute dagli aggregati e rifatte solo dopo una modifica
+_contract_months = None
+
+def contract_months():
+    global _contract_months
+    generation, client_services, agents = rollups.contracts()
+    packed = _contract_months
+    if packed is None or packed.generation != generation:
+        packed = _contract_months = analytics.ContractMonths(client_services, agents, generation)
+    return packed
+
+
+# --- Paginazione delle pagine elenco ---
+# Filtri accettati nella query string della rubrica (uguaglianza)
+CLIENT_FILTERS = ('city', 'agent')
+
+# Campi data filtrabili per intervallo (?<campo>_from=AAAA-MM-GG&<campo>_to=AAAA-MM-GG)
+DATE_RANGES = ('created_at',)
+
+def encode_cursor(cursor):
+    """Cursore della pagina successiva in forma adatta a un URL."""
+    return base64.urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode()).decode()
+
+def decode_cursor(token):
+    """Decodifica il cursore ricevuto nella query string; None se assente o non valido."""
+    if not token:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(token.encode()))
+    except ValueError:
+        return None
+
+def page_url(**changes):
+    """URL della pagina corrente con i parametri della query string modificati."""
+    args = request.args.to_dict(flat=False)
+    args.update(changes)
+    return url_for(request.endpoint, **{key: value for key, value in args.items() if value})
+
+def list_page(table, default_sort='name', filter_fields=(), facet_fields=(), range_fields=()):
+    """
+    Legge ordinamento (sort, dir), filtri, intervalli di date, faccette
+    (parametri ripetibili) e cursore (after) dalla query string e restituisce
+    la pagina richiesta con i link e i conteggi delle faccette per il template.
+    """
+    sort = request.args.get('sort', default_sort)
+    if sort not in ORDERED_INDEXES[table]:
+        sort = default_sort
+    descending = request.args.get('dir') == 'desc'
+    filters = {field: request.args[field] for field in filter_fields if request.args.get(field)}
+    selection = {field: [value for value in request.args.getlist(field) if value] for field in facet_fields}
+    selection = {field: values for field, values in selection.items() if values}
+    ranges = {}
+    for field in range_fields:
+        start = _date_arg(f'{field}_from')
+        end = _date_arg(f'{field}_to')
+        if start or end:
+            # Il giorno finale è compreso per intero
+            ranges[field] = (start or datetime.min, end + timedelta(days=1, microseconds=-1) if end else datetime.max)
+    records, cursor = repo.page(table, sort, after=decode_cursor(request.args.get('after')),
+                                descending=descending, filters=filters, facets=selection, ranges=ranges)
+    # Cliccando sulla colonna già ordinata si inverte la direzione
+    sort_urls = {field: page_url(sort=field, dir='desc' if field == sort and not descending else None, after=None)
+                 for field in ORDERED_INDEXES[table]}
+    page = {
+        'records': records,
+        'sort': sort,
+        'descending': descending,
+        'filters': filters,
+        'range_fields': range_fields,
+        'sort_urls': sort_urls,
+        'next_url': page_url(after=encode_cursor(cursor)) if cursor else None,
+        'first_url': page_url(after=None) if request.args.get('after') else None,
     }
-]
+    if facet_fields:
+        page['facets'], page['total'] = repo.facet_counts(table, selection)
+        page['selection'] = selection
+        page['clear_url'] = page_url(after=None, **{field: None for field in facet_fields}) if selection else None
+    return page
+
+def _date_arg(name):
+    """Data della query string (AAAA-MM-GG); None se assente o non valida."""
+    try:
+        return datetime.strptime(request.args[name], '%Y-%m-%d')
+    except (KeyError, ValueError):
+        return None
+
+
+# --- Ricerca testuale su clienti e potenziali clienti ---
+@app.route('/search')
+def search():
+    """Renderizza i risultati della ricerca (parametri q e, facoltativo, tipo)."""
+    query = request.args.get('q', '').strip()
+    scope = request.args.get('tipo', '')
+    tables = (scope,) if scope in SEARCH_TABLES else SEARCH_TABLES
+    results = repo.search(query, tables) if query else []
+    return render_template('search.html', query=query, scope=scope, results=results)
+
+
+# --- Completamento automatico per i campi di scelta ---
+# Entità consultabili -> funzione che produce l'etichetta mostrata nei suggerimenti
+AUTOCOMPLETE_LABELS = {
+    'clients': lambda record: f"{record['name']} ({record['city']})" if record.get('city') else record['name'],
+    'services': lambda record: f"{record['name']} - {record['price']:,.2f} €",
+    'prospects': lambda record: record['name'],
+    'collaborators': lambda record: record['name'],
+}
+
+@app.route('/autocomplete/<string:entity>')
+def autocomplete(entity):
+    """
+    Restituisce in JSON i primi record il cui nome inizia con il testo q,
+    così i moduli non devono includere l'intero elenco.
+    """
+    if entity not in AUTOCOMPLETE_LABELS:
+        return jsonify({'error': 'Entità non valida.'}), 404
+    try:
+        limit = min(max(int(request.args.get('limit', AUTOCOMPLETE_LIMIT)), 1), PAGE_SIZE)
+    except ValueError:
+        limit = AUTOCOMPLETE_LIMIT
+    label = AUTOCOMPLETE_LABELS[entity]
+    items = []
+    for record in repo.prefix_search(entity, request.args.get('q', '').strip(), limit=limit):
+        item = {'id': format_id(record['id']), 'name': record['name'], 'label': label(record)}
+        if entity == 'services':
+            item['price'] = record['price']
+        items.append(item)
+    return jsonify(items)
+
+
+# --- Esportazioni per la contabilità ---
+@app.route('/export/<string:entity>.<string:fmt>')
+def export(entity, fmt):
+    """
+    Scarica clienti, servizi, servizi cliente o la vista contratto-mese
+    (contract_months) in CSV o NDJSON. La risposta è generata a blocchi
+    mentre viene inviata, sempre dallo stesso snapshot dei dati.
+    """
+    if entity not in EXPORT_FIELDS or fmt not in EXPORT_FORMATS:
+        abort(404)
+    filename = f"{entity}-{datetime.now():%Y%m%d}.{fmt}"
+    return Response(stream_with_context(export_chunks(repo.snapshot(), entity, fmt)),
+                    mimetype=EXPORT_FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 
 # --- Route per la Homepage ---
+# Mesi e voci mostrati nelle tabelle della dashboard
+DASHBOARD_MONTHS = 12
+DASHBOARD_TOP = 10
+
 @app.route('/')
 def index():
-    """Renderizza la pagina principale del sito."""
-    return render_template('index.html')
+    """Renderizza la pagina principale del sito, con i numeri della dashboard letti dagli aggregati."""
+    current = month_index(datetime.now())
+    snapshot = repo.snapshot()
+    # Righe (etichetta, totali) delle tabelle, dal mese più recente
+    months = [(month_info(month).label, totals)
+              for month, totals in reversed(rollups.months(current - DASHBOARD_MONTHS + 1, current))]
+    clients = [(_record_name(snapshot, 'clients', key), totals) for key, totals in rollups.top('client', DASHBOARD_TOP)]
+    services = [(_record_name(snapshot, 'services', key), totals) for key, totals in rollups.top('service', DASHBOARD_TOP)]
+    agents = [(key or 'Senza agente', totals) for key, totals in rollups.top('agent', DASHBOARD_TOP)]
+    return render_template('index.html', totals=rollups.totals(), mrr=rollups.mrr(current), months=months,
+                           clients=clients, services=services, agents=agents, ready=rollups.ready)
+
+def _record_name(source, table, record_id):
+    record = source.get(table, record_id)
+    return record['name'] if record else '—'
     
 # --- Route per la Rubrica Clienti (vecchia, da rimuovere o reindirizzare se non più usata) ---
 @app.route('/rubrica')
 def show_address_book():
     """Renderizza la pagina con la rubrica dei clienti."""
-    # Passa la lista completa dei clienti al template
-    return render_template('address_book.html', clients=clients)
+    # Passa al template una pagina di clienti alla volta
+    page = list_page('clients', filter_fields=CLIENT_FILTERS, range_fields=DATE_RANGES)
+    return render_template('address_book.html', clients=page['records'], page=page)
 
 # --- Route per l'elenco dei clienti ---
 @app.route('/clients')
 def show_clients():
-    """Renderizza la pagina con la lista dei clienti."""
-    return render_template('clients.html', clients=clients)
+    """Renderizza la pagina con la lista dei clienti, filtrabile per faccette."""
+    page = list_page('clients', facet_fields=FACETS['clients'], range_fields=DATE_RANGES)
+    return render_template('clients.html', clients=page['records'], page=page)
 
 # --- Route per aggiungere un nuovo cliente ---
 @app.route('/add_client', methods=['GET', 'POST'])
@@ -181,22 +479,40 @@ def add_client():
         client_name = form_data.get('nome')
         
         if client_name:
-            new_client = {
-                'id': str(uuid.uuid4()),
-                'name': client_name,
-                'email': form_data.get('email', ''),
-                'phone': form_data.get('telefono', ''),
-                'vat_id': form_data.get('partita_iva', ''),
-                'address': form_data.get('indirizzo', ''),
-                'city': form_data.get('citta', ''),
-                'zip': form_data.get('cap', ''),
-                'sdi_code': form_data.get('codice_sdi', ''),
-                'agent': form_data.get('agente', ''),
-                'call_center': form_data.get('call_center', ''),
-                'contact': form_data.get('referente_aziendale', ''),
-                'created_at': datetime.now()
-            }
-            clients.append(new_client)
+            new_client = Client(
+                id=new_id(),
+                name=client_name,
+                email=form_data.get('email', ''),
+                phone=form_data.get('telefono', ''),
+                vat_id=form_data.get('partita_iva', ''),
+                address=form_data.get('indirizzo', ''),
+                city=form_data.get('citta', ''),
+                zip=form_data.get('cap', ''),
+                sdi_code=form_data.get('codice_sdi', ''),
+                agent=form_data.get('agente', ''),
+                call_center=form_data.get('call_center', ''),
+                contact=form_data.get('referente_aziendale', ''),
+                created_at=datetime.now()
+            )
+            try:
+                # Controllo dei duplicati e inserimento nella stessa transazione:
+                # nessun altro cliente può essere aggiunto nel mezzo
+                with repo.transaction() as tx:
+                    duplicates = repo.find_duplicates(new_client)
+                    same_keys = [match for match in duplicates if match[1] != 'name']
+                    if not same_keys and (not duplicates or form_data.get('conferma_duplicato')):
+                        new_client = tx.insert('clients', new_client)
+                        tx.on_commit(rollups.client_saved, new_client)
+                        duplicates = []
+            except IntegrityError:
+                flash('Errore: esiste già un cliente con questa email.', 'error')
+                return render_template('add_client.html', form_data=form_data)
+            if same_keys:
+                flash('Errore: esiste già un cliente con la stessa partita IVA o email.', 'error')
+                return render_template('add_client.html', form_data=form_data, duplicates=duplicates)
+            if duplicates:
+                flash('Attenzione: esistono clienti con un nome simile. Controlla e conferma per salvare comunque.', 'warning')
+                return render_template('add_client.html', form_data=form_data, duplicates=duplicates)
             flash(f'Cliente "{client_name}" aggiunto con successo!', 'success')
             return redirect(url_for('show_clients'))
         else:
@@ -206,70 +522,89 @@ def add_client():
 
 
 # --- Route per visualizzare i dettagli di un cliente e i suoi servizi ---
-@app.route('/clients/<string:client_id>')
+@app.route('/clients/<id:client_id>')
 def show_client(client_id):
     """
     Renderizza la pagina con i dettagli di un singolo cliente e la lista dei suoi servizi.
     """
-    client = next((item for item in clients if item['id'] == client_id), None)
+    # Tutte le letture della pagina avvengono sullo stesso snapshot coerente
+    snapshot = repo.snapshot()
+    client = snapshot.get('clients', client_id)
     if not client:
         flash('Cliente non trovato.', 'error')
         return redirect(url_for('show_clients'))
 
     client_services_with_details = []
-    for cs in client_services:
-        if cs['client_id'] == client_id:
-            service = next((s for s in services if s['id'] == cs['service_id']), None)
-            if service:
-                combined_service = {
-                    'id': cs['id'],
-                    'service': service,
-                    'subscribed_price': cs['subscribed_price'],
-                    'start_date': cs['start_date'],
-                    'end_date': cs['end_date'],
-                    'notes': cs['notes']
-                }
-                client_services_with_details.append(combined_service)
+    # Servizi del cliente e relativi servizi di catalogo in un solo passaggio sull'indice
+    for cs, service in snapshot.subscriptions_for_client(client_id):
+        combined_service = {
+            'id': cs['id'],
+            'service': service,
+            'subscribed_price': cs['subscribed_price'],
+            'start_date': cs['start_date'],
+            'end_date': cs['end_date'],
+            'notes': cs['notes']
+        }
+        client_services_with_details.append(combined_service)
 
     return render_template('client_detail.html', client=client, services=client_services_with_details)
 
 
 # --- Route per modificare un cliente esistente ---
-@app.route('/edit_client/<string:client_id>', methods=['GET', 'POST'])
+@app.route('/edit_client/<id:client_id>', methods=['GET', 'POST'])
 def edit_client(client_id):
     """
     Gestisce la modifica di un cliente.
     """
-    client = next((item for item in clients if item['id'] == client_id), None)
+    client = repo.get('clients', client_id)
 
     if not client:
         flash('Cliente non trovato.', 'error')
         return redirect(url_for('show_clients'))
 
     if request.method == 'POST':
-        client['name'] = request.form.get('name')
-        client['email'] = request.form.get('email')
-        client['phone'] = request.form.get('phone')
-        client['vat_id'] = request.form.get('vat_id')
-        client['address'] = request.form.get('address')
-        client['city'] = request.form.get('citta')
-        client['zip'] = request.form.get('cap')
-        client['sdi_code'] = request.form.get('sdi_code')
-        client['agent'] = request.form.get('agente')
-        client['call_center'] = request.form.get('call_center')
-        client['contact'] = request.form.get('referente_aziendale')
+        # Partita IVA ed email non possono coincidere con quelle di un altro cliente
+        keys = {'vat_id': request.form.get('vat_id'), 'email': request.form.get('email')}
+        try:
+            # Controllo e modifica nella stessa transazione, come in add_client:
+            # nessun altro cliente può prendere la stessa partita IVA o email nel mezzo
+            with repo.transaction() as tx:
+                same_keys = repo.find_duplicates(keys, exclude_id=client_id)
+                if not same_keys:
+                    client = tx.update('clients', client_id,
+                                       name=request.form.get('name'),
+                                       email=request.form.get('email'),
+                                       phone=request.form.get('phone'),
+                                       vat_id=request.form.get('vat_id'),
+                                       address=request.form.get('address'),
+                                       city=request.form.get('citta'),
+                                       zip=request.form.get('cap'),
+                                       sdi_code=request.form.get('sdi_code'),
+                                       agent=request.form.get('agente'),
+                                       call_center=request.form.get('call_center'),
+                                       contact=request.form.get('referente_aziendale'))
+                    if client:
+                        tx.on_commit(rollups.client_saved, client)
+        except IntegrityError:
+            flash('Errore: esiste già un cliente con questa email.', 'error')
+            return redirect(url_for('edit_client', client_id=client_id))
+        if same_keys:
+            flash(f'Errore: il cliente "{same_keys[0][0]["name"]}" ha già la stessa partita IVA o email.', 'error')
+            return redirect(url_for('edit_client', client_id=client_id))
         flash('Cliente modificato con successo!', 'success')
         return redirect(url_for('show_client', client_id=client_id))
 
     return render_template('edit_client.html', client=client)
 
 # --- Route per eliminare un cliente ---
-@app.route('/delete_client/<string:client_id>')
+@app.route('/delete_client/<id:client_id>')
 def delete_client(client_id):
     """Elimina un cliente dalla lista."""
-    global clients, client_services
-    clients = [client for client in clients if client['id'] != client_id]
-    client_services = [cs for cs in client_services if cs['client_id'] != client_id]
+    # Il repository elimina a cascata anche i servizi sottoscritti dal cliente
+    with repo.transaction() as tx:
+        cancel_cascaded_renewals(tx, 'clients', client_id)
+        tx.delete('clients', client_id)
+        tx.on_commit(rollups.client_deleted, client_id)
     flash('Cliente eliminato con successo!', 'success')
     return redirect(url_for('show_clients'))
 
@@ -277,7 +612,8 @@ def delete_client(client_id):
 @app.route('/services')
 def show_services():
     """Renderizza la pagina con la lista dei servizi."""
-    return render_template('services.html', services=services)
+    page = list_page('services')
+    return render_template('services.html', services=page['records'], page=page)
 
 @app.route('/add_service', methods=['GET', 'POST'])
 def add_service_route():
@@ -290,13 +626,13 @@ def add_service_route():
         service_description = request.form.get('description')
 
         if service_name and service_price and service_description:
-            new_service = {
-                'id': str(uuid.uuid4()),
-                'name': service_name,
-                'price': float(service_price),
-                'description': service_description
-            }
-            services.append(new_service)
+            new_service = Service(
+                id=new_id(),
+                name=service_name,
+                price=float(service_price),
+                description=service_description
+            )
+            repo.insert('services', new_service)
             flash('Servizio aggiunto con successo!', 'success')
             return redirect(url_for('show_services'))
         else:
@@ -304,59 +640,62 @@ def add_service_route():
             
     return render_template('add_service.html')
 
-@app.route('/services/<string:service_id>')
+@app.route('/services/<id:service_id>')
 def view_service_detail(service_id):
     """Renderizza la pagina con i dettagli di un singolo servizio."""
-    service = next((item for item in services if item['id'] == service_id), None)
+    service = repo.get('services', service_id)
     if service:
         return render_template('view_service.html', service=service)
     else:
         flash('Servizio non trovato.', 'error')
         return redirect(url_for('show_services'))
 
-@app.route('/edit_service/<string:service_id>', methods=['GET', 'POST'])
+@app.route('/edit_service/<id:service_id>', methods=['GET', 'POST'])
 def edit_service(service_id):
     """
     Gestisce la modifica di un servizio esistente.
     """
-    service = next((item for item in services if item['id'] == service_id), None)
+    service = repo.get('services', service_id)
 
     if not service:
         flash('Servizio non trovato.', 'error')
         return redirect(url_for('show_services'))
 
     if request.method == 'POST':
-        service['name'] = request.form.get('name')
-        service['price'] = float(request.form.get('price'))
-        service['description'] = request.form.get('description')
+        repo.update('services', service_id,
+                    name=request.form.get('name'),
+                    price=float(request.form.get('price')),
+                    description=request.form.get('description'))
         flash('Servizio modificato con successo!', 'success')
         return redirect(url_for('show_services'))
 
     return render_template('edit_service.html', service=service)
 
-@app.route('/delete_service/<string:service_id>')
+@app.route('/delete_service/<id:service_id>')
 def delete_service(service_id):
     """Elimina un servizio dalla lista."""
-    global services, client_services
-    services = [service for service in services if service['id'] != service_id]
-    client_services = [cs for cs in client_services if cs['service_id'] != service_id]
+    # Il repository elimina a cascata anche le sottoscrizioni del servizio
+    with repo.transaction() as tx:
+        cancel_cascaded_renewals(tx, 'services', service_id)
+        tx.delete('services', service_id)
+        tx.on_commit(rollups.service_deleted, service_id)
     flash('Servizio eliminato con successo!', 'success')
     return redirect(url_for('show_services'))
 
 
 # --- ROTTE PER LA GESTIONE DEI SERVIZI PER CLIENTE ---
-@app.route('/clients/<string:client_id>/add_service', methods=['GET', 'POST'])
+@app.route('/clients/<id:client_id>/add_service', methods=['GET', 'POST'])
 def add_client_service(client_id):
     """
     Gestisce l'associazione di un servizio a un cliente.
     """
-    client = next((c for c in clients if c['id'] == client_id), None)
+    client = repo.get('clients', client_id)
     if not client:
         flash('Cliente non trovato.', 'error')
         return redirect(url_for('show_clients'))
 
     if request.method == 'POST':
-        service_id = request.form.get('service_id')
+        service_id = parse_id(request.form.get('service_id'))
         subscribed_price = request.form.get('subscribed_price')
         start_date_str = request.form.get('start_date')
         end_date_str = request.form.get('end_date')
@@ -366,29 +705,40 @@ def add_client_service(client_id):
             flash('Compila tutti i campi obbligatori.', 'error')
             return redirect(url_for('add_client_service', client_id=client['id']))
 
+        # Il servizio arriva dal campo con completamento automatico: va verificato
+        if not repo.get('services', service_id):
+            flash('Servizio non trovato: sceglilo tra i suggerimenti.', 'error')
+            return redirect(url_for('add_client_service', client_id=client['id']))
+
         try:
             start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
             end_date = datetime.strptime(end_date_str, '%Y-%m-%d') if end_date_str else None
             subscribed_price = float(subscribed_price)
             
-            existing_service = next((cs for cs in client_services if cs['client_id'] == client_id and cs['service_id'] == service_id), None)
+            new_client_service = ClientService(
+                id=new_id(),
+                client_id=client_id,
+                service_id=service_id,
+                subscribed_price=subscribed_price,
+                start_date=start_date,
+                end_date=end_date,
+                notes=notes,
+                # Chiamiamo la funzione per inizializzare il campo monthly_details
+                monthly_details=generate_monthly_details(start_date, end_date if end_date else datetime.now())
+            )
+            # Controllo dei duplicati e inserimento nella stessa transazione,
+            # così due richieste concorrenti non possono aggiungere lo stesso servizio
+            with repo.transaction() as tx:
+                existing_service = tx.find_client_service(client_id, service_id)
+                if not existing_service:
+                    new_client_service = tx.insert('client_services', new_client_service)
+                    tx.on_commit(rollups.contract_saved, new_client_service)
+                    tx.on_commit(renewals.schedule, new_client_service)
 
             if existing_service:
                 flash('Questo servizio è già stato aggiunto a questo cliente.', 'error')
                 return redirect(url_for('add_client_service', client_id=client['id']))
 
-            new_client_service = {
-                'id': str(uuid.uuid4()),
-                'client_id': client_id,
-                'service_id': service_id,
-                'subscribed_price': subscribed_price,
-                'start_date': start_date,
-                'end_date': end_date,
-                'notes': notes,
-                # Chiamiamo la funzione per inizializzare il campo monthly_details
-                'monthly_details': generate_monthly_details(start_date, end_date if end_date else datetime.now())
-            }
-            client_services.append(new_client_service)
             flash('Servizio aggiunto con successo!', 'success')
             return redirect(url_for('show_client', client_id=client_id))
 
@@ -396,126 +746,533 @@ def add_client_service(client_id):
             flash(f'Errore nel formato dei dati: {e}', 'error')
             return redirect(url_for('add_client_service', client_id=client['id']))
 
-    return render_template('add_client_service.html', client=client, services=services)
+    return render_template('add_client_service.html', client=client)
 
 
-@app.route('/clients/<string:client_id>/edit_service/<string:client_service_id>', methods=['GET', 'POST'])
+@app.route('/clients/<id:client_id>/edit_service/<id:client_service_id>', methods=['GET', 'POST'])
 def edit_client_service(client_id, client_service_id):
     """
     Gestisce la modifica di un servizio già associato a un cliente.
     """
-    client = next((c for c in clients if c['id'] == client_id), None)
-    client_service = next((cs for cs in client_services if cs['id'] == client_service_id), None)
+    snapshot = repo.snapshot()
+    client = snapshot.get('clients', client_id)
+    client_service = snapshot.get('client_services', client_service_id)
 
     if not client or not client_service:
         flash('Cliente o servizio non trovato.', 'error')
         return redirect(url_for('show_clients'))
 
     if request.method == 'POST':
-        client_service['service_id'] = request.form.get('service_id')
-        client_service['subscribed_price'] = float(request.form.get('subscribed_price'))
         start_date_str = request.form.get('start_date')
         end_date_str = request.form.get('end_date')
-        client_service['notes'] = request.form.get('notes')
-        
-        client_service['start_date'] = datetime.strptime(start_date_str, '%Y-%m-%d')
-        client_service['end_date'] = datetime.strptime(end_date_str, '%Y-%m-%d') if end_date_str else None
-        
-        # Rigenera i dettagli mensili se le date sono cambiate
-        client_service['monthly_details'] = generate_monthly_details(
-            client_service['start_date'], 
-            client_service['end_date'] if client_service['end_date'] else datetime.now()
-        )
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d') if end_date_str else None
+
+        service_id = parse_id(request.form.get('service_id'))
+        if not snapshot.get('services', service_id):
+            flash('Servizio non trovato: sceglilo tra i suggerimenti.', 'error')
+            return redirect(url_for('edit_client_service', client_id=client_id, client_service_id=client_service_id))
+
+        # L'aggiornamento passa dal repository, che riallinea gli indici client_id/service_id.
+        # Lettura e scrittura nella stessa transazione: i dettagli mensili salvati
+        # nel frattempo non vengono persi.
+        with repo.transaction() as tx:
+            client_service = tx.get('client_services', client_service_id)
+            if client_service:
+                fields = dict(service_id=service_id,
+                              subscribed_price=float(request.form.get('subscribed_price')),
+                              notes=request.form.get('notes'),
+                              start_date=start_date,
+                              end_date=end_date)
+                # Se le date sono cambiate i mesi vengono riallineati per (anno, mese)
+                details = merged_monthly_details(client_service['monthly_details'], start_date, end_date)
+                if details is not client_service['monthly_details']:
+                    fields['monthly_details'] = details
+                client_service = tx.update('client_services', client_service_id, **fields)
+                tx.on_commit(rollups.contract_saved, client_service)
+                tx.on_commit(renewals.schedule, client_service)
+
+        if not client_service:
+            flash('Cliente o servizio non trovato.', 'error')
+            return redirect(url_for('show_clients'))
 
         flash('Servizio cliente modificato con successo!', 'success')
         return redirect(url_for('show_client', client_id=client_id))
 
-    return render_template('edit_client_service.html', client=client, client_service=client_service, available_services=services)
+    return render_template('edit_client_service.html', client=client, client_service=client_service,
+                           service=snapshot.get('services', client_service['service_id']))
 
-@app.route('/clients/<string:client_id>/delete_service/<string:client_service_id>', methods=['POST'])
+@app.route('/clients/<id:client_id>/delete_service/<id:client_service_id>', methods=['POST'])
 def delete_client_service(client_id, client_service_id):
     """
     Elimina un servizio associato a un cliente.
     """
-    global client_services
-    client_services = [cs for cs in client_services if cs['id'] != client_service_id]
+    with repo.transaction() as tx:
+        tx.delete('client_services', client_service_id)
+        tx.on_commit(rollups.contract_deleted, client_service_id)
+        tx.on_commit(renewals.cancel, client_service_id)
     flash('Servizio rimosso dal cliente con successo!', 'success')
     return redirect(url_for('show_client', client_id=client_id))
 
 
 # --- NUOVA ROTTA PER VISUALIZZARE UN SERVIZIO CLIENTE ---
-@app.route('/clients/<string:client_id>/view_service/<string:client_service_id>')
+@app.route('/clients/<id:client_id>/view_service/<id:client_service_id>')
 def view_client_service(client_id, client_service_id):
     """
     Renderizza la pagina con i dettagli di un servizio associato a un cliente.
     """
-    client = next((c for c in clients if c['id'] == client_id), None)
-    client_service = next((cs for cs in client_services if cs['id'] == client_service_id), None)
+    snapshot = repo.snapshot()
+    client = snapshot.get('clients', client_id)
+    client_service = snapshot.get('client_services', client_service_id)
 
     if not client or not client_service:
         flash('Cliente o servizio associato non trovato.', 'error')
         return redirect(url_for('show_clients'))
 
-    service = next((s for s in services if s['id'] == client_service['service_id']), None)
+    service = snapshot.get('services', client_service['service_id'])
     
     if not service:
         flash('Dettagli del servizio non trovati.', 'error')
         return redirect(url_for('show_client', client_id=client_id))
 
-    return render_template('view_client_service.html', client=client, client_service=client_service, service=service)
+    return render_template('view_client_service.html', client=client, client_service=client_service, service=service,
+                           monthly_details=current_monthly_details(client_service))
 
 # --- NUOVA ROTTA: Gestisce il salvataggio delle note mensili e delle ore lavorate ---
-@app.route('/clients/<string:client_id>/save_monthly_notes/<string:client_service_id>', methods=['POST'])
+@app.route('/clients/<id:client_id>/save_monthly_notes/<id:client_service_id>', methods=['POST'])
 def save_monthly_notes(client_id, client_service_id):
     """
     Salva le note mensili, le ore lavorate e l'importo pagato inviate tramite il form.
     """
-    client_service = next((cs for cs in client_services if cs['id'] == client_service_id), None)
+    # Lettura, modifica e scrittura avvengono nella stessa transazione:
+    # due salvataggi concorrenti non possono sovrascriversi a vicenda.
+    with repo.transaction() as tx:
+        client_service = tx.get('client_services', client_service_id)
+        if client_service:
+            # I mesi mostrati ma non ancora salvati (contratti in corso) diventano persistenti qui
+            monthly_details = _apply_monthly_form(current_monthly_details(client_service), request.form)
+            client_service = tx.update('client_services', client_service_id, monthly_details=monthly_details)
+            tx.on_commit(rollups.contract_saved, client_service)
+
     if not client_service:
         flash('Servizio cliente non trovato.', 'error')
         return redirect(url_for('show_client', client_id=client_id))
-    
-    for i, month_data in enumerate(client_service['monthly_details']):
-        notes_field_name = f"note_{month_data['year']}_{month_data['month']}"
-        hours_field_name = f"hours_{month_data['year']}_{month_data['month']}"
-        amount_paid_field_name = f"amount_paid_{month_data['year']}_{month_data['month']}"
-        estimated_hours_field_name = f"estimated_hours_{month_data['year']}_{month_data['month']}"
-        
-        new_notes = request.form.get(notes_field_name)
-        new_hours_worked = request.form.get(hours_field_name)
-        new_amount_paid = request.form.get(amount_paid_field_name)
-        new_estimated_hours = request.form.get(estimated_hours_field_name)
 
-        if new_notes is not None:
-            client_service['monthly_details'][i]['notes'] = new_notes
-        
+
+    flash('Dettagli mensili salvati con successo!', 'success')
+    return redirect(url_for('view_client_service', client_id=client_id, client_service_id=client_service_id))
+
+def _apply_monthly_form(details, form):
+    """
+    Restituisce una copia dei dettagli mensili con i valori inviati dal form.
+    I record pubblicati nel repository non vengono mai modificati sul posto.
+    """
+    cells = []
+    for offset, month_data in enumerate(details):
+        suffix = f"{month_data.year}_{month_data.month}"
+
+        new_notes = form.get(f"note_{suffix}")
+        new_hours_worked = form.get(f"hours_{suffix}")
+        new_amount_paid = form.get(f"amount_paid_{suffix}")
+        new_estimated_hours = form.get(f"estimated_hours_{suffix}")
+
+        if new_notes is not None and new_notes != month_data.notes:
+            cells.append((offset, 'notes', new_notes))
+
         if new_hours_worked is not None:
             try:
-                client_service['monthly_details'][i]['hours_worked'] = float(new_hours_worked)
+                cells.append((offset, 'hours_worked', float(new_hours_worked)))
             except ValueError:
-                flash(f"Errore: Il valore inserito per le ore di {month_data['month_name']} non è un numero valido.", 'error')
+                flash(f"Errore: Il valore inserito per le ore di {month_data.month_name} non è un numero valido.", 'error')
 
         if new_amount_paid is not None:
             try:
-                client_service['monthly_details'][i]['amount_paid'] = float(new_amount_paid)
+                cells.append((offset, 'amount_paid', float(new_amount_paid)))
             except ValueError:
-                flash(f"Errore: Il valore inserito per l'importo di {month_data['month_name']} non è un numero valido.", 'error')
-                
+                flash(f"Errore: Il valore inserito per l'importo di {month_data.month_name} non è un numero valido.", 'error')
+
         if new_estimated_hours is not None:
             try:
-                client_service['monthly_details'][i]['estimated_hours'] = float(new_estimated_hours)
+                cells.append((offset, 'estimated_hours', float(new_estimated_hours)))
             except ValueError:
-                flash(f"Errore: Il valore inserito per le ore preventivate di {month_data['month_name']} non è un numero valido.", 'error')
+                flash(f"Errore: Il valore inserito per le ore preventivate di {month_data.month_name} non è un numero valido.", 'error')
 
+    return details.updated(cells)
 
-    flash('Dettagli mensili salvati con successo!', 'success')
-    return redirect(url_for('view_client_service', client_id=client_id, client_service_id=client_service_id))
+# Numero massimo di celle accettate in un solo salvataggio
+MONTH_CELLS_LIMIT = 1000
+
+@app.route('/clients/<id:client_id>/monthly_details/<id:client_service_id>', methods=['PATCH'])
+def patch_monthly_details(client_id, client_service_id):
+    """
+    Salva solo le celle modificate dei dettagli mensili, inviate in JSON come
+    {"cells": [{"year": 2024, "month": 3, "field": "hours_worked", "value": 12.5}, ...]}.
+    Le celle sono validate tutte insieme: se anche una sola non è valida non
+    viene salvato nulla e la risposta (422) riporta l'errore di ogni cella.
+    """
+    payload = request.get_json(silent=True)
+    cells = payload.get('cells') if isinstance(payload, dict) else None
+    if not isinstance(cells, list) or not cells:
+        return jsonify({'error': 'Nessuna cella da salvare.'}), 400
+    if len(cells) > MONTH_CELLS_LIMIT:
+        return jsonify({'error': f'Troppe celle in un solo salvataggio (massimo {MONTH_CELLS_LIMIT}).'}), 400
+
+    with repo.transaction() as tx:
+        client_service = tx.get('client_services', client_service_id)
+        if not client_service:
+            return jsonify({'error': 'Servizio cliente non trovato.'}), 404
+        # Come per il form, i mesi mostrati ma non ancora salvati diventano persistenti qui
+        details = current_monthly_details(client_service)
+        changes, errors = _parse_month_cells(details, cells)
+        if errors:
+            return jsonify({'errors': errors}), 422
+        details = tx.update_months(client_service_id, details, changes)
+        tx.on_commit(rollups.contract_saved, client_service.replace(monthly_details=details))
+
+    return jsonify({'saved': len(changes)})
+
+def _parse_month_cells(details, cells):
+    """
+    Converte le celle inviate in (posizione, campo, valore) per MonthlyLedger.updated().
+    Restituisce le modifiche e l'elenco degli errori, uno per cella non valida.
+    """
+    changes = []
+    errors = []
+    for index, cell in enumerate(cells):
+        if not isinstance(cell, dict):
+            errors.append({'index': index, 'error': 'Cella non valida.'})
+            continue
+        year, month, field, value = cell.get('year'), cell.get('month'), cell.get('field'), cell.get('value')
+        error = None
+        offset = None
+        if field not in MONTH_FIELDS:
+            error = 'Campo non valido.'
+        elif type(year) is not int or type(month) is not int or not 1 <= month <= 12:
+            error = 'Mese non valido.'
+        else:
+            offset = details.offset(year, month)
+            if offset is None:
+                error = 'Il mese non fa parte del contratto.'
+        if error is None:
+            if field == 'notes':
+                if not isinstance(value, str):
+                    error = 'Le note devono essere un testo.'
+            else:
+                try:
+                    value = float(value.replace(',', '.') if isinstance(value, str) else value)
+                except (TypeError, ValueError):
+                    value = None
+                if value is None or not math.isfinite(value):
+                    error = 'Il valore inserito non è un numero valido.'
+        if error:
+            errors.append({'index': index, 'year': year, 'month': month, 'field': field, 'error': error})
+        else:
+            changes.append((offset, field, value))
+    return changes, errors
+
+# --- Chiusura del mese: ore e pagamenti di tutti i contratti attivi in una pagina ---
+# Colonne modificabili della griglia
+MONTH_CLOSE_FIELDS = (
+    ('estimated_hours', 'Ore preventivate'),
+    ('hours_worked', 'Ore lavorate'),
+    ('amount_paid', 'Importo pagato'),
+)
+
+@app.route('/month_close')
+def month_close_current():
+    """Apre la chiusura del mese corrente."""
+    today = datetime.now()
+    return redirect(url_for('month_close', year=today.year, month=today.month))
+
+@app.route('/month_close/<int:year>/<int:month>', methods=['GET', 'POST'])
+def month_close(year, month):
+    """
+    Griglia con ore preventivate, ore lavorate e importo pagato del mese per
+    ogni contratto attivo. Il salvataggio scrive tutte le celle modificate in
+    una sola transazione; se un valore non è valido non viene salvato nulla.
+    """
+    if not 1 <= month <= 12:
+        flash('Mese non valido.', 'error')
+        return redirect(url_for('month_close_current'))
+
+    errors = {}
+    if request.method == 'POST':
+        with repo.transaction() as tx:
+            rows = _month_close_rows(tx, year, month)
+            changes = []
+            for row in rows:
+                if row['offset'] is None:
+                    continue
+                cs_id = row['client_service']['id']
+                names = {field: f'{field}-{format_id(cs_id)}' for field, _ in MONTH_CLOSE_FIELDS}
+                cells = [{'year': year, 'month': month, 'field': field, 'value': request.form[name]}
+                         for field, name in names.items() if name in request.form]
+                cells, cell_errors = _parse_month_cells(row['details'], cells)
+                if cell_errors:
+                    errors[cs_id] = {error['field'] for error in cell_errors}
+                    continue
+                month_data = row['details'][row['offset']]
+                cells = [cell for cell in cells if cell[2] != month_data[cell[1]]]
+                if cells:
+                    changes.append((row, cells))
+            if not errors:
+                for row, cells in changes:
+                    details = tx.update_months(row['client_service']['id'], row['details'], cells)
+                    tx.on_commit(rollups.contract_saved, row['client_service'].replace(monthly_details=details))
+        if not errors:
+            flash(f'Chiusura del mese salvata: {len(changes)} contratti aggiornati.', 'success')
+            return redirect(url_for('month_close', year=year, month=month))
+        flash('Alcuni valori non sono numeri validi: nessuna modifica salvata.', 'error')
+    else:
+        rows = _month_close_rows(repo.snapshot(), year, month)
+
+    previous = (year - 1, 12) if month == 1 else (year, month - 1)
+    following = (year + 1, 1) if month == 12 else (year, month + 1)
+    return render_template('month_close.html', rows=rows, year=year, month=month,
+                           month_name=ITALIAN_MONTHS[month - 1], fields=MONTH_CLOSE_FIELDS,
+                           previous=previous, following=following,
+                           values=request.form if errors else None, errors=errors)
+
+def _month_close_rows(source, year, month):
+    """
+    Contratti attivi nel mese (tramite l'indice dei periodi) con cliente,
+    servizio, dettagli mensili e posizione del mese nei dettagli (None se il
+    mese non è coperto), ordinati per cliente e servizio.
+    """
+    entry = month_info(year * 12 + month - 1)
+    start = entry.first_day
+    end = entry.last_day + timedelta(days=1, microseconds=-1)
+    rows = []
+    for client_service in source.client_services_active(start, end):
+        # Per i contratti aperti il mese scelto può essere successivo a oggi
+        details = current_monthly_details(client_service, today=max(datetime.now(), start))
+        client = source.get('clients', client_service['client_id'])
+        service = source.get('services', client_service['service_id'])
+        rows.append({
+            'client_service': client_service,
+            'client': client,
+            'service': service,
+            'details': details,
+            'offset': details.offset(year, month),
+        })
+    rows.sort(key=lambda row: ((row['client'] or {}).get('name', '').casefold(),
+                               (row['service'] or {}).get('name', '').casefold()))
+    return rows
+
+# --- Report sui contratti di un periodo ---
+# Righe mostrate per ciascuna tabella del report (i totali contano tutti i contratti)
+REPORT_ROWS_LIMIT = 200
+
+@app.route('/reports')
+def reports():
+    """
+    Contratti attivi e in scadenza in un periodo (?from=AAAA-MM-GG&to=AAAA-MM-GG,
+    di default il mese corrente), con ore e importi pagati nei mesi del periodo.
+    Entrambi gli elenchi arrivano dagli indici sui periodi dei contratti.
+    """
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    presets = _report_presets(today)
+    try:
+        start = datetime.strptime(request.args['from'], '%Y-%m-%d')
+        end = datetime.strptime(request.args['to'], '%Y-%m-%d')
+    except (KeyError, ValueError):
+        if 'from' in request.args or 'to' in request.args:
+            flash('Periodo non valido: viene mostrato il mese corrente.', 'error')
+        start, end = presets[1][1], presets[1][2]
+    if end < start:
+        start, end = end, start
+    # Il giorno finale è compreso per intero
+    last_moment = end + timedelta(days=1, microseconds=-1)
+
+    snapshot = repo.snapshot()
+    active = snapshot.client_services_active(start, last_moment)
+    ending = snapshot.client_services_ending(start, last_moment)
+    first_month, last_month = month_index(start), month_index(end)
+    totals = {field: 0.0 for field, _ in MONTH_CLOSE_FIELDS}
+    for client_service in active:
+        details = current_monthly_details(client_service)
+        for field in totals:
+            totals[field] += details.total(field, first_month, last_month)
+
+    return render_template('reports.html', start=start, end=end, presets=presets, totals=totals,
+                           fields=MONTH_CLOSE_FIELDS, first_month=first_month, last_month=last_month,
+                           active_count=len(active), ending_count=len(ending),
+                           active=_report_rows(snapshot, active[:REPORT_ROWS_LIMIT]),
+                           ending=_report_rows(snapshot, ending[:REPORT_ROWS_LIMIT]),
+                           limit=REPORT_ROWS_LIMIT)
+
+def _report_presets(today):
+    """Periodi proposti nel report: (etichetta, inizio, fine)."""
+    current = month_of(today)
+    following = month_info(current.index + 1)
+    quarter = current.index - (current.month - 1) % 3
+    return [
+        ('Oggi', today, today),
+        ('Questo mese', current.first_day, current.last_day),
+        ('Mese prossimo', following.first_day, following.last_day),
+        ('Trimestre corrente', month_info(quarter).first_day, month_info(quarter + 2).last_day),
+        ("Quest'anno", today.replace(month=1, day=1), today.replace(month=12, day=31)),
+    ]
+
+def _report_rows(source, client_services):
+    """Servizi cliente del report con il cliente, il servizio di catalogo e i dettagli mensili."""
+    return [{
+        'client_service': client_service,
+        'client': source.get('clients', client_service['client_id']),
+        'service': source.get('services', client_service['service_id']),
+        'details': current_monthly_details(client_service),
+    } for client_service in client_services]
+
+# --- Analisi di ore e incassi dei mesi-contratto ---
+# Raggruppamenti proposti nella pagina di analisi
+ANALYTICS_GROUPS = (
+    ('client', 'Cliente'),
+    ('service', 'Servizio'),
+    ('agent', 'Agente'),
+    ('month', 'Mese'),
+    ('contract', 'Contratto'),
+)
+
+# Misure per cui si può ordinare la tabella
+ANALYTICS_SORTS = (
+    ('overrun', 'Sforamento ore'),
+    ('hourly_rate', 'Tariffa oraria'),
+    ('collection_rate', 'Tasso di incasso'),
+    ('amount_paid', 'Importo pagato'),
+)
+
+# Mesi analizzati di default (fino al mese corrente) e righe mostrate
+ANALYTICS_MONTHS = 12
+ANALYTICS_ROWS_LIMIT = 50
+
+@app.route('/analytics')
+def analytics_report():
+    """
+    Sforamento delle ore, tariffa oraria realizzata e tasso di incasso dei
+    mesi da ?from= a ?to= (AAAA-MM), raggruppati per ?by= e ordinati per ?sort=.
+    I calcoli sono vettoriali sulle colonne di tutti i mesi-contratto.
+    """
+    if not analytics.AVAILABLE:
+        flash("L'analisi richiede il pacchetto numpy, non installato sul server.", 'error')
+        return redirect(url_for('reports'))
+    current = month_index(datetime.now())
+    first = _month_arg('from', current - ANALYTICS_MONTHS + 1)
+    last = _month_arg('to', current)
+    if last < first:
+        first, last = last, first
+    by = request.args.get('by', 'client')
+    if by not in dict(ANALYTICS_GROUPS):
+        by = 'client'
+    sort = request.args.get('sort', 'overrun')
+    if sort not in dict(ANALYTICS_SORTS):
+        sort = 'overrun'
+    descending = request.args.get('order') != 'asc'
+
+    context = dict(groups=ANALYTICS_GROUPS, sorts=ANALYTICS_SORTS, by=by, sort=sort, descending=descending,
+                   first='{:04d}-{:02d}'.format(*year_month(first)), last='{:04d}-{:02d}'.format(*year_month(last)),
+                   ready=rollups.ready)
+    if not rollups.ready:
+        return render_template('analytics.html', **context)
+
+    packed = contract_months()
+    grouped = packed.grouped(by, first, last)
+    snapshot = repo.snapshot()
+    rows = []
+    for position in analytics.top(grouped, sort, ANALYTICS_ROWS_LIMIT, descending):
+        row = {name: _number(grouped[name][position]) for name in analytics.MEASURES}
+        for quantile in analytics.QUANTILES:
+            row[f'p{quantile}'] = _number(grouped[f'p{quantile}'][position])
+        row['label'], row['url'] = _analytics_label(snapshot, by, grouped['key'][position])
+        rows.append(row)
+    return render_template('analytics.html', rows=rows, count=len(grouped['key']),
+                           totals=packed.totals(first, last), quantiles=analytics.QUANTILES, **context)
+
+def _month_arg(name, default):
+    """Mese della query string (AAAA-MM) come numero progressivo."""
+    try:
+        return month_index(datetime.strptime(request.args[name], '%Y-%m'))
+    except (KeyError, ValueError):
+        return default
+
+def _number(value):
+    """Valore numpy come float, None se non definito (NaN)."""
+    value = float(value)
+    return None if math.isnan(value) else value
+
+def _analytics_label(source, by, key):
+    """Etichetta e collegamento (se c'è) di un gruppo dell'analisi."""
+    if by == 'client':
+        return _record_name(source, 'clients', key), url_for('show_client', client_id=key)
+    if by == 'service':
+        return _record_name(source, 'services', key), None
+    if by == 'agent':
+        return key or 'Senza agente', None
+    if by == 'month':
+        entry = month_info(key)
+        return entry.label, url_for('month_close', year=entry.year, month=entry.month)
+    client_service = source.get('client_services', key)
+    if client_service is None:
+        return '—', None
+    label = '{} · {}'.format(_record_name(source, 'clients', client_service['client_id']),
+                             _record_name(source, 'services', client_service['service_id']))
+    return label, url_for('view_client_service', client_id=client_service['client_id'], client_service_id=key)
+
+# --- Rinnovi: promemoria scattati e contratti in scadenza ---
+# Orizzonte di default (in giorni) dell'elenco dei contratti in scadenza
+EXPIRING_DAYS = 60
+
+@app.route('/renewals')
+def show_renewals():
+    """
+    Rinnovi da gestire (contratti entrati nel periodo di preavviso) e contratti
+    in scadenza nei prossimi ?days= giorni, letti dalla coda delle scadenze.
+    """
+    days = request.args.get('days', EXPIRING_DAYS, type=int)
+    if not 1 <= days <= 366:
+        days = EXPIRING_DAYS
+    snapshot = repo.snapshot()
+    pending = _renewal_rows(snapshot, renewals.pending())
+    expiring = _renewal_rows(snapshot, renewals.expiring(datetime.now(), days))
+    return render_template('renewals.html', pending=pending, expiring=expiring, days=days,
+                           notice_days=renewals.notice.days, today=datetime.now())
+
+@app.route('/renewals/<id:client_service_id>/dismiss', methods=['POST'])
+def dismiss_renewal(client_service_id):
+    """Segna come gestito il rinnovo di un contratto."""
+    if renewals.dismiss(client_service_id):
+        flash('Rinnovo segnato come gestito.', 'success')
+    else:
+        flash('Rinnovo non trovato.', 'error')
+    return redirect(url_for('show_renewals'))
+
+def _renewal_rows(source, entries):
+    """
+    Righe dell'elenco dei rinnovi da coppie (fine, id). I contratti eliminati
+    o modificati senza passare dalle rotte dei servizi cliente (per esempio
+    con l'eliminazione del cliente) vengono riallineati nella coda e saltati.
+    """
+    rows = []
+    for end_date, client_service_id in entries:
+        client_service = source.get('client_services', client_service_id)
+        if client_service is None:
+            renewals.cancel(client_service_id)
+            continue
+        if client_service.get('end_date') != end_date:
+            renewals.schedule(client_service)
+            continue
+        rows.append({
+            'client_service': client_service,
+            'client': source.get('clients', client_service['client_id']),
+            'service': source.get('services', client_service['service_id']),
+        })
+    return rows
 
 # --- NUOVE ROTTE PER LA GESTIONE DEI COLLABORATORI ---
 @app.route('/collaboratori')
 def show_collaborators():
     """Renderizza la pagina con la rubrica dei collaboratori."""
-    return render_template('collaborators.html', collaborators=collaborators)
+    page = list_page('collaborators')
+    return render_template('collaborators.html', collaborators=page['records'], page=page)
 
 @app.route('/add_collaborator', methods=['GET', 'POST'])
 def add_collaborator():
@@ -525,14 +1282,14 @@ def add_collaborator():
         name = form_data.get('name')
         
         if name:
-            new_collaborator = {
-                'id': str(uuid.uuid4()),
-                'name': name,
-                'role': form_data.get('role', ''),
-                'email': form_data.get('email', ''),
-                'phone': form_data.get('phone', '')
-            }
-            collaborators.append(new_collaborator)
+            new_collaborator = Collaborator(
+                id=new_id(),
+                name=name,
+                role=form_data.get('role', ''),
+                email=form_data.get('email', ''),
+                phone=form_data.get('phone', '')
+            )
+            repo.insert('collaborators', new_collaborator)
             flash(f'Collaboratore "{name}" aggiunto con successo!', 'success')
             return redirect(url_for('show_collaborators'))
         else:
@@ -544,7 +1301,8 @@ def add_collaborator():
 @app.route('/prospects')
 def show_prospects():
     """Renderizza la pagina con la lista dei potenziali clienti."""
-    return render_template('prospects.html', prospects=prospects)
+    page = list_page('prospects', range_fields=DATE_RANGES)
+    return render_template('prospects.html', prospects=page['records'], page=page)
 
 @app.route('/add_prospect', methods=['GET', 'POST'])
 def add_prospect():
@@ -559,63 +1317,141 @@ def add_prospect():
         prospect_name = form_data.get('name')
         
         if prospect_name:
-            new_prospect = {
-                'id': str(uuid.uuid4()),
-                'name': prospect_name,
-                'contact': form_data.get('contact', ''), # Nuovo campo referente aziendale
-                'email': form_data.get('email', ''),
-                'phone': form_data.get('phone', ''),
-                'notes': form_data.get('notes', ''), # Nuovo campo note
-                'preventivo': form_data.get('preventivo', ''), # Nuovo campo preventivo
-                'graphic_quote_link': form_data.get('graphic_quote_link', ''), # NUOVO CAMPO: link preventivo grafico
-                'created_at': datetime.now() # Data di creazione
-            }
-            prospects.append(new_prospect)
+            new_prospect = Prospect(
+                id=new_id(),
+                name=prospect_name,
+                contact=form_data.get('contact', ''), # Nuovo campo referente aziendale
+                email=form_data.get('email', ''),
+                phone=form_data.get('phone', ''),
+                notes=form_data.get('notes', ''), # Nuovo campo note
+                preventivo=form_data.get('preventivo', ''), # Nuovo campo preventivo
+                graphic_quote_link=form_data.get('graphic_quote_link', ''), # NUOVO CAMPO: link preventivo grafico
+                created_at=datetime.now() # Data di creazione
+            )
+            repo.insert('prospects', new_prospect)
             flash(f'Potenziale Cliente "{prospect_name}" aggiunto con successo!', 'success')
             return redirect(url_for('show_prospects'))
         else:
             flash('Errore: Il campo "Nome" è obbligatorio.', 'error')
     return render_template('add_prospect.html', form_data=form_data)
 
-@app.route('/edit_prospect/<string:prospect_id>', methods=['GET', 'POST'])
+@app.route('/edit_prospect/<id:prospect_id>', methods=['GET', 'POST'])
 def edit_prospect(prospect_id):
     """
     Gestisce la modifica di un potenziale cliente esistente.
     """
-    prospect = next((item for item in prospects if item['id'] == prospect_id), None)
+    prospect = repo.get('prospects', prospect_id)
 
     if not prospect:
         flash('Potenziale Cliente non trovato.', 'error')
         return redirect(url_for('show_prospects'))
 
     if request.method == 'POST':
-        prospect['name'] = request.form.get('name')
-        prospect['contact'] = request.form.get('contact')
-        prospect['email'] = request.form.get('email')
-        prospect['phone'] = request.form.get('phone')
-        prospect['notes'] = request.form.get('notes')
-        prospect['preventivo'] = request.form.get('preventivo')
-        prospect['graphic_quote_link'] = request.form.get('graphic_quote_link') # Salva il campo preventivo grafico
+        repo.update('prospects', prospect_id,
+                    name=request.form.get('name'),
+                    contact=request.form.get('contact'),
+                    email=request.form.get('email'),
+                    phone=request.form.get('phone'),
+                    notes=request.form.get('notes'),
+                    preventivo=request.form.get('preventivo'),
+                    graphic_quote_link=request.form.get('graphic_quote_link')) # Salva il campo preventivo grafico
         flash('Potenziale Cliente modificato con successo!', 'success')
         return redirect(url_for('show_prospects'))
 
     return render_template('edit_prospect.html', prospect=prospect)
 
-@app.route('/delete_prospect/<string:prospect_id>')
+@app.route('/delete_prospect/<id:prospect_id>')
 def delete_prospect(prospect_id):
     """Elimina un potenziale cliente dalla lista."""
-    global prospects
-    prospects = [p for p in prospects if p['id'] != prospect_id]
+    repo.delete('prospects', prospect_id)
     flash('Potenziale Cliente eliminato con successo!', 'success')
     return redirect(url_for('show_prospects'))
 
-# --- NUOVO: Aggiungiamo un'entry point per Firebase Cloud Functions ---
-@https_fn.on_request()
-def flask_app(req: Request):
+# --- Eliminazione multipla ---
+# Pagina di ritorno per ogni tabella che supporta l'eliminazione multipla
+BULK_DELETE_REDIRECTS = {
+    'clients': 'show_clients',
+    'services': 'show_services',
+    'prospects': 'show_prospects',
+    'collaborators': 'show_collaborators',
+}
+
+@app.route('/bulk_delete/<string:table>', methods=['POST'])
+def bulk_delete(table):
     """
-    Questo è il punto di ingresso per Firebase Functions.
-    Tutte le richieste HTTP verranno gestite da questa funzione,
-    che a sua volta le passerà all'applicazione Flask.
+    Elimina in un solo passaggio tutti i record selezionati (campo 'ids' ripetuto).
+    Clienti e servizi vengono eliminati a cascata insieme alle sottoscrizioni collegate.
     """
-    with app.request_context(req.environ):
-        return app.full_dispatch_request()
+    if table not in BULK_DELETE_REDIRECTS:
+        flash('Tipo di elemento non valido.', 'error')
+        return redirect(url_for('index'))
+
+    record_ids = [record_id for record_id in map(parse_id, request.form.getlist('ids')) if record_id is not None]
+    if not record_ids:
+        flash('Nessun elemento selezionato.', 'error')
+        return redirect(url_for(BULK_DELETE_REDIRECTS[table]))
+
+    with repo.transaction() as tx:
+        for record_id in record_ids:
+            cancel_cascaded_renewals(tx, table, record_id)
+        removed = tx.delete_many(table, record_ids)
+        for record in removed:
+            if table == 'clients':
+                tx.on_commit(rollups.client_deleted, record['id'])
+            elif table == 'services':
+                tx.on_commit(rollups.service_deleted, record['id'])
+    flash(f'{len(removed)} elementi eliminati con successo!', 'success')
+    return redirect(url_for(BULK_DELETE_REDIRECTS[table]))
+
+# --- Comandi da riga di comando ---
+@app.cli.command('save-snapshot')
+@click.argument('path')
+def save_snapshot_command(path):
+    """Salva i dati correnti in uno snapshot msgpack (da usare con CRM_SNAPSHOT)."""
+    size = save_snapshot(path, repo.snapshot())
+    click.echo(f'Snapshot salvato in {path} ({size} byte).')
+
+@app.cli.command('import-data')
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--batch-size', default=BATCH_SIZE, show_default=True, help='Record per transazione.')
+@click.option('--table', type=click.Choice(['clients', 'services']),
+              help='Tabella di destinazione dei file JSON (altrimenti dedotta dal nome del file).')
+def import_data_command(paths, batch_size, table):
+    """
+    Importa clients.json, services.json e le vecchie basi di dati SQLite (database.db, manager.db, mycrm.db).
+
+    Con il backend in memoria serve CRM_DATA_DIR, altrimenti i dati importati
+    andrebbero persi all'uscita del comando; il server che usa la stessa
+    cartella va fermato prima (il journal è bloccato dal processo che lo usa).
+    """
+    if app.config['CRM_BACKEND'] != 'sqlite' and not app.config['CRM_DATA_DIR']:
+        raise click.ClickException('con il backend in memoria imposta CRM_DATA_DIR: '
+                                   'senza cartella dati l\'importazione andrebbe persa.')
+
+    def progress(stats):
+        click.echo(f'  {stats.table}: {stats.read} letti ({stats.rate:,.0f} record/s)\r', nl=False)
+
+    importer = Importer(repo, batch_size=batch_size, progress=progress)
+    for path in paths:
+        for stats in importer.import_path(path, table):
+            click.echo(stats)
+
+@app.cli.command('check-renewals')
+def check_renewals_command():
+    """Elenca i contratti entrati nel periodo di preavviso (da eseguire periodicamente)."""
+    renewals.tick(datetime.now())
+    for end_date, client_service_id in renewals.pending():
+        click.echo(f'{end_date:%d/%m/%Y}  contratto {format_id(client_service_id)}')
+    click.echo(f'{len(renewals.pending())} rinnovi da gestire, {len(renewals)} contratti in coda.')
+
+# --- NUOVO: Aggiungiamo un'entry point per Firebase Cloud Functions ---
+if https_fn is not None:
+    @https_fn.on_request()
+    def flask_app(req: https_fn.Request):
+        """
+        Questo è il punto di ingresso per Firebase Functions.
+        Tutte le richieste HTTP verranno gestite da questa funzione,
+        che a sua volta le passerà all'applicazione Flask.
+        """
+        with app.request_context(req.environ):
+            return app.full_dispatch_request()
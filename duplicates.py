@@ -0,0 +1,248 @@
+# Rilevamento dei clienti duplicati.
+# - Duplicati certi: stessa partita IVA o stessa email, dopo la normalizzazione
+#   (maiuscole, senza spazi e punteggiatura, senza il prefisso IT per la partita
+#   IVA; minuscole per l'email). Sono due indici hash valore -> id.
+# - Possibili duplicati: nomi simili, confrontati come insiemi di trigrammi
+#   (similarità di Jaccard) dopo aver tolto accenti, punteggiatura e forme
+#   societarie ("Beta S.r.l." e "BETA srl" diventano entrambi "beta").
+#
+# Per i nomi si usa il filtro sui prefissi (blocking): i trigrammi hanno un
+# ordine globale, dal più raro al più comune, e ogni nome è indicizzato solo con
+# i suoi primi n - ceil(NAME_SIMILARITY * n) + PREFIX_OVERLAP trigrammi in
+# quell'ordine (n = numero dei suoi trigrammi). Due nomi con similarità
+# >= NAME_SIMILARITY hanno per forza almeno PREFIX_OVERLAP trigrammi in comune
+# tra i rispettivi prefissi: i candidati sono le intersezioni a coppie delle
+# liste dei trigrammi del prefisso cercato (operazioni sugli insiemi, senza
+# cicli Python sui singoli id) e solo questi vengono verificati. Essendo
+# trigrammi rari, il costo per inserimento non cresce con il numero di clienti.
+#
+# L'ordine non può cambiare per i nomi già indicizzati: i trigrammi nuovi vengono
+# messi in testa (più rari di tutti) e quando i nomi indicizzati raddoppiano
+# l'ordine viene ricalcolato sulle frequenze reali e l'indice ricostruito
+# (costo ammortizzato lineare, anche per le importazioni in blocco).
+#
+# Come SearchIndex, l'indice è aggiornato dal Repository a ogni commit (sotto
+# il lock di scrittura) e ha un lock proprio per i lettori.
+from math import ceil
+import re
+import threading
+
+from search import normalize
+
+# Tabella controllata
+DUPLICATE_TABLE = 'clients'
+
+# Similarità minima tra i trigrammi di due nomi per segnalarli come possibili duplicati
+NAME_SIMILARITY = 0.6
+
+# Numero massimo di possibili duplicati restituiti
+DUPLICATE_LIMIT = 5
+
+# Trigrammi in comune richiesti tra i prefissi di due nomi simili
+PREFIX_OVERLAP = 2
+
+# Numero minimo di nomi per ricalcolare l'ordine dei trigrammi
+RERANK_MIN = 1000
+
+# Forme societarie e parole di collegamento ignorate nel confronto dei nomi
+LEGAL_FORMS = frozenset({
+    'srl', 'srls', 'spa', 'snc', 'sas', 'sapa', 'ss', 'scarl', 'scrl', 'soc', 'coop',
+    'societa', 'ditta', 'di', 'e', 'c', 'ltd', 'gmbh', 'inc',
+})
+
+_NOT_ALNUM = re.compile(r'[^0-9a-z]+')
+
+
+def normalize_vat(value):
+    """Partita IVA senza spazi, punti, trattini e barre, in maiuscolo e senza prefisso IT."""
+    value = (value or '').strip().upper()
+    for char in ' .-/':
+        value = value.replace(char, '')
+    if len(value) == 13 and value.startswith('IT') and value[2:].isascii() and value[2:].isdigit():
+        value = value[2:]
+    return value
+
+
+def normalize_email(value):
+    """Email senza spazi ai lati e in minuscolo."""
+    return (value or '').strip().lower()
+
+
+def normalize_name(value):
+    """Nome senza accenti, punteggiatura e forme societarie."""
+    text = normalize(value or '').replace('.', '')
+    words = _NOT_ALNUM.sub(' ', text).split()
+    kept = [word for word in words if word not in LEGAL_FORMS]
+    return ' '.join(kept or words)
+
+
+def name_grams(value):
+    """Trigrammi del nome normalizzato (il nome intero se è più corto)."""
+    text = normalize_name(value)
+    if len(text) < 3:
+        return frozenset((text,)) if text else frozenset()
+    return frozenset(text[i:i + 3] for i in range(len(text) - 2))
+
+
+def similarity(grams, other):
+    """Similarità di Jaccard tra due insiemi di trigrammi."""
+    if not grams or not other:
+        return 0.0
+    common = len(grams & other)
+    return common / (len(grams) + len(other) - common)
+
+
+def _min_overlap(count):
+    # La tolleranza evita che un errore di arrotondamento accorci il prefisso
+    return ceil(NAME_SIMILARITY * count - 1e-9)
+
+
+def probe_size(count):
+    """Lunghezza del prefisso di un nome con count trigrammi."""
+    return min(count, count - _min_overlap(count) + PREFIX_OVERLAP)
+
+
+def required_overlap(count):
+    """Trigrammi del prefisso che un nome simile deve avere in comune (meno per i nomi cortissimi)."""
+    return min(PREFIX_OVERLAP, _min_overlap(count))
+
+
+def candidate_ids(postings, required):
+    """Id presenti in almeno required (1 o 2) delle liste indicate."""
+    found = set()
+    if required <= 1:
+        for ids in postings:
+            found |= ids
+        return found
+    for position, ids in enumerate(postings):
+        for other in postings[position + 1:]:
+            found |= ids & other
+    return found
+
+
+def exact_keys(record):
+    """Coppie (campo, valore normalizzato) che identificano un cliente con certezza."""
+    keys = []
+    vat = normalize_vat(record.get('vat_id'))
+    if vat:
+        keys.append(('vat_id', vat))
+    email = normalize_email(record.get('email'))
+    if email:
+        keys.append(('email', email))
+    return keys
+
+
+class DuplicateIndex:
+    """Indici su partita IVA, email e trigrammi dei nomi dei clienti."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._exact = {'vat_id': {}, 'email': {}}   # campo -> valore normalizzato -> set di id
+        self._keys = {}                             # id -> chiavi esatte indicizzate
+        self._grams = {}                            # id -> trigrammi del nome
+        self._prefixes = {}                         # id -> trigrammi del prefisso
+        self._postings = {}                         # trigramma -> set di id che lo hanno nel prefisso
+        self._rank = {}                             # trigramma -> posizione nell'ordine globale
+        self._next_rank = -1                        # posizione del prossimo trigramma nuovo
+        self._ranked = 0                            # nomi presenti all'ultimo ricalcolo dell'ordine
+
+    # --- Aggiornamento ---
+    def apply(self, changes):
+        """Applica le modifiche di una transazione confermata (['put'|'delete', tabella, ...])."""
+        with self._lock:
+            puts = sum(1 for op, table, _ in changes if op == 'put' and table == DUPLICATE_TABLE)
+            # Un blocco grande almeno quanto l'indice (caricamento, importazione)
+            # fa ricostruire l'indice alla fine: inutile calcolare i prefissi ora
+            rebuild = puts >= max(RERANK_MIN, len(self._grams))
+            for op, table, payload in changes:
+                if table != DUPLICATE_TABLE:
+                    continue
+                if op == 'put':
+                    self._remove(payload['id'])
+                    self._add(payload, index=not rebuild)
+                else:
+                    self._remove(payload)
+            if rebuild or len(self._grams) >= max(RERANK_MIN, 2 * self._ranked):
+                self._rerank()
+
+    def _add(self, record, index=True):
+        record_id = record['id']
+        keys = exact_keys(record)
+        for field, value in keys:
+            self._exact[field].setdefault(value, set()).add(record_id)
+        self._keys[record_id] = keys
+        grams = name_grams(record.get('name'))
+        self._grams[record_id] = grams
+        if index:
+            for gram in grams:
+                if gram not in self._rank:
+                    self._rank[gram] = self._next_rank
+                    self._next_rank -= 1
+            self._index_prefix(record_id, grams)
+
+    def _index_prefix(self, record_id, grams):
+        prefix = self._prefix(grams)
+        self._prefixes[record_id] = prefix
+        for gram in prefix:
+            self._postings.setdefault(gram, set()).add(record_id)
+
+    def _prefix(self, grams):
+        # I trigrammi mai visti non sono in nessun nome: vanno in testa senza
+        # cambiare l'ordine degli altri
+        known = [gram for gram in grams if gram in self._rank]
+        size = probe_size(len(grams)) - (len(grams) - len(known))
+        return sorted(known, key=self._rank.__getitem__)[:max(size, 0)]
+
+    def _remove(self, record_id):
+        for field, value in self._keys.pop(record_id, ()):
+            ids = self._exact[field][value]
+            ids.discard(record_id)
+            if not ids:
+                del self._exact[field][value]
+        self._grams.pop(record_id, None)
+        for gram in self._prefixes.pop(record_id, ()):
+            ids = self._postings[gram]
+            ids.discard(record_id)
+            if not ids:
+                del self._postings[gram]
+
+    def _rerank(self):
+        """Ricalcola l'ordine dei trigrammi sulle frequenze attuali e ricostruisce i prefissi."""
+        frequency = {}
+        for grams in self._grams.values():
+            for gram in grams:
+                frequency[gram] = frequency.get(gram, 0) + 1
+        ordered = sorted(frequency, key=lambda gram: (frequency[gram], gram))
+        self._rank = {gram: position for position, gram in enumerate(ordered)}
+        self._next_rank = -1
+        self._postings = {}
+        self._prefixes = {}
+        for record_id, grams in self._grams.items():
+            self._index_prefix(record_id, grams)
+        self._ranked = len(self._grams)
+
+    # --- Ricerca ---
+    def find(self, record, exclude_id=None, limit=DUPLICATE_LIMIT):
+        """
+        Clienti che potrebbero essere lo stesso soggetto di record. Restituisce
+        terne (id, motivo, similarità): prima le corrispondenze esatte (motivo
+        'vat_id' o 'email', similarità 1.0), poi i nomi simili (motivo 'name')
+        dal più simile.
+        """
+        found = {}
+        names = []
+        with self._lock:
+            for field, value in exact_keys(record):
+                for record_id in self._exact[field].get(value, ()):
+                    if record_id != exclude_id and record_id not in found:
+                        found[record_id] = (record_id, field, 1.0)
+            grams = name_grams(record.get('name'))
+            postings = [self._postings[gram] for gram in self._prefix(grams) if gram in self._postings]
+            for record_id in candidate_ids(postings, required_overlap(len(grams))):
+                if record_id == exclude_id or record_id in found:
+                    continue
+                score = similarity(grams, self._grams[record_id])
+                if score >= NAME_SIMILARITY:
+                    names.append((record_id, 'name', score))
+        names.sort(key=lambda match: -match[2])
+        return (list(found.values()) + names)[:limit]
@@ -0,0 +1,87 @@
+# Esportazioni CSV e NDJSON in streaming (/export/<entità>.<formato>).
+# Le righe arrivano dagli iteratori dei backend (iter_all, iter_contract_months)
+# e vengono trasformate in testo a blocchi: il file non viene mai costruito in
+# memoria e il download parte subito, qualunque sia il numero di righe.
+#
+# contract_months è la vista piatta per la contabilità: una riga per ogni mese
+# di ogni servizio cliente, con ore lavorate, importo pagato e ore preventivate.
+import csv
+from datetime import date, datetime
+import io
+import json
+
+from ids import format_id
+
+# Entità esportabili e colonne, nell'ordine del file
+EXPORT_FIELDS = {
+    'clients': ('id', 'name', 'vat_id', 'email', 'phone', 'address', 'city', 'zip', 'sdi_code',
+                'agent', 'call_center', 'contact', 'created_at'),
+    'services': ('id', 'name', 'description', 'price'),
+    'client_services': ('id', 'client_id', 'service_id', 'subscribed_price', 'start_date', 'end_date', 'notes'),
+    'contract_months': ('contract_id', 'client_id', 'client_name', 'service_id', 'service_name', 'year', 'month',
+                        'hours_worked', 'amount_paid', 'estimated_hours', 'notes'),
+}
+
+# Colonne con id, scritti nella stessa forma degli URL
+ID_COLUMNS = frozenset(('id', 'client_id', 'service_id', 'contract_id'))
+
+# Formati supportati -> tipo MIME della risposta
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Dimensione indicativa (in caratteri) dei blocchi inviati al client
+CHUNK_SIZE = 64 * 1024
+
+
+def export_rows(snapshot, entity):
+    """Righe dell'entità lette da uno snapshot (o sessione SQLite), una alla volta."""
+    if entity == 'contract_months':
+        return snapshot.iter_contract_months()
+    return snapshot.iter_all(entity)
+
+
+def _value(field, value):
+    if field in ID_COLUMNS:
+        return format_id(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def csv_chunks(rows, fields, chunk_size=CHUNK_SIZE):
+    """Testo CSV (intestazione compresa) a blocchi di circa chunk_size caratteri."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for row in rows:
+        writer.writerow([_value(field, row.get(field)) for field in fields])
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_chunks(rows, fields, chunk_size=CHUNK_SIZE):
+    """Un oggetto JSON per riga, a blocchi di circa chunk_size caratteri."""
+    lines = []
+    size = 0
+    for row in rows:
+        line = json.dumps({field: _value(field, row.get(field)) for field in fields}, ensure_ascii=False) + '\n'
+        lines.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield ''.join(lines)
+            lines = []
+            size = 0
+    yield ''.join(lines)
+
+
+EXPORT_WRITERS = {'csv': csv_chunks, 'ndjson': ndjson_chunks}
+
+
+def export_chunks(snapshot, entity, fmt):
+    """Contenuto del file di esportazione, a blocchi di testo."""
+    return EXPORT_WRITERS[fmt](export_rows(snapshot, entity), EXPORT_FIELDS[entity])
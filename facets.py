@@ -0,0 +1,101 @@
+# Indici bitmap per le faccette dell'elenco clienti (agente, call center,
+# città, prefisso del CAP).
+# Ogni record riceve un numero di riga stabile; per ogni valore di una faccetta
+# si conserva un intero Python usato come insieme di bit (bit n acceso = la riga
+# n ha quel valore). Le combinazioni di filtri diventano operazioni sui bit:
+# OR tra i valori scelti di una faccetta, AND tra faccette diverse, e i
+# conteggi sono bit_count() dell'intersezione, senza scorrere i record.
+#
+# Gli interi sono immutabili: aggiornare una riga crea un nuovo intero, quindi
+# le bitmap seguono le regole copy-on-write degli snapshot del Repository.
+
+# Tabelle con faccette e relativi campi
+FACETS = {'clients': ('agent', 'call_center', 'city', 'zip_prefix')}
+
+# Numero di cifre del CAP usate per la faccetta zip_prefix
+ZIP_PREFIX_LENGTH = 2
+
+# Righe libere tollerate in una numerazione prima di rinumerare la tabella
+# (comunque non meno delle righe in uso, così il costo resta ammortizzato)
+FREE_ROWS_LIMIT = 1024
+
+# int.bit_count() esiste da Python 3.10; prima si contano gli '1' della forma binaria
+if hasattr(int, 'bit_count'):
+    bit_count = int.bit_count
+else:
+    def bit_count(bits):
+        """Numero di righe accese in una bitmap."""
+        return bin(bits).count('1')
+
+
+def facet_value(record, field):
+    """Valore di una faccetta per un record ('' se il campo è vuoto)."""
+    if field == 'zip_prefix':
+        return (record.get('zip') or '').strip()[:ZIP_PREFIX_LENGTH]
+    return (record.get(field) or '').strip()
+
+
+def bitmap_from_rows(rows):
+    """Costruisce la bitmap con accese le righe indicate."""
+    rows = list(rows)
+    if not rows:
+        return 0
+    data = bytearray(max(rows) // 8 + 1)
+    for row in rows:
+        data[row >> 3] |= 1 << (row & 7)
+    return int.from_bytes(data, 'little')
+
+
+def bitmaps_by_value(numbered, field):
+    """Bitmap di ogni valore della faccetta field, da coppie (numero di riga, record)."""
+    grouped = {}
+    for row, record in numbered:
+        grouped.setdefault(facet_value(record, field), []).append(row)
+    return {value: bitmap_from_rows(rows) for value, rows in grouped.items()}
+
+
+def bitmap_rows(bits):
+    """Numeri di riga accesi in una bitmap, in ordine crescente."""
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    rows = []
+    for index, byte in enumerate(data):
+        if byte:
+            base = index << 3
+            for bit in range(8):
+                if byte >> bit & 1:
+                    rows.append(base + bit)
+    return rows
+
+
+class RowNumbers:
+    """
+    Numerazione delle righe di una tabella con faccette. Cresce soltanto: un id
+    mantiene sempre lo stesso numero e le righe eliminate (o assegnate da
+    transazioni annullate) restano come buchi, quindi gli snapshot più vecchi
+    possono continuare a usarla senza copiarla. Viene modificata solo dallo
+    scrittore, sotto il lock del Repository. Quando i buchi superano
+    FREE_ROWS_LIMIT e le righe in uso, il Repository costruisce una nuova
+    numerazione compatta con nuove bitmap; quella vecchia resta agli snapshot
+    che la usano e non cambia più.
+    """
+
+    __slots__ = ('ids', 'rows')
+
+    def __init__(self):
+        self.ids = []       # numero di riga -> id del record
+        self.rows = {}      # id del record -> numero di riga
+
+    def __len__(self):
+        return len(self.ids)
+
+    def free(self, used):
+        """Righe assegnate a record non più presenti, dato il numero di quelle in uso."""
+        return len(self.ids) - used
+
+    def row(self, record_id):
+        """Numero di riga del record, assegnato al primo utilizzo."""
+        row = self.rows.get(record_id)
+        if row is None:
+            row = self.rows[record_id] = len(self.ids)
+            self.ids.append(record_id)
+        return row
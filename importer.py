@@ -0,0 +1,381 @@
+# Importazione in blocco dei dati dalle vecchie versioni del CRM:
+# - clients.json e services.json (chiavi italiane, id interi);
+# - database.db (clienti, servizi con cliente_id e ore);
+# - instance/manager.db (clients, services, client_service);
+# - instance/mycrm.db (clienti).
+#
+# Ogni sorgente è letta in streaming: i file JSON elemento per elemento con
+# JSONDecoder.raw_decode su blocchi di dimensione fissa, le tabelle SQLite con
+# fetchmany. I record vengono convertiti nel modello attuale (nome -> name,
+# partita_iva -> vat_id, ...) e inseriti a lotti, una transazione per lotto,
+# quindi la memoria usata non dipende dalla dimensione della sorgente. Fanno
+# eccezione le corrispondenze tra vecchi e nuovi id di clienti e servizi, che
+# servono per collegare i contratti.
+#
+# I clienti con la stessa partita IVA o email di uno già presente vengono
+# saltati (vedi duplicates.py); il confronto dei nomi simili, più costoso,
+# resta alla maschera di inserimento manuale.
+from datetime import datetime
+import json
+import os
+import sqlite3
+import time
+
+from duplicates import exact_keys
+from ids import new_id
+from ledger import MonthlyLedger
+from repository import IntegrityError
+
+# Record per transazione
+BATCH_SIZE = 5000
+
+# Byte letti per volta dai file JSON
+CHUNK_SIZE = 1 << 16
+
+# Colonne delle vecchie sorgenti -> campi del modello attuale
+FIELD_MAPS = {
+    'clients': {
+        'nome': 'name', 'name': 'name',
+        'email': 'email',
+        'telefono': 'phone', 'phone': 'phone',
+        'partita_iva': 'vat_id',
+        'indirizzo': 'address',
+        'citta': 'city',
+        'cap': 'zip',
+        'codice_sdi': 'sdi_code',
+        'agente': 'agent',
+        'call_center': 'call_center',
+        'referente_aziendale': 'contact',
+        'data_creazione': 'created_at', 'created_at': 'created_at',
+    },
+    'services': {
+        'nome': 'name', 'name': 'name',
+        'descrizione': 'description', 'description': 'description',
+        'prezzo': 'price', 'prezzo_base': 'price', 'price': 'price', 'costo_orario': 'price',
+    },
+    'client_services': {
+        'client_id': 'client_id', 'cliente_id': 'client_id',
+        'service_id': 'service_id',
+        'subscribed_price': 'subscribed_price', 'costo_concordato': 'subscribed_price',
+        'start_date': 'start_date', 'data_inizio': 'start_date',
+        'end_date': 'end_date', 'data_fine': 'end_date',
+        'notes': 'notes', 'note_contratto': 'notes',
+    },
+}
+
+# Valori dei campi assenti nella sorgente (come nei form dell'applicazione)
+DEFAULTS = {
+    'clients': dict.fromkeys(('email', 'phone', 'vat_id', 'address', 'city', 'zip', 'sdi_code',
+                              'agent', 'call_center', 'contact'), ''),
+    'services': {'description': '', 'price': 0.0},
+    'client_services': {'end_date': None, 'notes': ''},
+}
+
+# Tabelle delle vecchie basi di dati SQLite -> tabella del repository, in
+# ordine di importazione (i contratti dopo clienti e servizi)
+SQLITE_TABLES = (
+    ('clienti', 'clients'),
+    ('clients', 'clients'),
+    ('servizi', 'services'),
+    ('services', 'services'),
+    ('client_service', 'client_services'),
+)
+
+NUMBER_FIELDS = ('price', 'subscribed_price')
+DATE_FIELDS = ('created_at', 'start_date', 'end_date')
+REFERENCES = {'client_id': 'clients', 'service_id': 'services'}
+
+
+class ImportStats:
+    """Contatori e tempi dell'importazione di una tabella."""
+
+    def __init__(self, source, table):
+        self.source = source
+        self.table = table
+        self.read = 0
+        self.imported = 0
+        self.duplicates = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def rate(self):
+        """Record letti al secondo."""
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f'{self.source} -> {self.table}: {self.read} letti, {self.imported} importati, '
+                f'{self.duplicates} duplicati, {self.errors} errori '
+                f'in {self.elapsed:.2f} s ({self.rate:,.0f} record/s)')
+
+
+# --- Lettura delle sorgenti ---
+def iter_json_array(path, chunk_size=CHUNK_SIZE):
+    """
+    Restituisce uno alla volta gli elementi di un file con un array JSON,
+    leggendo blocchi di chunk_size caratteri: in memoria c'è solo l'elemento
+    corrente e la parte di file non ancora interpretata.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as file:
+        buffer = ''
+        position = 0
+        started = False
+        eof = False
+        while True:
+            # Salta spazi, la parentesi iniziale e le virgole tra gli elementi
+            while position < len(buffer) and buffer[position] in ' \t\r\n,[':
+                if buffer[position] == '[':
+                    if started:
+                        break
+                    started = True
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            if position < len(buffer):
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    # Un numero troncato dalla fine del blocco ("4." di "4.5") va
+                    # riletto: l'elemento è completo solo se seguito da un separatore
+                    if eof or (end < len(buffer) and buffer[end] in ' \t\r\n,]'):
+                        position = end
+                        yield item
+                        continue
+            if eof:
+                raise ValueError(f'{path}: array JSON non chiuso')
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+
+
+def iter_sqlite_rows(conn, table, batch_size=BATCH_SIZE):
+    """Righe di una tabella SQLite come dizionari, lette a blocchi con fetchmany."""
+    cursor = conn.execute(f'SELECT * FROM {table} ORDER BY rowid')
+    columns = [description[0] for description in cursor.description]
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        for row in rows:
+            yield dict(zip(columns, row))
+
+
+def json_table(path):
+    """Tabella di destinazione di un file JSON, dedotta dal nome (services.json -> servizi)."""
+    name = os.path.basename(path).lower()
+    return 'services' if 'servic' in name or 'servizi' in name else 'clients'
+
+
+# --- Conversione nel modello attuale ---
+def _number(value):
+    if isinstance(value, str):
+        value = value.strip().replace(',', '.')
+        return float(value) if value else 0.0
+    return float(value) if value is not None else 0.0
+
+
+def _date(value):
+    if isinstance(value, str):
+        value = value.strip()
+        return datetime.fromisoformat(value) if value else None
+    if not isinstance(value, datetime):
+        raise TypeError(f'data non valida: {value!r}')
+    return value
+
+
+def convert(table, row):
+    """
+    Converte una riga di una vecchia sorgente in un record di table, con un
+    nuovo id. Le colonne sconosciute vengono ignorate, i testi ripuliti dagli
+    spazi ai lati, prezzi e date convertiti nei tipi usati dall'applicazione.
+    """
+    record = {'id': new_id(), **DEFAULTS[table]}
+    for column, field in FIELD_MAPS[table].items():
+        value = row.get(column)
+        if value is None:
+            continue
+        if field in NUMBER_FIELDS:
+            value = _number(value)
+        elif field in DATE_FIELDS:
+            value = _date(value)
+        elif isinstance(value, str):
+            value = value.strip()
+        record[field] = value
+    if table == 'clients' and not record.get('created_at'):
+        record['created_at'] = datetime.now()
+    if table == 'services' and not record.get('name'):
+        # I servizi di database.db hanno solo la descrizione
+        record['name'] = record['description']
+    return record
+
+
+def _client_service(record):
+    """Aggiunge ai contratti importati i dettagli mensili, come add_client_service."""
+    end = record['end_date'] or datetime.now()
+    record['monthly_details'] = MonthlyLedger.for_range(record['start_date'], end)
+    return record
+
+
+def _subscription(row, service):
+    """
+    Contratto ricavato da un servizio per cliente di database.db (con
+    cliente_id, ore previste e ore lavorate ma senza date): parte dal mese
+    dell'importazione e riporta le ore nel primo mese.
+    """
+    start = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    details = MonthlyLedger.for_range(start, start).updated([
+        (0, 'estimated_hours', _number(row.get('ore_previste'))),
+        (0, 'hours_worked', _number(row.get('ore_lavorate'))),
+    ])
+    return {
+        'id': new_id(),
+        'client_id': row['cliente_id'],
+        'service_id': service['id'],
+        'subscribed_price': service['price'],
+        'start_date': start,
+        'end_date': None,
+        'notes': '',
+        'monthly_details': details,
+    }
+
+
+# --- Importazione ---
+class Importer:
+    """
+    Importa le vecchie sorgenti in un repository. I riferimenti dei contratti
+    (client_id, service_id, cliente_id) sono risolti con le corrispondenze tra
+    vecchi e nuovi id registrate durante l'importazione della stessa sorgente.
+    """
+
+    def __init__(self, repo, batch_size=BATCH_SIZE, progress=None):
+        self.repo = repo
+        self.batch_size = batch_size
+        # Funzione chiamata con le statistiche parziali dopo ogni lotto
+        self.progress = progress
+        self._ids = {}
+
+    def import_path(self, path, table=None):
+        """Importa un file JSON o una base di dati SQLite. Restituisce le statistiche per tabella."""
+        self._ids = {}
+        if path.lower().endswith('.json'):
+            return [self._import(path, table or json_table(path), iter_json_array(path))]
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        try:
+            present = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            return [self._import(path, target, iter_sqlite_rows(conn, name, self.batch_size), name)
+                    for name, target in SQLITE_TABLES if name in present and (table is None or table == target)]
+        finally:
+            conn.close()
+
+    def _import(self, source, table, rows, source_table=None):
+        stats = ImportStats(source if source_table is None else f'{source}:{source_table}', table)
+        batch = []
+        for row in rows:
+            stats.read += 1
+            batch.append(row)
+            if len(batch) == self.batch_size:
+                self._write(table, batch, stats)
+                batch = []
+        if batch:
+            self._write(table, batch, stats)
+        stats.elapsed = time.perf_counter() - stats.started
+        return stats
+
+    def _write(self, table, rows, stats):
+        """Inserisce un lotto in una transazione; se fallisce riprova un record alla volta."""
+        try:
+            with self.repo.transaction() as tx:
+                ids, imported, skipped, errors = self._insert(tx, table, rows)
+        except IntegrityError:
+            ids, imported, skipped, errors = {}, 0, 0, 0
+            for row in rows:
+                try:
+                    with self.repo.transaction() as tx:
+                        result = self._insert(tx, table, [row])
+                except IntegrityError:
+                    errors += 1
+                    continue
+                ids.update(result[0])
+                imported += result[1]
+                skipped += result[2]
+                errors += result[3]
+        self._ids.update(ids)
+        stats.imported += imported
+        stats.duplicates += skipped
+        stats.errors += errors
+        stats.elapsed = time.perf_counter() - stats.started
+        if self.progress is not None:
+            self.progress(stats)
+
+    def _insert(self, tx, table, rows):
+        """
+        Converte e inserisce le righe di un lotto. Restituisce le nuove
+        corrispondenze (tabella, vecchio id) -> nuovo id, da registrare solo se
+        la transazione va a buon fine, e i conteggi di record importati,
+        duplicati e scartati. Le righe con valori non convertibili (un prezzo
+        "n/d", una data malformata) sono contate tra gli errori senza
+        interrompere il lotto.
+        """
+        ids = {}
+        seen = set()
+        legacy = []
+        records = []
+        skipped = errors = 0
+        for row in rows:
+            try:
+                record = convert(table, row)
+            except (ValueError, TypeError):
+                errors += 1
+                continue
+            if table != 'client_services' and not record.get('name'):
+                errors += 1
+                continue
+            if table == 'clients':
+                keys = exact_keys(record)
+                if any(key in seen for key in keys) or self.repo.find_duplicates(
+                        {'vat_id': record['vat_id'], 'email': record['email']}, limit=1):
+                    skipped += 1
+                    continue
+                seen.update(keys)
+            elif table == 'client_services':
+                if not (self._resolve(record, 'client_id') and self._resolve(record, 'service_id')):
+                    errors += 1
+                    continue
+                if record.get('start_date') is None:
+                    errors += 1
+                    continue
+                _client_service(record)
+            legacy.append(row)
+            records.append(record)
+        stored = tx.insert_many(table, records)
+        subscriptions = []
+        for row, record in zip(legacy, stored):
+            if row.get('id') is not None:
+                ids[(table, row['id'])] = record['id']
+            if table == 'services' and row.get('cliente_id') is not None:
+                try:
+                    subscription = _subscription(row, record)
+                except (ValueError, TypeError):
+                    errors += 1
+                    continue
+                if self._resolve(subscription, 'client_id'):
+                    subscriptions.append(subscription)
+                else:
+                    errors += 1
+        if subscriptions:
+            tx.insert_many('client_services', subscriptions)
+        return ids, len(records), skipped, errors
+
+    def _resolve(self, record, field):
+        """Sostituisce il vecchio id in record[field] con quello nuovo; False se non è stato importato."""
+        resolved = self._ids.get((REFERENCES[field], record[field]))
+        if resolved is None:
+            return False
+        record[field] = resolved
+        return True
@@ -0,0 +1,152 @@
+# Indice a intervalli dei periodi dei servizi cliente [start_date, end_date],
+# con end_date assente = contratto aperto.
+#
+# È un treap (albero binario di ricerca ordinato per (inizio, id), bilanciato
+# da priorità casuali) in cui ogni nodo conosce anche la fine massima del suo
+# sottoalbero: una ricerca degli intervalli che si sovrappongono a [lo, hi]
+# scarta interi sottoalberi che finiscono prima di lo o iniziano dopo hi, e
+# costa O(log n + k) per k risultati.
+#
+# I nodi non vengono mai modificati dopo la pubblicazione: inserimenti ed
+# eliminazioni copiano solo il cammino dalla radice al nodo toccato (O(log n)
+# nodi) e restituiscono un nuovo albero. Le versioni precedenti restano
+# valide, quindi l'indice segue gli snapshot del Repository senza copie.
+from datetime import datetime
+import random
+
+# Fine usata per i contratti senza data di fine
+OPEN_END = datetime.max
+
+
+def contract_interval(cs):
+    """Periodo (inizio, fine) di un servizio cliente."""
+    return cs['start_date'], cs.get('end_date') or OPEN_END
+
+
+class _Node:
+    __slots__ = ('key', 'end', 'priority', 'left', 'right', 'max_end')
+
+    def __init__(self, key, end, priority, left, right):
+        self.key = key              # (inizio, id)
+        self.end = end
+        self.priority = priority
+        self.left = left
+        self.right = right
+        max_end = end
+        if left is not None and left.max_end > max_end:
+            max_end = left.max_end
+        if right is not None and right.max_end > max_end:
+            max_end = right.max_end
+        self.max_end = max_end
+
+    def replaced(self, left, right):
+        return _Node(self.key, self.end, self.priority, left, right)
+
+
+def _insert(node, new):
+    if node is None:
+        return new
+    if new.priority > node.priority:
+        left, right = _split(node, new.key)
+        return new.replaced(left, right)
+    if new.key < node.key:
+        return node.replaced(_insert(node.left, new), node.right)
+    return node.replaced(node.left, _insert(node.right, new))
+
+
+def _split(node, key):
+    """Divide l'albero in (chiavi < key, chiavi > key), copiando solo i cammini."""
+    if node is None:
+        return None, None
+    if node.key < key:
+        left, right = _split(node.right, key)
+        return node.replaced(node.left, left), right
+    left, right = _split(node.left, key)
+    return left, node.replaced(right, node.right)
+
+
+def _merge(left, right):
+    """Unisce due alberi in cui tutte le chiavi di left precedono quelle di right."""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        return left.replaced(left.left, _merge(left.right, right))
+    return right.replaced(_merge(left, right.left), right.right)
+
+
+def _remove(node, key):
+    if node is None:
+        return None, False
+    if key == node.key:
+        return _merge(node.left, node.right), True
+    if key < node.key:
+        left, found = _remove(node.left, key)
+        return (node.replaced(left, node.right) if found else node), found
+    right, found = _remove(node.right, key)
+    return (node.replaced(node.left, right) if found else node), found
+
+
+class IntervalTree:
+    """Insieme immutabile di intervalli chiusi [inizio, fine] identificati da un id."""
+
+    __slots__ = ('_root', '_size')
+
+    def __init__(self, root=None, size=0):
+        self._root = root
+        self._size = size
+
+    @classmethod
+    def from_intervals(cls, intervals):
+        """
+        Costruisce l'albero da terne (inizio, fine, id) in tempo lineare dopo
+        l'ordinamento (caricamento in blocco): i nodi sono disposti con una pila
+        sulla spina destra, come in un albero cartesiano.
+        """
+        items = sorted(((start, record_id), end) for start, end, record_id in intervals)
+        spine = []      # [(chiave, fine, priorità, sinistro)] dalla radice verso destra
+        for key, end in items:
+            priority = random.random()
+            left = None
+            while spine and spine[-1][2] < priority:
+                top_key, top_end, top_priority, top_left = spine.pop()
+                left = _Node(top_key, top_end, top_priority, top_left, left)
+            spine.append((key, end, priority, left))
+        root = None
+        while spine:
+            key, end, priority, left = spine.pop()
+            root = _Node(key, end, priority, left, root)
+        return cls(root, len(items))
+
+    def __len__(self):
+        return self._size
+
+    def inserted(self, start, end, record_id):
+        """Nuovo albero con l'intervallo aggiunto."""
+        node = _Node((start, record_id), end, random.random(), None, None)
+        return IntervalTree(_insert(self._root, node), self._size + 1)
+
+    def removed(self, start, record_id):
+        """Nuovo albero senza l'intervallo (self se non è presente)."""
+        root, found = _remove(self._root, (start, record_id))
+        return IntervalTree(root, self._size - 1) if found else self
+
+    def overlapping(self, lo, hi):
+        """Id degli intervalli che si sovrappongono a [lo, hi], in ordine di inizio."""
+        stack = []
+        node = self._root
+        while stack or node is not None:
+            # Discesa a sinistra, saltando i sottoalberi che finiscono prima di lo
+            while node is not None and node.max_end >= lo:
+                stack.append(node)
+                node = node.left
+            if not stack:
+                return
+            node = stack.pop()
+            if node.key[0] > hi:
+                # Questo nodo e tutto ciò che segue iniziano dopo hi
+                return
+            if node.end >= lo:
+                yield node.key[1]
+            node = node.right
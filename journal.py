@@ -0,0 +1,266 @@
+# Journal append-only delle modifiche al Repository in memoria.
+# Ogni transazione confermata viene scritta come una riga JSON nel file
+# journal.jsonl; periodicamente lo stato completo viene salvato in uno snapshot
+# msgpack (vedi snapshots.py) e il journal viene compattato, così all'avvio si
+# rilegge solo snapshot + coda.
+#
+# Le scritture su disco usano il group commit: chi conferma una transazione
+# accoda la propria riga e attende che sia resa persistente; il primo thread
+# in attesa diventa "leader", scrive tutte le righe accodate e fa un solo
+# fsync per l'intero gruppo, svegliando poi gli altri.
+#
+# Un solo processo alla volta può scrivere in una cartella dati: il journal
+# prende un lock esclusivo su journal.lock (flock, solo POSIX) e lo tiene fino
+# a close() o all'uscita del processo. Un secondo processo sulla stessa
+# cartella, per esempio il comando import-data con il server avviato, riceve
+# JournalLockedError invece di aggiungere righe al journal dell'altro.
+#
+# Gli id interi (vedi ids.py) vanno in JSON come numeri. Le righe scritte
+# prima degli id interi hanno id stringa uuid: al ripristino vengono
+# convertiti, insieme a quelli dello snapshot JSON delle versioni precedenti.
+from array import array
+from datetime import datetime
+import json
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:     # pragma: no cover - dipende dall'ambiente
+    fcntl = None
+
+from ids import migrate_id, migrate_record
+from ledger import MonthlyLedger
+from records import Record
+from snapshots import fsync_directory, load_snapshot, save_snapshot
+
+JOURNAL_FILE = 'journal.jsonl'
+SNAPSHOT_FILE = 'snapshot.msgpack'
+# Snapshot JSON delle versioni precedenti, letto solo se manca quello msgpack
+LEGACY_SNAPSHOT_FILE = 'snapshot.json'
+LOCK_FILE = 'journal.lock'
+
+# Numero di transazioni dopo il quale lo snapshot viene rigenerato
+COMPACT_EVERY = 1000
+
+
+def _encode(value):
+    """Serializza i tipi non supportati da JSON (record, date e dettagli mensili)."""
+    if isinstance(value, Record):
+        return dict(value.items())
+    if isinstance(value, datetime):
+        return {'$dt': value.isoformat()}
+    if isinstance(value, MonthlyLedger):
+        return {'$ledger': [value.start, value.hours_worked.tolist(), value.amount_paid.tolist(),
+                            value.estimated_hours.tolist(), [[k, v] for k, v in value.notes.items()]]}
+    raise TypeError(f'Tipo non serializzabile: {type(value).__name__}')
+
+
+def _decode(obj):
+    if len(obj) == 1:
+        if '$dt' in obj:
+            return datetime.fromisoformat(obj['$dt'])
+        if '$ledger' in obj:
+            start, hours_worked, amount_paid, estimated_hours, notes = obj['$ledger']
+            return MonthlyLedger(start, array('d', hours_worked), array('d', amount_paid),
+                                 array('d', estimated_hours), dict(notes))
+    return obj
+
+
+class JournalLockedError(Exception):
+    """La cartella dati è già usata da un altro processo."""
+
+
+def dumps(obj):
+    return json.dumps(obj, default=_encode, ensure_ascii=False, separators=(',', ':'))
+
+
+def loads(text):
+    return json.loads(text, object_hook=_decode)
+
+
+class Journal:
+    """
+    Registro persistente delle transazioni di un Repository.
+    Va collegato al repository con Repository.attach_journal() dopo restore().
+    """
+
+    def __init__(self, directory, compact_every=COMPACT_EVERY):
+        self.directory = directory
+        self.journal_path = os.path.join(directory, JOURNAL_FILE)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.legacy_snapshot_path = os.path.join(directory, LEGACY_SNAPSHOT_FILE)
+        self.compact_every = compact_every
+        self._repo = None
+        self._cond = threading.Condition()
+        self._buffer = []
+        self._appended = 0       # righe accodate
+        self._durable = 0        # righe rese persistenti con fsync
+        self._flushing = False
+        self._since_snapshot = 0
+        self._compacting = False
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = self._acquire_lock(os.path.join(directory, LOCK_FILE))
+        self._file = open(self.journal_path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def _acquire_lock(path):
+        lock_file = open(path, 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                raise JournalLockedError(f'{os.path.dirname(path)}: cartella dati già in uso da un altro processo')
+        return lock_file
+
+    # --- Avvio ---
+    def restore(self, repo):
+        """
+        Ricarica nel repository lo snapshot e le transazioni successive del journal.
+        Restituisce False se non c'è nulla da ripristinare (primo avvio).
+        """
+        version = 0
+        tables = {}
+        if os.path.exists(self.snapshot_path):
+            version, tables = load_snapshot(self.snapshot_path)
+        elif os.path.exists(self.legacy_snapshot_path):
+            with open(self.legacy_snapshot_path, encoding='utf-8') as f:
+                data = loads(f.read())
+            version = data['version']
+            tables = {table: [migrate_record(record) for record in records]
+                      for table, records in data['tables'].items()}
+
+        entries, valid_bytes = self._read_tail(version)
+        if not tables and not entries:
+            return False
+
+        repo.load(version, tables)
+        with repo.transaction() as tx:
+            for entry in entries:
+                for op, table, payload in entry['ops']:
+                    if op == 'put':
+                        tx.put(table, migrate_record(payload))
+                    else:
+                        tx.delete(table, migrate_id(payload))
+                version = entry['v']
+            tx.version = version
+        # Il repository non è ancora collegato al journal (attach_journal avviene
+        # dopo restore), quindi il ripristino non viene registrato di nuovo
+
+        # Una riga finale incompleta (scrittura interrotta) viene scartata
+        if valid_bytes < os.path.getsize(self.journal_path):
+            self._file.truncate(valid_bytes)
+        self._since_snapshot = len(entries)
+        return True
+
+    def _read_tail(self, after_version):
+        entries = []
+        valid_bytes = 0
+        with open(self.journal_path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    entry = loads(line.decode('utf-8'))
+                except ValueError:
+                    break
+                valid_bytes += len(line)
+                if entry['v'] > after_version:
+                    entries.append(entry)
+        return entries, valid_bytes
+
+    def attach(self, repo):
+        self._repo = repo
+
+    # --- Scrittura ---
+    def append(self, version, changes):
+        """
+        Accoda una transazione da confermare. Viene chiamato dal repository sotto il
+        lock di scrittura, prima di pubblicare lo snapshot, quindi l'ordine delle
+        righe è quello dei commit e un errore di serializzazione annulla la
+        transazione. Restituisce il numero di sequenza da passare a sync().
+        """
+        line = dumps({'v': version, 'ops': changes}) + '\n'
+        with self._cond:
+            self._buffer.append(line)
+            self._appended += 1
+            return self._appended
+
+    def sync(self, lsn):
+        """Attende che la riga con numero di sequenza lsn sia su disco (group commit)."""
+        with self._cond:
+            while self._durable < lsn:
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+                # Questo thread diventa leader e scrive tutto il gruppo accodato
+                self._flushing = True
+                batch, self._buffer = self._buffer, []
+                target = self._appended
+                self._cond.release()
+                try:
+                    self._file.write(''.join(batch))
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                finally:
+                    self._cond.acquire()
+                    self._flushing = False
+                self._durable = target
+                self._since_snapshot += len(batch)
+                self._cond.notify_all()
+            compact = (self._repo is not None and not self._compacting
+                       and self._since_snapshot >= self.compact_every)
+            if compact:
+                self._compacting = True
+        if compact:
+            threading.Thread(target=self.checkpoint, daemon=True).start()
+
+    # --- Compattazione ---
+    def checkpoint(self, snapshot=None):
+        """
+        Salva lo stato completo in uno snapshot e rimuove dal journal le
+        transazioni che contiene. Gli scrittori non vengono bloccati durante
+        il salvataggio: lo snapshot del repository è immutabile.
+        """
+        self._compacting = True
+        try:
+            snapshot = snapshot or self._repo.snapshot()
+            save_snapshot(self.snapshot_path, snapshot)
+            self._truncate(snapshot.version)
+        finally:
+            self._compacting = False
+
+    def _truncate(self, version):
+        """Riscrive il journal lasciando solo le transazioni successive allo snapshot."""
+        with self._cond:
+            # Attende il flush in corso e porta su disco le righe accodate
+            while self._flushing:
+                self._cond.wait()
+            self._file.write(''.join(self._buffer))
+            self._buffer = []
+            self._durable = self._appended
+            self._file.flush()
+            entries, _ = self._read_tail(version)
+            tmp_path = self.journal_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for entry in entries:
+                    f.write(dumps(entry) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(tmp_path, self.journal_path)
+            fsync_directory(self.directory)
+            self._file = open(self.journal_path, 'a', encoding='utf-8')
+            self._since_snapshot = len(entries)
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._file.write(''.join(self._buffer))
+            self._buffer = []
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            # Chiudere il file rilascia il lock
+            self._lock_file.close()
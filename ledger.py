@@ -0,0 +1,254 @@
+# Rappresentazione compatta dei dettagli mensili di un servizio cliente.
+# Invece di un dizionario per mese (con il nome del mese ripetuto), un contratto
+# conserva il mese di inizio e tre colonne parallele array('d') per ore lavorate,
+# importo pagato e ore preventivate; le note sono una mappa sparsa
+# posizione -> testo che contiene solo i mesi con una nota.
+#
+# MonthlyLedger si comporta come una sequenza di sola lettura di righe MonthRow,
+# che espongono gli stessi campi dei vecchi dizionari (month, year, month_name,
+# notes, hours_worked, amount_paid, estimated_hours), quindi i template continuano
+# a usare month_data.month_name e simili. Come gli altri record del Repository,
+# un ledger pubblicato non va modificato: updated() restituisce una copia.
+from array import array
+from datetime import datetime
+from functools import lru_cache
+
+from months import MONTH_NAMES, month_index, year_month
+
+NUMERIC_FIELDS = ('hours_worked', 'amount_paid', 'estimated_hours')
+FIELDS = NUMERIC_FIELDS + ('notes',)
+
+# Lunghezze per cui empty() tiene pronta la colonna di zeri da copiare
+ZEROS_CACHE_SIZE = 1024
+
+
+class MonthRow:
+    """Vista di sola lettura su un mese di un MonthlyLedger."""
+
+    __slots__ = ('_ledger', '_offset')
+
+    def __init__(self, ledger, offset):
+        self._ledger = ledger
+        self._offset = offset
+
+    @property
+    def year(self):
+        return (self._ledger.start + self._offset) // 12
+
+    @property
+    def month(self):
+        return (self._ledger.start + self._offset) % 12 + 1
+
+    @property
+    def month_name(self):
+        return MONTH_NAMES[self.month]
+
+    @property
+    def notes(self):
+        return self._ledger.notes.get(self._offset, '')
+
+    @property
+    def hours_worked(self):
+        return self._ledger.hours_worked[self._offset]
+
+    @property
+    def amount_paid(self):
+        return self._ledger.amount_paid[self._offset]
+
+    @property
+    def estimated_hours(self):
+        return self._ledger.estimated_hours[self._offset]
+
+    # Accesso come dizionario, per il codice che usava month_data['year']
+    def __getitem__(self, key):
+        if key not in ('year', 'month', 'month_name') + FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in ('month', 'year', 'month_name') + FIELDS}
+
+    def __repr__(self):
+        return f'MonthRow({self.year}-{self.month:02d})'
+
+
+class MonthlyLedger:
+    """
+    Dettagli mensili di un contratto in forma colonnare. Ogni ledger ha colonne
+    e note proprie, mai condivise con altri ledger: updated() e reframed()
+    restituiscono copie, e solo un ledger appena creato (per esempio da
+    empty()) può essere scritto sul posto prima di essere pubblicato.
+    """
+
+    __slots__ = ('start', 'hours_worked', 'amount_paid', 'estimated_hours', 'notes')
+
+    def __init__(self, start, hours_worked, amount_paid, estimated_hours, notes=None):
+        self.start = start
+        self.hours_worked = hours_worked
+        self.amount_paid = amount_paid
+        self.estimated_hours = estimated_hours
+        self.notes = notes or {}
+
+    @classmethod
+    def empty(cls, start, length):
+        """Ledger di length mesi a partire dal mese start, con tutti i valori a zero."""
+        zeros = _zeros(length)
+        return cls(start, array('d', zeros), array('d', zeros), array('d', zeros))
+
+    @classmethod
+    def for_range(cls, start_date, end_date):
+        """Ledger con un mese per ogni mese tra le due date (estremi inclusi)."""
+        start = month_index(start_date)
+        return cls.empty(start, max(month_index(end_date) - start + 1, 0))
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Costruisce un ledger da righe con le chiavi dei vecchi dizionari mensili
+        (year, month, notes, hours_worked, amount_paid, estimated_hours).
+        """
+        rows = list(rows)
+        if not rows:
+            return cls.empty(0, 0)
+        indexes = [row['year'] * 12 + row['month'] - 1 for row in rows]
+        start = min(indexes)
+        ledger = cls.empty(start, max(indexes) - start + 1)
+        for index, row in zip(indexes, rows):
+            offset = index - start
+            for field in NUMERIC_FIELDS:
+                getattr(ledger, field)[offset] = float(row.get(field) or 0)
+            if row.get('notes'):
+                ledger.notes[offset] = row['notes']
+        return ledger
+
+    # --- Sequenza di sola lettura ---
+    def __len__(self):
+        return len(self.hours_worked)
+
+    def __iter__(self):
+        for offset in range(len(self.hours_worked)):
+            yield MonthRow(self, offset)
+
+    def __getitem__(self, offset):
+        if offset < 0:
+            offset += len(self)
+        if not 0 <= offset < len(self):
+            raise IndexError(offset)
+        return MonthRow(self, offset)
+
+    def __bool__(self):
+        return len(self.hours_worked) > 0
+
+    def __eq__(self, other):
+        if not isinstance(other, MonthlyLedger):
+            return NotImplemented
+        return (self.start == other.start and self.hours_worked == other.hours_worked
+                and self.amount_paid == other.amount_paid
+                and self.estimated_hours == other.estimated_hours and self.notes == other.notes)
+
+    def __repr__(self):
+        return f'MonthlyLedger(start={year_month(self.start)}, months={len(self)})'
+
+    @property
+    def end(self):
+        """Numero progressivo dell'ultimo mese presente."""
+        return self.start + len(self) - 1
+
+    def offset(self, year, month):
+        """Posizione del mese nel ledger oppure None se il mese non è coperto."""
+        offset = year * 12 + month - 1 - self.start
+        return offset if 0 <= offset < len(self) else None
+
+    def reframed(self, start, end):
+        """
+        Restituisce un ledger che copre i mesi da start a end (numeri progressivi,
+        estremi inclusi), conservando i valori e le note dei mesi in comune.
+        Se l'intervallo non cambia restituisce il ledger stesso.
+        """
+        if start == self.start and end == self.end:
+            return self
+        ledger = MonthlyLedger.empty(start, max(end - start + 1, 0))
+        first = max(start, self.start)
+        last = min(end, self.end)
+        if first <= last:
+            source = slice(first - self.start, last - self.start + 1)
+            target = slice(first - start, last - start + 1)
+            for field in NUMERIC_FIELDS:
+                getattr(ledger, field)[target] = getattr(self, field)[source]
+            shift = self.start - start
+            ledger.notes = {offset + shift: text for offset, text in self.notes.items()
+                            if first <= self.start + offset <= last}
+        return ledger
+
+    def extended_to(self, end):
+        """Ledger che arriva almeno fino al mese end (stesso inizio); self se lo copre già."""
+        if end <= self.end:
+            return self
+        return self.reframed(self.start, end)
+
+    def total(self, field, first=None, last=None):
+        """
+        Somma di una colonna numerica; con first e last (numeri progressivi,
+        estremi inclusi) solo dei mesi di quel periodo.
+        """
+        column = getattr(self, field)
+        if first is None and last is None:
+            return sum(column)
+        lo = max((self.start if first is None else first) - self.start, 0)
+        hi = max((self.end if last is None else last) - self.start + 1, 0)
+        return sum(column[lo:hi])
+
+    def updated(self, cells):
+        """
+        Restituisce un nuovo ledger con le celle modificate, date come
+        (posizione, campo, valore). Vengono copiate solo le colonne toccate.
+        """
+        copies = {}
+        for offset, field, value in cells:
+            if field not in copies:
+                if field == 'notes':
+                    copies[field] = dict(self.notes)
+                else:
+                    copies[field] = array('d', getattr(self, field))
+            if field == 'notes':
+                if value:
+                    copies[field][offset] = value
+                else:
+                    copies[field].pop(offset, None)
+            else:
+                copies[field][offset] = value
+        return MonthlyLedger(self.start,
+                             copies.get('hours_worked', self.hours_worked),
+                             copies.get('amount_paid', self.amount_paid),
+                             copies.get('estimated_hours', self.estimated_hours),
+                             copies.get('notes', self.notes))
+
+
+def current_monthly_details(client_service, today=None):
+    """
+    Dettagli mensili di un servizio cliente come vanno mostrati oggi.
+    Per i contratti senza data di fine i mesi trascorsi dall'ultimo salvataggio
+    vengono aggiunti al volo (a zero), senza scrivere nulla nel repository:
+    sono resi persistenti al primo salvataggio dei dettagli mensili. Tutte le
+    letture dei dettagli mensili (pagine, esportazioni, aggregati, analisi e
+    report) passano da qui, così ogni pagina mostra gli stessi mesi.
+    """
+    details = client_service['monthly_details']
+    if client_service.get('end_date') is not None:
+        return details
+    current = month_index(today or datetime.now())
+    if not details:
+        return MonthlyLedger.empty(month_index(client_service['start_date']), 0).extended_to(current)
+    return details.extended_to(current)
+
+
+@lru_cache(maxsize=ZEROS_CACHE_SIZE)
+def _zeros(length):
+    """Colonna di length zeri: fa da modello per le copie (memcpy), non va restituita."""
+    return array('d', bytes(8 * length))
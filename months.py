@@ -0,0 +1,77 @@
+# Mesi come numeri progressivi (anno * 12 + mese - 1), la stessa forma usata
+# dai ledger dei dettagli mensili, dagli aggregati e dalle analisi.
+#
+# Per gli anni da FIRST_YEAR a LAST_YEAR la tabella MONTHS è calcolata una
+# volta all'importazione: ogni voce porta anno, mese, nomi e primo e ultimo
+# giorno, così le rotte e i ledger non ricostruiscono datetime né chiamano
+# calendar.month_name (che formatta una data a ogni accesso) per ogni mese.
+# I mesi fuori dalla tabella vengono calcolati al momento, con lo stesso
+# risultato.
+import calendar
+from collections import namedtuple
+from datetime import datetime
+
+# Anni coperti dalla tabella precalcolata
+FIRST_YEAR = 1970
+LAST_YEAR = 2100
+
+# Nomi dei mesi mostrati nelle pagine
+ITALIAN_MONTHS = ('Gennaio', 'Febbraio', 'Marzo', 'Aprile', 'Maggio', 'Giugno',
+                  'Luglio', 'Agosto', 'Settembre', 'Ottobre', 'Novembre', 'Dicembre')
+
+# Nomi di calendar (quelli dei vecchi dettagli mensili), letti una volta sola
+MONTH_NAMES = tuple(calendar.month_name)
+
+
+class Month(namedtuple('Month', 'index year month name italian_name first_day last_day')):
+    """Un mese della tabella: numero progressivo, anno, mese (1-12), nomi e confini."""
+
+    __slots__ = ()
+
+    @property
+    def label(self):
+        """Nome italiano e anno, per esempio 'Marzo 2024'."""
+        return f'{self.italian_name} {self.year}'
+
+
+def month_index(date_value):
+    """Numero progressivo del mese (anno * 12 + mese - 1) di una data."""
+    return date_value.year * 12 + date_value.month - 1
+
+
+def year_month(index):
+    """Converte un numero progressivo di mese in (anno, mese)."""
+    year, month0 = divmod(index, 12)
+    return year, month0 + 1
+
+
+def _build(index):
+    year, month = year_month(index)
+    return Month(index, year, month, MONTH_NAMES[month], ITALIAN_MONTHS[month - 1],
+                 datetime(year, month, 1), datetime(year, month, calendar.monthrange(year, month)[1]))
+
+
+_FIRST_INDEX = FIRST_YEAR * 12
+MONTHS = tuple(_build(index) for index in range(_FIRST_INDEX, (LAST_YEAR + 1) * 12))
+
+
+def month_info(index):
+    """Voce della tabella per un numero progressivo di mese."""
+    position = index - _FIRST_INDEX
+    if 0 <= position < len(MONTHS):
+        return MONTHS[position]
+    return _build(index)
+
+
+def month_of(date_value):
+    """Voce della tabella per il mese di una data."""
+    return month_info(month_index(date_value))
+
+
+def months_between(first, last):
+    """Voci dei mesi da first a last (numeri progressivi, estremi inclusi)."""
+    if first >= _FIRST_INDEX and last < _FIRST_INDEX + len(MONTHS):
+        yield from MONTHS[first - _FIRST_INDEX:last - _FIRST_INDEX + 1]
+        return
+    for index in range(first, last + 1):
+        yield month_info(index)
@@ -0,0 +1,145 @@
+# Record delle tabelle del CRM come classi con __slots__.
+#
+# Un record come dizionario porta con sé una tabella hash: con una decina di
+# campi sono centinaia di byte per cliente. Con __slots__ i valori stanno in un
+# array di riferimenti dentro l'oggetto, senza __dict__. Le classi espongono la
+# stessa interfaccia in lettura dei dizionari usati finora (record['name'],
+# record.get('city'), 'email' in record, dict(record), {**record}) oltre agli
+# attributi (client.name), quindi template, indici, journal, snapshot ed
+# esportazioni non devono distinguere.
+#
+# Un campo mai assegnato è assente, come una chiave mancante del dizionario:
+# get() restituisce il default e il campo non compare in keys(). I campi fuori
+# dallo schema (dati salvati da versioni precedenti) finiscono in _extra.
+#
+# I record pubblicati non vanno modificati sul posto: replace() restituisce
+# una copia con i campi indicati, come faceva {**record, **fields}.
+
+_MISSING = object()
+
+
+def _make_init(fields):
+    """
+    __init__ con un parametro per campo, generato come fanno dataclasses e
+    namedtuple: un'assegnazione diretta per campo invece di un ciclo con
+    setattr. I campi non passati (o passati come _MISSING) restano assenti.
+    """
+    lines = [f'def __init__(self, *, {", ".join(f"{field}=_MISSING" for field in fields)}, **extra):']
+    for field in fields:
+        lines.append(f'    if {field} is not _MISSING: self.{field} = {field}')
+    lines.append('    self._extra = extra or None')
+    namespace = {'_MISSING': _MISSING}
+    exec('\n'.join(lines), namespace)
+    return namespace['__init__']
+
+
+class Record:
+    """Base dei record: accesso per attributo e per chiave, come un dizionario in sola lettura."""
+
+    __slots__ = ('id', '_extra')
+
+    # Campi dello schema (id escluso), nell'ordine di keys()
+    FIELDS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._FIELDS = ('id',) + cls.FIELDS
+        cls._FIELD_SET = frozenset(cls._FIELDS)
+        cls.__init__ = _make_init(cls._FIELDS)
+
+    def replace(self, **fields):
+        """Copia del record con i campi indicati sostituiti o aggiunti."""
+        values = {field: getattr(self, field, _MISSING) for field in self._FIELDS}
+        if self._extra:
+            values.update(self._extra)
+        values.update(fields)
+        return type(self)(**values)
+
+    def copy(self):
+        return self.replace()
+
+    # --- Interfaccia di dizionario ---
+    def __getitem__(self, field):
+        try:
+            if field in self._FIELD_SET:
+                return getattr(self, field)
+            return self._extra[field]
+        except (AttributeError, KeyError, TypeError):
+            raise KeyError(field) from None
+
+    def get(self, field, default=None):
+        if field in self._FIELD_SET:
+            return getattr(self, field, default)
+        return self._extra.get(field, default) if self._extra else default
+
+    def __contains__(self, field):
+        return self.get(field, _MISSING) is not _MISSING
+
+    def keys(self):
+        keys = [field for field in self._FIELDS if hasattr(self, field)]
+        if self._extra:
+            keys.extend(self._extra)
+        return keys
+
+    def values(self):
+        return [self[field] for field in self.keys()]
+
+    def items(self):
+        return [(field, self[field]) for field in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ', '.join(f'{field}={value!r}' for field, value in self.items())
+        return f'{type(self).__name__}({fields})'
+
+
+class Client(Record):
+    __slots__ = FIELDS = ('name', 'contact', 'email', 'phone', 'vat_id', 'address', 'city', 'zip',
+                          'sdi_code', 'agent', 'call_center', 'created_at')
+
+
+class Prospect(Record):
+    __slots__ = FIELDS = ('name', 'contact', 'email', 'phone', 'notes', 'preventivo', 'graphic_quote_link',
+                          'created_at')
+
+
+class Service(Record):
+    __slots__ = FIELDS = ('name', 'price', 'description')
+
+
+class Collaborator(Record):
+    __slots__ = FIELDS = ('name', 'role', 'email', 'phone')
+
+
+class ClientService(Record):
+    __slots__ = FIELDS = ('client_id', 'service_id', 'subscribed_price', 'start_date', 'end_date', 'notes',
+                          'monthly_details')
+
+
+# Tabella -> classe dei suoi record
+RECORD_TYPES = {
+    'clients': Client,
+    'prospects': Prospect,
+    'services': Service,
+    'collaborators': Collaborator,
+    'client_services': ClientService,
+}
+
+
+def as_record(table, record):
+    """Il record come istanza della classe della tabella (convertito se è un dizionario)."""
+    if isinstance(record, Record):
+        return record
+    return RECORD_TYPES[table](**record)
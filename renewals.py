@@ -0,0 +1,150 @@
+# Scadenze dei servizi cliente e promemoria di rinnovo.
+#
+# RenewalScheduler tiene in una coda a priorità (heap binario) i contratti con
+# una data di fine non ancora passata, ordinati per scadenza. Le rotte che
+# aggiungono, modificano o eliminano un servizio cliente (anche a cascata con
+# il cliente o il servizio) aggiornano la coda con schedule() e cancel(),
+# senza rileggere gli altri contratti; le chiamate sono registrate con
+# on_commit della transazione, così arrivano nell'ordine dei commit.
+#
+# Modifiche ed eliminazioni non cercano la vecchia voce nell'heap: la mappa
+# _entries indica la voce valida di ogni contratto (per identità, così una
+# data tolta e poi rimessa non conta due volte) e le altre vengono scartate
+# quando arrivano in cima o quando la coda, con troppe voci superate, viene
+# ricompattata.
+#
+# tick() controlla solo la cima della coda: se nessun contratto entra nel
+# periodo di preavviso costa O(1), altrimenti estrae i soli contratti in
+# scadenza, li sposta tra i rinnovi da gestire e chiama per ciascuno il task
+# di rinnovo. Lo stato vive in memoria: al riavvio la coda viene ricaricata
+# dal repository e i promemoria ancora validi scattano di nuovo.
+from datetime import datetime, timedelta
+import heapq
+import threading
+
+# Giorni di preavviso con cui scatta il promemoria di rinnovo
+RENEWAL_NOTICE_DAYS = 30
+
+# Voci superate tollerate nell'heap prima di ricompattarlo
+STALE_ENTRIES_LIMIT = 1024
+
+
+class RenewalScheduler:
+    """Coda delle scadenze dei contratti con i promemoria di rinnovo."""
+
+    def __init__(self, task=None, notice_days=RENEWAL_NOTICE_DAYS):
+        self._lock = threading.Lock()
+        self._heap = []         # voci (fine, id), comprese quelle superate
+        self._entries = {}      # id -> voce valida dei contratti in coda
+        self._pending = {}      # id -> fine dei rinnovi scattati e non ancora gestiti
+        self._task = task       # chiamato come task(id, fine) quando scatta un promemoria
+        self.notice = timedelta(days=notice_days)
+
+    def load(self, client_services, now):
+        """Ricostruisce la coda dai servizi cliente che scadono da now in poi (heapify, O(n))."""
+        entries = [(cs['end_date'], cs['id']) for cs in client_services
+                   if cs.get('end_date') is not None and cs['end_date'] >= now]
+        heapq.heapify(entries)
+        with self._lock:
+            self._heap = entries
+            self._entries = {entry[1]: entry for entry in entries}
+            self._pending = {}
+
+    def schedule(self, client_service, now=None):
+        """
+        Registra la scadenza di un servizio cliente aggiunto o modificato. Come
+        in load(), un contratto già scaduto (fine prima di now) non entra in coda.
+        """
+        record_id = client_service['id']
+        end = client_service.get('end_date')
+        if now is None:
+            now = datetime.now()
+        with self._lock:
+            # Una nuova data di fine (per esempio dopo un rinnovo) chiude il promemoria
+            if self._pending.get(record_id) != end:
+                self._pending.pop(record_id, None)
+            if end is None or end < now or record_id in self._pending:
+                self._entries.pop(record_id, None)
+                return
+            current = self._entries.get(record_id)
+            if current is not None and current[0] == end:
+                return
+            entry = (end, record_id)
+            self._entries[record_id] = entry
+            heapq.heappush(self._heap, entry)
+            if len(self._heap) - len(self._entries) > STALE_ENTRIES_LIMIT:
+                self._compact()
+
+    def cancel(self, record_id):
+        """Toglie dalla coda e dai rinnovi da gestire un servizio cliente eliminato."""
+        with self._lock:
+            self._entries.pop(record_id, None)
+            self._pending.pop(record_id, None)
+
+    def dismiss(self, record_id):
+        """Segna come gestito il rinnovo di un contratto."""
+        with self._lock:
+            return self._pending.pop(record_id, None) is not None
+
+    def tick(self, now):
+        """
+        Fa scattare i promemoria dei contratti che scadono entro il preavviso.
+        Restituisce le coppie (fine, id) scattate, in ordine di scadenza.
+        """
+        limit = now + self.notice
+        fired = []
+        with self._lock:
+            heap = self._heap
+            while heap and heap[0][0] <= limit:
+                entry = heapq.heappop(heap)
+                end, record_id = entry
+                if self._entries.get(record_id) is not entry:
+                    continue    # voce superata da una modifica o da un'eliminazione
+                del self._entries[record_id]
+                self._pending[record_id] = end
+                fired.append((end, record_id))
+        if self._task is not None:
+            for end, record_id in fired:
+                self._task(record_id, end)
+        return fired
+
+    def pending(self):
+        """Rinnovi da gestire come coppie (fine, id), in ordine di scadenza."""
+        with self._lock:
+            return sorted((end, record_id) for record_id, end in self._pending.items())
+
+    def expiring(self, now, days):
+        """
+        Contratti che scadono tra now e now + days giorni, come coppie (fine, id)
+        in ordine di scadenza. Visita solo la parte dell'heap con scadenza entro
+        il limite (i figli di un nodo oltre il limite lo sono anch'essi), quindi
+        il costo dipende dai k risultati e non dal numero di contratti in coda.
+        """
+        self.tick(now)
+        limit = now + timedelta(days=days)
+        with self._lock:
+            result = [(end, record_id) for record_id, end in self._pending.items() if now <= end <= limit]
+            heap = self._heap
+            stack = [0] if heap else []
+            while stack:
+                position = stack.pop()
+                entry = heap[position]
+                if entry[0] > limit:
+                    continue
+                if self._entries.get(entry[1]) is entry:
+                    result.append(entry)
+                child = 2 * position + 1
+                if child < len(heap):
+                    stack.append(child)
+                if child + 1 < len(heap):
+                    stack.append(child + 1)
+        result.sort()
+        return result
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _compact(self):
+        """Ricostruisce l'heap con le sole voci valide (chiamata con il lock preso)."""
+        self._heap = list(self._entries.values())
+        heapq.heapify(self._heap)
@@ -0,0 +1,784 @@
+# Livello di accesso ai dati in memoria del CRM.
+# Tutte le rotte di app.py passano da qui invece di scorrere le liste con next():
+# ogni tabella è una mappa id -> record e i servizi cliente hanno due indici
+# secondari (client_id -> servizi cliente, service_id -> servizi cliente).
+#
+# Concorrenza (MVCC): lo stato pubblicato è uno Snapshot immutabile. I lettori
+# prendono il riferimento allo snapshot corrente senza lock e vedono sempre uno
+# stato coerente; gli scrittori lavorano in una Transaction serializzata da un
+# lock, che copia solo le tabelle e i bucket degli indici che modifica
+# (copy-on-write) e al commit pubblica il nuovo snapshot con un solo assegnamento.
+# I record pubblicati non vanno mai modificati sul posto: update() crea sempre
+# un nuovo record (vedi records.py).
+#
+# Indici ordinati: per i campi usati nell'ordinamento delle pagine elenco ogni
+# tabella ha una lista ordinata di coppie (chiave di ordinamento, id), divisa in
+# blocchi (vedi sortedindex.py) così che inserimenti e cancellazioni costino
+# O(log n) anche con il copy-on-write delle transazioni. Le pagine usano la
+# paginazione per chiave (keyset): il cursore è l'ultima coppia mostrata e la
+# pagina successiva parte da lì con una ricerca binaria, quindi il costo non
+# dipende dal numero di pagine già sfogliate; allo stesso modo un intervallo
+# sul campo di ordinamento (per esempio i clienti creati in un anno) è
+# delimitato da due ricerche binarie.
+#
+# Faccette: per i campi di FACETS ogni valore ha una bitmap delle righe che lo
+# contengono (vedi facets.py); filtri e conteggi dell'elenco clienti sono
+# operazioni sui bit invece di scansioni della tabella.
+#
+# Periodi dei contratti: i servizi cliente sono anche in un albero a intervalli
+# persistente su [start_date, end_date] (vedi intervals.py), per trovare i
+# contratti attivi in un periodo senza scorrere la tabella.
+#
+# Id: interi ordinati nel tempo (vedi ids.py); a parità di chiave di
+# ordinamento le voci degli indici seguono quindi l'ordine di creazione.
+from contextlib import contextmanager
+from datetime import datetime
+import threading
+
+from duplicates import DUPLICATE_LIMIT, DuplicateIndex
+from facets import FACETS, FREE_ROWS_LIMIT, RowNumbers, bit_count, bitmap_rows, bitmaps_by_value, facet_value
+from ids import parse_id
+from intervals import IntervalTree, contract_interval
+from records import as_record
+from ledger import NUMERIC_FIELDS, current_monthly_details
+from months import months_between
+from search import SEARCH_LIMIT, SEARCH_TABLES, SearchIndex
+from sortedindex import SortedIndex
+
+TABLES = ('clients', 'prospects', 'services', 'collaborators', 'client_services')
+
+# Campi dei servizi cliente indicizzati, con il nome dell'indice corrispondente
+CLIENT_SERVICE_INDEXES = ('client_id', 'service_id')
+
+# Eliminazioni a cascata: tabella -> indice dei servizi cliente che la referenziano
+CASCADES = {'clients': 'client_id', 'services': 'service_id'}
+
+# Campi con indice ordinato, utilizzabili per ordinare e filtrare le pagine elenco
+ORDERED_INDEXES = {
+    'clients': ('name', 'created_at', 'city', 'agent'),
+    'prospects': ('name', 'created_at'),
+    'services': ('name',),
+    'collaborators': ('name',),
+    # Scadenze dei contratti (vedi Snapshot.client_services_ending)
+    'client_services': ('end_date',),
+}
+
+# Numero di record per pagina
+PAGE_SIZE = 50
+
+# Numero di suggerimenti restituiti dal completamento automatico
+AUTOCOMPLETE_LIMIT = 10
+
+# Numero massimo di valori mostrati per ogni faccetta (quelli selezionati sono sempre inclusi)
+FACET_LIMIT = 15
+
+# Sotto questo numero di righe selezionate dalle faccette la pagina viene
+# ordinata a partire dalla bitmap invece di scorrere l'indice ordinato
+FACET_SORT_LIMIT = 2000
+
+def sort_key(value):
+    """
+    Chiave di ordinamento di un valore: i valori mancanti vengono per primi, i testi
+    sono confrontati senza distinzione tra maiuscole e minuscole e le date come
+    stringhe ISO (così la chiave può essere usata direttamente nel cursore).
+    """
+    if value is None or value == '':
+        return (0, '')
+    if isinstance(value, str):
+        return (1, value.casefold())
+    if isinstance(value, datetime):
+        return (1, value.isoformat())
+    return (1, value)
+
+
+class IntegrityError(Exception):
+    """Violazione di un vincolo dell'archivio (ad esempio un'email già registrata)."""
+
+
+class Snapshot:
+    """
+    Vista immutabile dei dati a una certa versione, con accesso per chiave
+    primaria in O(1). I dizionari conservano l'ordine di inserimento, quindi le
+    liste mostrate nelle pagine restano nello stesso ordine delle vecchie liste globali.
+    """
+
+    def __init__(self, tables, indexes, ordered, facets, rows, intervals, version):
+        self._tables = tables
+        # Indici secondari: valore del campo -> {id servizio cliente: record}
+        self._indexes = indexes
+        # Indici ordinati: (tabella, campo) -> lista ordinata di (chiave, id)
+        self._ordered = ordered
+        # Faccette: (tabella, campo) -> {valore: bitmap delle righe}
+        self._facets = facets
+        # Numerazione delle righe delle tabelle con faccette, condivisa tra gli snapshot
+        self._rows = rows
+        # Periodi dei servizi cliente (IntervalTree immutabile)
+        self._intervals = intervals
+        self.version = version
+
+    def get(self, table, record_id):
+        """Restituisce il record con l'id indicato oppure None."""
+        return self._tables[table].get(record_id)
+
+    def all(self, table):
+        """Restituisce tutti i record di una tabella in ordine di inserimento."""
+        return list(self._tables[table].values())
+
+    def iter_all(self, table):
+        """
+        Scorre i record di una tabella in ordine di inserimento senza copiarli in
+        una lista: lo snapshot non cambia, quindi l'iterazione resta coerente
+        anche se nel frattempo altre transazioni vengono confermate.
+        """
+        return iter(self._tables[table].values())
+
+    def iter_client_services(self):
+        """Scorre tutti i servizi cliente (con i dettagli mensili)."""
+        return self.iter_all('client_services')
+
+    def iter_contract_months(self):
+        """
+        Una riga per ogni mese di ogni servizio cliente (vista piatta per le
+        esportazioni), con i nomi di cliente e servizio. Le righe sono
+        generate una alla volta dai ledger; i contratti in corso arrivano
+        fino al mese attuale.
+        """
+        clients = self._tables['clients']
+        services = self._tables['services']
+        for cs in self._tables['client_services'].values():
+            client = clients.get(cs['client_id'])
+            service = services.get(cs['service_id'])
+            details = current_monthly_details(cs)
+            for offset, entry in enumerate(months_between(details.start, details.end)):
+                row = {
+                    'contract_id': cs['id'],
+                    'client_id': cs['client_id'],
+                    'client_name': client['name'] if client else '',
+                    'service_id': cs['service_id'],
+                    'service_name': service['name'] if service else '',
+                    'year': entry.year,
+                    'month': entry.month,
+                    'notes': details.notes.get(offset, ''),
+                }
+                for field in NUMERIC_FIELDS:
+                    row[field] = getattr(details, field)[offset]
+                yield row
+
+    def count(self, table):
+        """Numero di record presenti in una tabella."""
+        return len(self._tables[table])
+
+    def client_services_for_client(self, client_id):
+        """Servizi sottoscritti da un cliente, tramite l'indice client_id."""
+        return list(self._indexes['client_id'].get(client_id, {}).values())
+
+    def client_services_for_service(self, service_id):
+        """Sottoscrizioni di un servizio di catalogo, tramite l'indice service_id."""
+        return list(self._indexes['service_id'].get(service_id, {}).values())
+
+    def client_services_active(self, start, end):
+        """
+        Servizi cliente il cui periodo si sovrappone a [start, end] (datetime,
+        estremi inclusi), tramite l'indice a intervalli, in ordine di inizio.
+        """
+        client_services = self._tables['client_services']
+        return [client_services[cs_id] for cs_id in self._intervals.overlapping(start, end)]
+
+    def client_services_ending(self, start, end):
+        """
+        Servizi cliente con data di fine in [start, end] (estremi inclusi), in
+        ordine di scadenza, tramite l'indice ordinato su end_date.
+        """
+        entries = self._ordered[('client_services', 'end_date')]
+        client_services = self._tables['client_services']
+        lo = entries.bisect_key_left(sort_key(start))
+        hi = entries.bisect_key_right(sort_key(end))
+        return [client_services[record_id] for _, record_id in entries.irange(lo, hi)]
+
+    def find_client_service(self, client_id, service_id):
+        """Cerca la sottoscrizione di un servizio da parte di un cliente."""
+        for cs in self._indexes['client_id'].get(client_id, {}).values():
+            if cs['service_id'] == service_id:
+                return cs
+        return None
+
+    def subscriptions_for_client(self, client_id):
+        """Coppie (servizio cliente, servizio di catalogo) di un cliente."""
+        services = self._tables['services']
+        return [(cs, services[cs['service_id']])
+                for cs in self._indexes['client_id'].get(client_id, {}).values()
+                if cs['service_id'] in services]
+
+    def page(self, table, order_by, after=None, descending=False, filters=None, facets=None, limit=PAGE_SIZE,
+             ranges=None):
+        """
+        Una pagina di record ordinati per il campo order_by, tramite l'indice ordinato.
+        after è il cursore restituito dalla pagina precedente; filters è un
+        dizionario campo -> valore (uguaglianza senza distinzione di maiuscole)
+        sui campi di ORDERED_INDEXES; ranges è un dizionario campo -> (minimo,
+        massimo), estremi inclusi, sugli stessi campi; facets è una selezione di
+        faccette (vedi facet_bitmap). Restituisce (record, cursore della pagina
+        successiva oppure None se è l'ultima).
+        """
+        entries = self._ordered[(table, order_by)]
+        records = self._tables[table]
+        conditions = {field: sort_key(value) for field, value in (filters or {}).items()}
+        bounds = {field: (sort_key(start), sort_key(end)) for field, (start, end) in (ranges or {}).items()}
+
+        member = None
+        if _selected(facets):
+            bits = self.facet_bitmap(table, facets)
+            rows = self._rows[table]
+            if bit_count(bits) <= FACET_SORT_LIMIT:
+                # Poche righe selezionate: si ordinano direttamente
+                ids = rows.ids
+                entries = SortedIndex(sorted((sort_key(records[ids[row]].get(order_by)), ids[row])
+                                             for row in bitmap_rows(bits)))
+            else:
+                # Molte righe: si scorre l'indice ordinato verificando il bit di ogni record
+                data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+                row_of = rows.rows
+
+                def member(record_id):
+                    row = row_of[record_id]
+                    return (row >> 3) < len(data) and data[row >> 3] >> (row & 7) & 1
+
+        # Un filtro o un intervallo sul campo di ordinamento restringe direttamente le posizioni
+        lo, hi = (0, 0), entries.end
+        if order_by in conditions:
+            key = conditions.pop(order_by)
+            lo, hi = entries.bisect_key_left(key), entries.bisect_key_right(key)
+        if order_by in bounds:
+            low, high = bounds.pop(order_by)
+            lo = max(lo, entries.bisect_key_left(low))
+            hi = min(hi, entries.bisect_key_right(high))
+
+        cursor = _parse_cursor(after)
+        if cursor:
+            if descending:
+                hi = min(hi, entries.bisect_left(cursor))
+            else:
+                lo = max(lo, entries.bisect_right(cursor))
+
+        result = []
+        last = None
+        for entry in entries.irange(lo, hi, reverse=descending):
+            if member is not None and not member(entry[1]):
+                continue
+            record = records[entry[1]]
+            if any(sort_key(record.get(field)) != key for field, key in conditions.items()):
+                continue
+            if any(not low <= sort_key(record.get(field)) <= high for field, (low, high) in bounds.items()):
+                continue
+            if len(result) == limit:
+                return result, [list(last[0]), last[1]]
+            result.append(record)
+            last = entry
+        return result, None
+
+    def facet_bitmap(self, table, selection):
+        """
+        Bitmap delle righe che soddisfano una selezione di faccette
+        {campo: [valori]}: OR tra i valori dello stesso campo, AND tra campi
+        diversi. Senza valori selezionati comprende tutte le righe della tabella.
+        """
+        bits = None
+        for field, values in (selection or {}).items():
+            if not values:
+                continue
+            bucket = self._facets[(table, field)]
+            field_bits = 0
+            for value in values:
+                field_bits |= bucket.get(value, 0)
+            bits = field_bits if bits is None else bits & field_bits
+        if bits is None:
+            # Ogni riga ha esattamente un valore per campo (eventualmente ''):
+            # l'OR dei valori del campo più piccolo comprende tutte le righe
+            bits = 0
+            smallest = min((self._facets[(table, field)] for field in FACETS[table]), key=len)
+            for field_bits in smallest.values():
+                bits |= field_bits
+        return bits
+
+    def facet_counts(self, table, selection=None, limit=FACET_LIMIT):
+        """
+        Conteggi delle faccette per la selezione corrente. Per ogni campo si
+        contano le righe che soddisfano i filtri degli altri campi, così i
+        valori alternativi di una faccetta già filtrata restano sceglibili (OR).
+        Restituisce ({campo: [(valore, conteggio, selezionato)]}, totale), con i
+        valori più frequenti per primi e senza il valore vuoto.
+        """
+        selection = {field: values for field, values in (selection or {}).items() if values}
+        counts = {}
+        for field in FACETS[table]:
+            chosen = set(selection.get(field, ()))
+            others = {other: values for other, values in selection.items() if other != field}
+            base = self.facet_bitmap(table, others) if others else None
+            bucket = self._facets[(table, field)]
+            values = []
+            for value, bits in bucket.items():
+                if not value:
+                    continue
+                count = bit_count(bits & base if base is not None else bits)
+                if count or value in chosen:
+                    values.append((value, count, value in chosen))
+            values.extend((value, 0, True) for value in chosen if value not in bucket)
+            values.sort(key=lambda item: (-item[1], item[0].casefold()))
+            counts[field] = values[:limit] + [item for item in values[limit:] if item[2]]
+        return counts, bit_count(self.facet_bitmap(table, selection))
+
+
+    def prefix_search(self, table, prefix, field='name', limit=AUTOCOMPLETE_LIMIT):
+        """
+        Record il cui campo (di ORDERED_INDEXES) inizia con prefix, senza
+        distinzione di maiuscole, in ordine alfabetico: una ricerca binaria
+        nell'indice ordinato e poi una scansione dei soli risultati.
+        """
+        prefix = prefix.casefold()
+        if not prefix:
+            return []
+        entries = self._ordered[(table, field)]
+        records = self._tables[table]
+        result = []
+        for (rank, value), record_id in entries.irange(entries.bisect_key_left((1, prefix)), entries.end):
+            if len(result) == limit or not (isinstance(value, str) and value.startswith(prefix)):
+                break
+            result.append(records[record_id])
+        return result
+
+
+def _selected(selection):
+    """True se la selezione di faccette contiene almeno un valore."""
+    return bool(selection) and any(selection.values())
+
+
+def _parse_cursor(after):
+    """Cursore [[rango, valore], id] ricevuto dall'URL; None se non valido."""
+    try:
+        (rank, value), record_id = after
+    except (TypeError, ValueError):
+        return None
+    record_id = parse_id(record_id)
+    return None if record_id is None else ((rank, value), record_id)
+
+
+class Transaction(Snapshot):
+    """
+    Copia di lavoro di uno snapshot, visibile solo allo scrittore che la possiede.
+    Tabelle e bucket degli indici vengono copiati alla prima modifica, così lo
+    snapshot di partenza resta intatto per i lettori concorrenti.
+    """
+
+    def __init__(self, base):
+        super().__init__(dict(base._tables), dict(base._indexes), dict(base._ordered),
+                         dict(base._facets), base._rows, base._intervals, base.version + 1)
+        self._own_tables = set()
+        self._own_indexes = set()
+        self._own_buckets = set()
+        self._own_ordered = set()
+        self._own_facets = set()
+        # Modifiche effettuate, nell'ordine: ['put', tabella, record] o ['delete', tabella, id]
+        self.changes = []
+        # Funzioni da chiamare alla conferma (vedi on_commit)
+        self._on_commit = []
+
+    def on_commit(self, callback, *args):
+        """
+        Registra callback(*args) da chiamare quando la transazione viene
+        confermata, ancora sotto il lock di scrittura: gli aggiornamenti
+        derivati (come gli aggregati della dashboard) seguono così l'ordine dei
+        commit. Se la transazione viene annullata la funzione non viene chiamata.
+        """
+        self._on_commit.append((callback, args))
+
+    def insert(self, table, record):
+        """Aggiunge un record alla tabella e aggiorna gli indici. Restituisce il record salvato."""
+        record = as_record(table, record)
+        self._table(table)[record['id']] = record
+        if table == 'client_services':
+            self._index_add(record)
+        for field in ORDERED_INDEXES.get(table, ()):
+            self._ordered_index(table, field).add((sort_key(record.get(field)), record['id']))
+        if table in FACETS:
+            self._facet_add(table, record)
+        self.changes.append(['put', table, record])
+        return record
+
+    def put(self, table, record):
+        """Inserisce il record oppure sostituisce quello con lo stesso id."""
+        old = self._tables[table].get(record['id'])
+        if old is not None:
+            if table == 'client_services':
+                self._index_remove(old)
+            for field in ORDERED_INDEXES.get(table, ()):
+                self._ordered_remove(table, field, old)
+            if table in FACETS:
+                self._facet_remove(table, old)
+        return self.insert(table, record)
+
+    def put_many(self, table, records):
+        """
+        Inserisce in blocco record nuovi (caricamento di uno snapshot,
+        importazione): le chiavi degli indici ordinati vengono ordinate una volta
+        e fuse con quelle esistenti invece di un inserimento per record; le
+        bitmap delle faccette vengono costruite una volta per valore.
+        Restituisce i record salvati.
+        """
+        records = [as_record(table, record) for record in records]
+        rows = self._table(table)
+        # Indice a intervalli vuoto (caricamento): costruito una volta alla fine
+        bulk_intervals = table == 'client_services' and not self._intervals
+        for record in records:
+            rows[record['id']] = record
+            if table == 'client_services':
+                self._index_add(record, interval=not bulk_intervals)
+        if bulk_intervals:
+            self._intervals = IntervalTree.from_intervals((*contract_interval(cs), cs['id']) for cs in records)
+        for field in ORDERED_INDEXES.get(table, ()):
+            self._ordered[(table, field)] = self._ordered[(table, field)].merged(
+                sorted((sort_key(record.get(field)), record['id']) for record in records))
+            self._own_ordered.add((table, field))
+        if table in FACETS:
+            numbered = [(self._rows[table].row(record['id']), record) for record in records]
+            for field in FACETS[table]:
+                bucket = self._facet(table, field)
+                for value, bits in bitmaps_by_value(numbered, field).items():
+                    bucket[value] = bucket.get(value, 0) | bits
+        self.changes.extend(['put', table, record] for record in records)
+        return records
+
+    def insert_many(self, table, records):
+        """Aggiunge in blocco record nuovi. Restituisce i record salvati."""
+        return self.put_many(table, records)
+
+    def update(self, table, record_id, **fields):
+        """
+        Sostituisce un record esistente con una copia che contiene i campi indicati.
+        Restituisce il nuovo record oppure None se non esiste.
+        """
+        record = self._tables[table].get(record_id)
+        if record is None:
+            return None
+        new_record = record.replace(**fields)
+        if table == 'client_services':
+            self._index_remove(record)
+            self._index_add(new_record)
+        for field in ORDERED_INDEXES.get(table, ()):
+            if field in fields and sort_key(record.get(field)) != sort_key(new_record.get(field)):
+                self._ordered_remove(table, field, record)
+                self._ordered_index(table, field).add((sort_key(new_record.get(field)), record_id))
+        if table in FACETS:
+            self._facet_move(table, record, new_record)
+        self._table(table)[record_id] = new_record
+        self.changes.append(['put', table, new_record])
+        return new_record
+
+    def update_months(self, client_service_id, details, cells):
+        """
+        Salva nel servizio cliente il ledger details con le celle indicate
+        (posizione, campo, valore) modificate; vengono copiate solo le colonne
+        toccate. Restituisce il ledger aggiornato oppure None se il servizio
+        cliente non esiste.
+        """
+        record = self.update('client_services', client_service_id, monthly_details=details.updated(cells))
+        return record['monthly_details'] if record else None
+
+    def delete(self, table, record_id):
+        """
+        Elimina un record. Restituisce il record rimosso oppure None.
+        Eliminando un cliente o un servizio di catalogo vengono rimosse anche le
+        sottoscrizioni collegate, trovate tramite l'indice inverso: il costo è
+        proporzionale alle sole sottoscrizioni coinvolte.
+        """
+        if record_id not in self._tables[table]:
+            return None
+        record = self._table(table).pop(record_id)
+        self.changes.append(['delete', table, record_id])
+        for field in ORDERED_INDEXES.get(table, ()):
+            self._ordered_remove(table, field, record)
+        if table in FACETS:
+            self._facet_remove(table, record)
+        if table == 'client_services':
+            self._index_remove(record)
+        elif table in CASCADES:
+            self._cascade(CASCADES[table], record_id)
+        return record
+
+    def delete_many(self, table, record_ids):
+        """Elimina più record in un solo passaggio. Restituisce i record rimossi."""
+        removed = []
+        for record_id in record_ids:
+            record = self.delete(table, record_id)
+            if record is not None:
+                removed.append(record)
+        return removed
+
+    # --- Copy-on-write ---
+    def _table(self, name):
+        if name not in self._own_tables:
+            self._tables[name] = dict(self._tables[name])
+            self._own_tables.add(name)
+        return self._tables[name]
+
+    def _index(self, field):
+        if field not in self._own_indexes:
+            self._indexes[field] = dict(self._indexes[field])
+            self._own_indexes.add(field)
+        return self._indexes[field]
+
+    def _bucket(self, field, key):
+        index = self._index(field)
+        if (field, key) not in self._own_buckets:
+            index[key] = dict(index.get(key, ()))
+            self._own_buckets.add((field, key))
+        return index[key]
+
+    def _ordered_index(self, table, field):
+        if (table, field) not in self._own_ordered:
+            self._ordered[(table, field)] = self._ordered[(table, field)].copy()
+            self._own_ordered.add((table, field))
+        return self._ordered[(table, field)]
+
+    def _ordered_remove(self, table, field, record):
+        self._ordered_index(table, field).discard((sort_key(record.get(field)), record['id']))
+
+    def _facet(self, table, field):
+        if (table, field) not in self._own_facets:
+            self._facets[(table, field)] = dict(self._facets[(table, field)])
+            self._own_facets.add((table, field))
+        return self._facets[(table, field)]
+
+    # --- Manutenzione delle faccette ---
+    def _facet_add(self, table, record):
+        bit = 1 << self._rows[table].row(record['id'])
+        for field in FACETS[table]:
+            bucket = self._facet(table, field)
+            value = facet_value(record, field)
+            bucket[value] = bucket.get(value, 0) | bit
+
+    def _facet_remove(self, table, record):
+        bit = 1 << self._rows[table].row(record['id'])
+        for field in FACETS[table]:
+            self._facet_clear(table, field, facet_value(record, field), bit)
+
+    def _facet_move(self, table, old, new):
+        """Sposta la riga del record tra i valori delle faccette cambiate."""
+        bit = 1 << self._rows[table].row(old['id'])
+        for field in FACETS[table]:
+            old_value, new_value = facet_value(old, field), facet_value(new, field)
+            if old_value != new_value:
+                self._facet_clear(table, field, old_value, bit)
+                bucket = self._facet(table, field)
+                bucket[new_value] = bucket.get(new_value, 0) | bit
+
+    def _compact_rows(self):
+        """
+        Rinumera le righe delle tabelle con faccette che hanno troppe righe
+        libere e ricostruisce le loro bitmap, così la dimensione delle bitmap
+        segue i record presenti e non tutti quelli mai inseriti. La nuova
+        numerazione appartiene solo a questa transazione e ai suoi snapshot.
+        """
+        for table in FACETS:
+            used = len(self._tables[table])
+            if self._rows[table].free(used) <= max(FREE_ROWS_LIMIT, used):
+                continue
+            numbers = RowNumbers()
+            numbered = [(numbers.row(record_id), record) for record_id, record in self._tables[table].items()]
+            self._rows = {**self._rows, table: numbers}
+            for field in FACETS[table]:
+                self._facets[(table, field)] = bitmaps_by_value(numbered, field)
+                self._own_facets.add((table, field))
+
+    def _facet_clear(self, table, field, value, bit):
+        bucket = self._facet(table, field)
+        bits = bucket.get(value, 0) & ~bit
+        if bits:
+            bucket[value] = bits
+        else:
+            bucket.pop(value, None)
+
+    # --- Manutenzione degli indici secondari ---
+    def _index_add(self, cs, interval=True):
+        for field in CLIENT_SERVICE_INDEXES:
+            self._bucket(field, cs[field])[cs['id']] = cs
+        if interval:
+            start, end = contract_interval(cs)
+            self._intervals = self._intervals.inserted(start, end, cs['id'])
+
+    def _cascade(self, field, record_id):
+        """Rimuove le sottoscrizioni che referenziano il record eliminato."""
+        bucket = self._index(field).pop(record_id, None)
+        self._own_buckets.discard((field, record_id))
+        if not bucket:
+            return
+        client_services = self._table('client_services')
+        for cs_id, cs in bucket.items():
+            client_services.pop(cs_id, None)
+            self.changes.append(['delete', 'client_services', cs_id])
+            for other in CLIENT_SERVICE_INDEXES:
+                if other != field:
+                    self._index_discard(other, cs)
+            for ordered in ORDERED_INDEXES['client_services']:
+                self._ordered_remove('client_services', ordered, cs)
+            self._intervals = self._intervals.removed(cs['start_date'], cs_id)
+
+    def _index_remove(self, cs):
+        for field in CLIENT_SERVICE_INDEXES:
+            self._index_discard(field, cs)
+        self._intervals = self._intervals.removed(cs['start_date'], cs['id'])
+
+    def _index_discard(self, field, cs):
+        key = cs[field]
+        if key not in self._indexes[field]:
+            return
+        bucket = self._bucket(field, key)
+        bucket.pop(cs['id'], None)
+        if not bucket:
+            del self._indexes[field][key]
+            self._own_buckets.discard((field, key))
+
+
+class Repository:
+    """
+    Archivio in memoria condiviso tra i thread che servono le richieste.
+    Le letture usano lo snapshot corrente e non attendono mai gli scrittori;
+    le scritture sono serializzate e atomiche.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = Snapshot({name: {} for name in TABLES},
+                                  {field: {} for field in CLIENT_SERVICE_INDEXES},
+                                  {(table, field): SortedIndex() for table, fields in ORDERED_INDEXES.items() for field in fields},
+                                  {(table, field): {} for table, fields in FACETS.items() for field in fields},
+                                  {table: RowNumbers() for table in FACETS},
+                                  IntervalTree(),
+                                  0)
+        self._journal = None
+        # Indice di ricerca testuale, aggiornato a ogni commit
+        self._search = SearchIndex()
+        # Indici per il rilevamento dei clienti duplicati, aggiornati a ogni commit
+        self._duplicates = DuplicateIndex()
+
+    def attach_journal(self, journal):
+        """Da qui in poi ogni transazione confermata viene registrata nel journal."""
+        self._journal = journal
+        journal.attach(self)
+
+    def snapshot(self):
+        """Restituisce lo snapshot pubblicato più recente (lettura senza lock)."""
+        return self._snapshot
+
+    @contextmanager
+    def transaction(self):
+        """
+        Apre una transazione di scrittura. Le modifiche diventano visibili ai
+        lettori tutte insieme all'uscita dal blocco; se il blocco solleva
+        un'eccezione vengono scartate.
+        """
+        lsn = None
+        with self._lock:
+            tx = Transaction(self._snapshot)
+            yield tx
+            # Prima si serializza nel journal: se le modifiche non sono
+            # registrabili la transazione fallisce senza essere pubblicata
+            if self._journal is not None and tx.changes:
+                lsn = self._journal.append(tx.version, tx.changes)
+            tx._compact_rows()
+            self._snapshot = Snapshot(tx._tables, tx._indexes, tx._ordered, tx._facets, tx._rows,
+                                      tx._intervals, tx.version)
+            self._search.apply(tx.changes)
+            self._duplicates.apply(tx.changes)
+            for callback, args in tx._on_commit:
+                callback(*args)
+        # L'attesa del disco avviene fuori dal lock: i commit concorrenti
+        # vengono scritti insieme con un solo fsync
+        if lsn is not None:
+            self._journal.sync(lsn)
+
+    def load(self, version, tables):
+        """
+        Carica in blocco i record di uno snapshot salvato (avvio dell'applicazione).
+        Il caricamento non viene registrato nel journal.
+        """
+        with self._lock:
+            tx = Transaction(self._snapshot)
+            for table, records in tables.items():
+                tx.put_many(table, records)
+            self._snapshot = Snapshot(tx._tables, tx._indexes, tx._ordered, tx._facets, tx._rows,
+                                      tx._intervals, version)
+            self._search.apply(tx.changes)
+            self._duplicates.apply(tx.changes)
+
+    # --- Letture sullo snapshot corrente ---
+    def get(self, table, record_id):
+        return self._snapshot.get(table, record_id)
+
+    def all(self, table):
+        return self._snapshot.all(table)
+
+    def count(self, table):
+        return self._snapshot.count(table)
+
+    def client_services_for_client(self, client_id):
+        return self._snapshot.client_services_for_client(client_id)
+
+    def client_services_for_service(self, service_id):
+        return self._snapshot.client_services_for_service(service_id)
+
+    def client_services_active(self, start, end):
+        return self._snapshot.client_services_active(start, end)
+
+    def client_services_ending(self, start, end):
+        return self._snapshot.client_services_ending(start, end)
+
+    def find_client_service(self, client_id, service_id):
+        return self._snapshot.find_client_service(client_id, service_id)
+
+    def subscriptions_for_client(self, client_id):
+        return self._snapshot.subscriptions_for_client(client_id)
+
+    def page(self, table, order_by, after=None, descending=False, filters=None, facets=None, limit=PAGE_SIZE,
+             ranges=None):
+        return self._snapshot.page(table, order_by, after, descending, filters, facets, limit, ranges)
+
+    def facet_counts(self, table, selection=None, limit=FACET_LIMIT):
+        return self._snapshot.facet_counts(table, selection, limit)
+
+    def prefix_search(self, table, prefix, field='name', limit=AUTOCOMPLETE_LIMIT):
+        return self._snapshot.prefix_search(table, prefix, field, limit)
+
+    def search(self, query, tables=SEARCH_TABLES, limit=SEARCH_LIMIT):
+        """Ricerca testuale su clienti e potenziali clienti; coppie (tabella, record)."""
+        return self._search.search(self._snapshot, query, tables, limit)
+
+    def find_duplicates(self, record, exclude_id=None, limit=DUPLICATE_LIMIT):
+        """
+        Clienti che potrebbero coincidere con record (vedi DuplicateIndex.find):
+        terne (cliente, motivo, similarità). Chiamata dentro una transazione
+        vede tutti i commit precedenti, quindi controllo e inserimento sono atomici.
+        """
+        snapshot = self._snapshot
+        found = []
+        for record_id, reason, score in self._duplicates.find(record, exclude_id, limit):
+            client = snapshot.get('clients', record_id)
+            if client is not None:
+                found.append((client, reason, score))
+        return found
+
+    # --- Scritture in una transazione singola ---
+    def insert(self, table, record):
+        with self.transaction() as tx:
+            return tx.insert(table, record)
+
+    def update(self, table, record_id, **fields):
+        with self.transaction() as tx:
+            return tx.update(table, record_id, **fields)
+
+    def delete(self, table, record_id):
+        with self.transaction() as tx:
+            return tx.delete(table, record_id)
+
+    def delete_many(self, table, record_ids):
+        with self.transaction() as tx:
+            return tx.delete_many(table, record_ids)
@@ -0,0 +1,272 @@
+# Aggregati per la dashboard: fatturato, pagato, ore lavorate e ore
+# preventivate per cliente, servizio, agente e mese, più l'MRR.
+#
+# Gli aggregati vengono calcolati una volta all'avvio e poi aggiornati per
+# differenza: le rotte che salvano un servizio cliente (o i suoi dettagli
+# mensili) chiamano contract_saved(), che toglie il contributo della versione
+# precedente del contratto e aggiunge quello nuovo. Le chiamate sono
+# registrate con on_commit() della transazione che salva il contratto, così
+# arrivano nello stesso ordine dei commit: con due salvataggi concorrenti
+# l'ultima versione vista è sempre quella confermata per ultima. La dashboard
+# legge valori già pronti invece di scorrere i dettagli mensili di tutti i
+# contratti.
+#
+# Il calcolo iniziale può richiedere secondi con molti contratti su SQLite,
+# quindi load() costruisce gli aggregati senza bloccare le rotte: gli
+# aggiornamenti che arrivano da begin_load() in poi (chiamata prima di
+# prendere lo snapshot da caricare) vengono accodati e riapplicati alla fine.
+# Riapplicarli è sempre corretto, perché ognuno sostituisce la versione del
+# contratto vista dal caricamento, vecchia o nuova che sia.
+#
+# Il fatturato di un contratto è il prezzo concordato per ogni mese presente
+# nei suoi dettagli mensili. I contratti senza data di fine contano fino al
+# mese corrente (ledger.current_monthly_details, come le pagine): ogni
+# contratto viene conservato con i dettagli già estesi, così la differenza
+# toglie esattamente quello che era stato aggiunto, e al cambio di mese le
+# letture estendono una volta sola i contratti in corso. L'MRR è invece la
+# somma dei prezzi dei contratti attivi in un mese secondo le date di inizio e
+# fine: ogni contratto aggiunge il prezzo al mese di inizio e lo toglie dal
+# mese successivo alla fine, e l'MRR di un mese è la somma progressiva fino a
+# quel mese (memorizzata per il mese corrente e corretta a ogni modifica).
+from collections import Counter
+from datetime import datetime
+import heapq
+import threading
+
+from facets import facet_value
+from ledger import current_monthly_details
+from months import month_index, month_info
+
+# Misure di ogni aggregato, nell'ordine dei vettori interni
+MEASURES = ('billed', 'amount_paid', 'hours_worked', 'estimated_hours', 'contracts')
+
+# Dimensioni degli aggregati
+DIMENSIONS = ('client', 'service', 'agent', 'month')
+
+
+def _measures(vector):
+    return dict(zip(MEASURES, vector))
+
+
+class _Totals:
+    """Stato degli aggregati; i metodi non prendono lock."""
+
+    def __init__(self):
+        self.totals = {dimension: {} for dimension in DIMENSIONS}
+        self.grand = [0.0] * len(MEASURES)
+        self.contracts = {}         # id -> ultima versione vista del servizio cliente
+        self.by_client = {}         # id cliente -> id dei suoi servizi cliente
+        self.by_service = {}        # id servizio -> id dei servizi cliente
+        self.agents = {}            # id cliente -> agente
+        self.mrr_starts = Counter()     # mese -> prezzi dei contratti che iniziano
+        self.mrr_ends = Counter()       # mese -> prezzi dei contratti finiti il mese prima
+        self.mrr = None                 # (mese, MRR del mese) per l'ultimo mese richiesto
+        self.generation = 0             # cresce a ogni modifica di contratti o agenti
+        self.month = month_index(datetime.now())    # mese fino a cui arrivano i contratti in corso
+
+    def contract_saved(self, client_service):
+        self.contract_deleted(client_service['id'])
+        self.generation += 1
+        if client_service.get('end_date') is None:
+            details = current_monthly_details(client_service, today=month_info(self.month).first_day)
+            if details is not client_service['monthly_details']:
+                client_service = client_service.replace(monthly_details=details)
+        self._add_contract(client_service, 1)
+        record_id = client_service['id']
+        self.contracts[record_id] = client_service
+        self.by_client.setdefault(client_service['client_id'], set()).add(record_id)
+        self.by_service.setdefault(client_service['service_id'], set()).add(record_id)
+
+    def contract_deleted(self, client_service_id):
+        old = self.contracts.pop(client_service_id, None)
+        if old is None:
+            return
+        self.generation += 1
+        self._add_contract(old, -1)
+        for index, key in ((self.by_client, old['client_id']), (self.by_service, old['service_id'])):
+            ids = index[key]
+            ids.discard(client_service_id)
+            if not ids:
+                del index[key]
+
+    def client_saved(self, client):
+        agent = facet_value(client, 'agent')
+        old = self.agents.get(client['id'], '')
+        self.agents[client['id']] = agent
+        if old != agent:
+            self.generation += 1
+        totals = self.totals['client'].get(client['id'])
+        if old != agent and totals is not None:
+            self._add('agent', old, list(totals), -1)
+            self._add('agent', agent, list(totals), 1)
+
+    def client_deleted(self, client_id):
+        for client_service_id in list(self.by_client.get(client_id, ())):
+            self.contract_deleted(client_service_id)
+        self.agents.pop(client_id, None)
+
+    def service_deleted(self, service_id):
+        for client_service_id in list(self.by_service.get(service_id, ())):
+            self.contract_deleted(client_service_id)
+
+    def roll_over(self, month):
+        """Passaggio al mese indicato: i contratti in corso ricevono i mesi mancanti."""
+        if month <= self.month:
+            return
+        self.month = month
+        for client_service in [cs for cs in self.contracts.values() if cs.get('end_date') is None]:
+            self.contract_saved(client_service)
+
+    def _add_contract(self, client_service, sign):
+        client_id = client_service['client_id']
+        details = client_service['monthly_details']
+        price = client_service.get('subscribed_price') or 0.0
+        vector = (price * len(details), details.total('amount_paid'), details.total('hours_worked'),
+                  details.total('estimated_hours'), 1)
+        self._add('client', client_id, vector, sign)
+        self._add('service', client_service['service_id'], vector, sign)
+        self._add('agent', self.agents.get(client_id, ''), vector, sign)
+        for offset in range(len(details)):
+            self._add('month', details.start + offset, (price, details.amount_paid[offset],
+                      details.hours_worked[offset], details.estimated_hours[offset], 1), sign)
+        for position, value in enumerate(vector):
+            self.grand[position] += sign * value
+
+        start = month_index(client_service['start_date'])
+        end = month_index(client_service['end_date']) + 1 if client_service.get('end_date') else None
+        self.mrr_starts[start] += sign * price
+        if end is not None:
+            self.mrr_ends[end] += sign * price
+        if self.mrr is not None and start <= self.mrr[0] and (end is None or self.mrr[0] < end):
+            self.mrr = (self.mrr[0], self.mrr[1] + sign * price)
+
+    def _add(self, dimension, key, vector, sign):
+        totals = self.totals[dimension]
+        current = totals.get(key)
+        if current is None:
+            current = totals[key] = [0.0] * len(MEASURES)
+        for position, value in enumerate(vector):
+            current[position] += sign * value
+        if current[-1] <= 0:
+            # Nessun contratto (o mese di contratto) rimasto: la voce sparisce
+            del totals[key]
+
+
+class Rollups:
+    """Aggregati della dashboard aggiornati per differenza."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = _Totals()
+        self._queued = None         # aggiornamenti arrivati durante load(), altrimenti None
+        self.ready = False
+
+    def begin_load(self):
+        """
+        Inizia ad accodare gli aggiornamenti per load(). Va chiamata prima di
+        prendere lo snapshot da cui leggere i dati: un commit avvenuto dopo lo
+        snapshot arriva così nella coda invece che nello stato da sostituire.
+        """
+        with self._lock:
+            if self._queued is None:
+                self._queued = []
+
+    def load(self, clients, client_services):
+        """
+        Calcola tutti gli aggregati; i servizi cliente vanno passati con i
+        dettagli mensili, letti da uno snapshot preso dopo begin_load(). Le
+        rotte possono continuare ad aggiornare gli aggregati mentre il calcolo
+        è in corso.
+        """
+        self.begin_load()
+        state = _Totals()
+        for client in clients:
+            state.agents[client['id']] = facet_value(client, 'agent')
+        for client_service in client_services:
+            state.contract_saved(client_service)
+        with self._lock:
+            for name, argument in self._queued:
+                getattr(state, name)(argument)
+            # La generazione non deve mai tornare a un valore già visto
+            state.generation += self._state.generation + 1
+            self._state = state
+            self._queued = None
+            self.ready = True
+
+    # --- Aggiornamenti per differenza ---
+    def contract_saved(self, client_service):
+        """Servizio cliente aggiunto o modificato (date, prezzo o dettagli mensili)."""
+        self._apply('contract_saved', client_service)
+
+    def contract_deleted(self, client_service_id):
+        self._apply('contract_deleted', client_service_id)
+
+    def client_saved(self, client):
+        """Cliente aggiunto o modificato: se cambia l'agente i suoi totali passano al nuovo agente."""
+        self._apply('client_saved', client)
+
+    def client_deleted(self, client_id):
+        """Cliente eliminato, insieme ai suoi servizi cliente (come nel repository)."""
+        self._apply('client_deleted', client_id)
+
+    def service_deleted(self, service_id):
+        """Servizio di catalogo eliminato, insieme alle sottoscrizioni."""
+        self._apply('service_deleted', service_id)
+
+    def _apply(self, name, argument):
+        with self._lock:
+            if self._queued is not None:
+                self._queued.append((name, argument))
+            getattr(self._state, name)(argument)
+
+    def _current(self):
+        """Stato degli aggregati aggiornato al mese corrente (da chiamare sotto il lock)."""
+        self._state.roll_over(month_index(datetime.now()))
+        return self._state
+
+    # --- Letture ---
+    def totals(self):
+        """Totali complessivi."""
+        with self._lock:
+            return _measures(self._current().grand)
+
+    def get(self, dimension, key):
+        """Totali di una voce di una dimensione (None se non ha contratti)."""
+        with self._lock:
+            vector = self._current().totals[dimension].get(key)
+            return _measures(vector) if vector is not None else None
+
+    def top(self, dimension, limit, measure='billed'):
+        """Le voci con la misura più alta, come coppie (chiave, totali)."""
+        position = MEASURES.index(measure)
+        with self._lock:
+            items = heapq.nlargest(limit, self._current().totals[dimension].items(), key=lambda item: item[1][position])
+            return [(key, _measures(vector)) for key, vector in items]
+
+    def months(self, first, last):
+        """Totali dei mesi da first a last (numeri progressivi), anche se vuoti."""
+        with self._lock:
+            months = self._current().totals['month']
+            empty = [0.0] * len(MEASURES)
+            return [(month, _measures(months.get(month, empty))) for month in range(first, last + 1)]
+
+    def contracts(self):
+        """
+        Ultima versione vista di tutti i servizi cliente e agente di ogni cliente,
+        come (generazione, servizi cliente, agenti). La generazione cambia a ogni
+        modifica: chi tiene copie derivate dei contratti la usa per capire se
+        sono ancora valide.
+        """
+        with self._lock:
+            state = self._current()
+            return state.generation, list(state.contracts.values()), dict(state.agents)
+
+    def mrr(self, month):
+        """Ricavo mensile ricorrente dei contratti attivi nel mese (numero progressivo)."""
+        with self._lock:
+            state = self._current()
+            if state.mrr is None or state.mrr[0] != month:
+                value = (sum(price for start, price in state.mrr_starts.items() if start <= month)
+                         - sum(price for end, price in state.mrr_ends.items() if end <= month))
+                state.mrr = (month, value)
+            return state.mrr[1]
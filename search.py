@@ -0,0 +1,188 @@
+# Indice di ricerca testuale in memoria per clienti e potenziali clienti.
+# Indice invertito a trigrammi: ogni campo indicizzato viene normalizzato
+# (minuscole, senza accenti), racchiuso tra spazi e scomposto in trigrammi;
+# per ogni trigramma si conserva la lista ordinata dei documenti che lo contengono
+# (array di interi). Una parola di ricerca di almeno tre caratteri trova le
+# sottostringhe (partite IVA, email, CAP...), una di due caratteri trova le
+# parole che iniziano così grazie al trigramma con lo spazio iniziale (" ro").
+#
+# I numeri di documento crescono sempre, quindi un nuovo documento si aggiunge
+# in coda alle liste senza riordinarle. Modificare un record equivale a
+# eliminarlo e reinserirlo con un nuovo numero; i documenti eliminati restano
+# nelle liste come "morti" finché non sono troppi, poi l'indice viene ricompattato.
+#
+# L'indice è aggiornato dal Repository a ogni commit (sotto il lock di
+# scrittura) e interrogato dai lettori con un lock proprio. I candidati vengono
+# verificati sul testo normalizzato (i trigrammi da soli possono dare falsi
+# positivi) e i record restituiti sono letti dallo snapshot del lettore, quindi
+# quelli eliminati nel frattempo vengono scartati.
+from array import array
+from bisect import bisect_left
+import threading
+import unicodedata
+
+# Tabelle e campi indicizzati
+SEARCH_TABLES = ('clients', 'prospects')
+SEARCH_FIELDS = ('name', 'contact', 'email', 'vat_id', 'city', 'zip', 'agent', 'call_center')
+
+# Numero massimo di risultati restituiti da una ricerca
+SEARCH_LIMIT = 50
+
+# Ricompatta l'indice quando i documenti morti superano questa quota dei documenti totali
+COMPACT_RATIO = 0.5
+COMPACT_MIN_DEAD = 1000
+
+
+def normalize(text):
+    """Testo in minuscolo, senza accenti e con gli spazi compattati."""
+    text = str(text)
+    if text.isascii():
+        # Caso più frequente: nessun accento da rimuovere
+        return ' '.join(text.lower().split())
+    text = unicodedata.normalize('NFKD', text.casefold())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(text.split())
+
+
+def trigrams(text):
+    """Trigrammi del testo racchiuso tra spazi (inizio e fine parola inclusi)."""
+    padded = f' {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _query_terms(query):
+    """
+    Trigrammi da cercare per ogni parola della ricerca: sottostringa per le
+    parole di almeno tre caratteri, inizio di parola per quelle di due.
+    Le parole di un solo carattere non hanno trigrammi e valgono solo come verifica.
+    """
+    terms = []
+    for term in normalize(query).split():
+        if len(term) >= 3:
+            grams = {term[i:i + 3] for i in range(len(term) - 2)}
+        elif len(term) == 2:
+            grams = {' ' + term}
+        else:
+            grams = set()
+        terms.append((term, grams))
+    return terms
+
+
+def _term_matches(term, texts):
+    if len(term) >= 3:
+        return any(term in text for text in texts)
+    return any(text.startswith(term) or ' ' + term in text for text in texts)
+
+
+def _contains(postings, doc):
+    position = bisect_left(postings, doc)
+    return position < len(postings) and postings[position] == doc
+
+
+class SearchIndex:
+    """Indice invertito a trigrammi sui campi di SEARCH_FIELDS."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = {}      # trigramma -> array('I') di numeri di documento
+        self._docs = []          # numero di documento -> (tabella, id) oppure None se eliminato
+        self._texts = []         # numero di documento -> campi normalizzati (per la verifica)
+        self._doc_of = {}        # (tabella, id) -> numero di documento
+        self._dead = 0
+
+    # --- Aggiornamento ---
+    def apply(self, changes):
+        """Applica le modifiche di una transazione confermata (['put'|'delete', tabella, ...])."""
+        with self._lock:
+            for op, table, payload in changes:
+                if table not in SEARCH_TABLES:
+                    continue
+                if op == 'put':
+                    self._remove(table, payload['id'])
+                    self._add(table, payload)
+                else:
+                    self._remove(table, payload)
+            if self._dead >= COMPACT_MIN_DEAD and self._dead > len(self._docs) * COMPACT_RATIO:
+                self._compact()
+
+    def _add(self, table, record):
+        texts = tuple(normalize(record[field]) for field in SEARCH_FIELDS if record.get(field))
+        doc = len(self._docs)
+        self._docs.append((table, record['id']))
+        self._texts.append(texts)
+        self._doc_of[(table, record['id'])] = doc
+        grams = set()
+        for text in texts:
+            grams |= trigrams(text)
+        for gram in grams:
+            postings = self._postings.get(gram)
+            if postings is None:
+                postings = self._postings[gram] = array('I')
+            postings.append(doc)
+
+    def _remove(self, table, record_id):
+        doc = self._doc_of.pop((table, record_id), None)
+        if doc is not None:
+            self._docs[doc] = None
+            self._texts[doc] = None
+            self._dead += 1
+
+    def _compact(self):
+        """Rinumera i documenti vivi e ricostruisce le liste senza quelli eliminati."""
+        renumber = {}
+        docs = []
+        texts = []
+        for doc, key in enumerate(self._docs):
+            if key is not None:
+                renumber[doc] = len(docs)
+                docs.append(key)
+                texts.append(self._texts[doc])
+        postings = {}
+        for gram, old in self._postings.items():
+            new = array('I', (renumber[doc] for doc in old if doc in renumber))
+            if new:
+                postings[gram] = new
+        self._postings = postings
+        self._docs = docs
+        self._texts = texts
+        self._doc_of = {key: doc for doc, key in enumerate(docs)}
+        self._dead = 0
+
+    # --- Ricerca ---
+    def search(self, snapshot, query, tables=SEARCH_TABLES, limit=SEARCH_LIMIT):
+        """
+        Cerca i record che contengono tutte le parole della ricerca in almeno
+        uno dei campi indicizzati. Restituisce coppie (tabella, record) lette
+        dallo snapshot, dalle modifiche più recenti alle più vecchie.
+        """
+        terms = _query_terms(query)
+        grams = set().union(*(term_grams for _, term_grams in terms)) if terms else set()
+        if not grams:
+            return []
+        results = []
+        with self._lock:
+            lists = [self._postings.get(gram) for gram in grams]
+            if any(postings is None for postings in lists):
+                return []
+            lists.sort(key=len)
+            smallest, others = lists[0], lists[1:]
+            # I candidati sono scorsi dal più recente e la ricerca si ferma al limite
+            for doc in reversed(smallest):
+                key = self._docs[doc]
+                if key is None or key[0] not in tables:
+                    continue
+                if not all(_contains(postings, doc) for postings in others):
+                    continue
+                texts = self._texts[doc]
+                if not all(_term_matches(term, texts) for term, _ in terms):
+                    continue
+                results.append(key)
+                if len(results) == limit:
+                    break
+        # Lettura dei record dallo snapshot, fuori dal lock dell'indice
+        found = []
+        for table, record_id in results:
+            record = snapshot.get(table, record_id)
+            if record is not None:
+                found.append((table, record))
+        return found
@@ -0,0 +1,150 @@
+# Formato binario msgpack per gli snapshot completi del Repository in memoria.
+# Ogni tabella è salvata in forma colonnare: l'elenco dei campi una sola volta e
+# poi una riga (array msgpack) per record, senza ripetere le chiavi.
+# Le date usano un tipo di estensione dedicato (microsecondi dall'epoca, int64),
+# così il caricamento non deve interpretare stringhe ISO.
+# I dettagli mensili (MonthlyLedger) sono salvati come byte grezzi delle colonne
+# array('d'), che in lettura vengono ricostruite con una semplice copia di memoria.
+# Gli id a 128 bit (vedi ids.py) non stanno negli interi msgpack e usano
+# un'estensione di 16 byte; quelli salvati come stringhe uuid dalle versioni
+# precedenti vengono convertiti in interi in lettura.
+# I file possono essere letti tramite mmap: il decoder lavora direttamente sulle
+# pagine del file senza copiarlo prima in memoria.
+from array import array
+from datetime import datetime, timedelta
+import mmap
+import os
+import struct
+import sys
+
+import msgpack
+
+from ids import migrate_record
+from ledger import MonthlyLedger
+from repository import TABLES
+
+# Codici dei tipi di estensione msgpack
+EXT_DATETIME = 1
+EXT_MISSING = 2     # campo assente nel record (diverso da None)
+EXT_LEDGER = 3      # dettagli mensili in forma colonnare
+EXT_ID = 4          # interi oltre i 64 bit (id), big-endian su 16 byte
+
+FORMAT_VERSION = 2
+EPOCH = datetime(1970, 1, 1)
+_INT64 = struct.Struct('>q')
+_MISSING = msgpack.ExtType(EXT_MISSING, b'')
+
+
+def _column_bytes(column):
+    # Le colonne sono salvate sempre in little-endian
+    if sys.byteorder == 'big':
+        column = array('d', column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def _column(data):
+    column = array('d')
+    column.frombytes(data)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        delta = value - EPOCH
+        micros = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+        return msgpack.ExtType(EXT_DATETIME, _INT64.pack(micros))
+    if isinstance(value, MonthlyLedger):
+        payload = msgpack.packb([value.start, _column_bytes(value.hours_worked), _column_bytes(value.amount_paid),
+                                 _column_bytes(value.estimated_hours), list(value.notes.items())],
+                                use_bin_type=True)
+        return msgpack.ExtType(EXT_LEDGER, payload)
+    if isinstance(value, int):
+        return msgpack.ExtType(EXT_ID, value.to_bytes(16, 'big'))
+    raise TypeError(f'Tipo non serializzabile: {type(value).__name__}')
+
+
+def _ext_hook(code, data):
+    if code == EXT_DATETIME:
+        return EPOCH + timedelta(microseconds=_INT64.unpack(data)[0])
+    if code == EXT_MISSING:
+        return _MISSING
+    if code == EXT_LEDGER:
+        start, hours_worked, amount_paid, estimated_hours, notes = msgpack.unpackb(data, raw=False)
+        return MonthlyLedger(start, _column(hours_worked), _column(amount_paid), _column(estimated_hours),
+                             dict(notes))
+    if code == EXT_ID:
+        return int.from_bytes(data, 'big')
+    return msgpack.ExtType(code, data)
+
+
+def pack_tables(version, tables):
+    """Serializza {tabella: [record]} nel formato colonnare dello snapshot."""
+    packed = {}
+    for table, records in tables.items():
+        fields = []
+        seen = set()
+        for record in records:
+            for field in record:
+                if field not in seen:
+                    seen.add(field)
+                    fields.append(field)
+        rows = [[record.get(field, _MISSING) for field in fields] for record in records]
+        packed[table] = {'fields': fields, 'rows': rows}
+    return msgpack.packb({'format': FORMAT_VERSION, 'version': version, 'tables': packed},
+                         default=_default, use_bin_type=True)
+
+
+def unpack_tables(buffer):
+    """Decodifica uno snapshot; restituisce (versione, {tabella: [record]})."""
+    data = msgpack.unpackb(buffer, ext_hook=_ext_hook, raw=False, strict_map_key=False)
+    # Fino al formato 1 gli id erano stringhe uuid
+    legacy_ids = data['format'] < 2
+    tables = {}
+    for table, packed in data['tables'].items():
+        fields = packed['fields']
+        records = []
+        for row in packed['rows']:
+            record = dict(zip(fields, row))
+            if _MISSING in row:
+                record = {field: value for field, value in record.items() if value != _MISSING}
+            if legacy_ids:
+                migrate_record(record)
+            records.append(record)
+        tables[table] = records
+    return data['version'], tables
+
+
+def save_snapshot(path, snapshot):
+    """Scrive lo snapshot del repository su file in modo atomico (file temporaneo + rename)."""
+    payload = pack_tables(snapshot.version, {table: snapshot.all(table) for table in TABLES})
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_directory(os.path.dirname(path) or '.')
+    return len(payload)
+
+
+def fsync_directory(directory):
+    """Rende persistente la rinomina di un file nella cartella (fsync della cartella, solo POSIX)."""
+    if os.name != 'posix':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def load_snapshot(path, use_mmap=True):
+    """Legge uno snapshot da file, di default mappandolo in memoria con mmap."""
+    with open(path, 'rb') as f:
+        if not use_mmap or os.fstat(f.fileno()).st_size == 0:
+            return unpack_tables(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return unpack_tables(buffer)
@@ -0,0 +1,185 @@
+# Indici ordinati a blocchi per il Repository in memoria.
+#
+# Con una lista ordinata semplice ogni modifica costa O(n): insort sposta in
+# media metà delle voci e, con il copy-on-write delle transazioni, la prima
+# modifica di una transazione copia tutta la lista. SortedIndex divide le voci
+# in blocchi ordinati (tra CHUNK_SIZE / 2 e 2 * CHUNK_SIZE voci) e tiene in
+# _maxes l'ultima voce di ogni blocco: una ricerca è una bisezione su _maxes
+# più una nel blocco, un inserimento o una cancellazione tocca un solo blocco.
+# Una transazione copia soltanto l'elenco dei blocchi (n / CHUNK_SIZE
+# riferimenti) e i blocchi che modifica; gli altri restano condivisi con lo
+# snapshot da cui è partita.
+#
+# Le posizioni sono coppie (blocco, posizione nel blocco), confrontabili tra
+# loro; la fine dell'indice è end = (numero di blocchi, 0).
+#
+# Le ricerche per sola chiave confrontano le voci con tuple sonda invece di
+# usare il parametro key di bisect (disponibile solo da Python 3.10): (chiave,)
+# precede tutte le voci con quella chiave, (chiave, _AFTER) le segue tutte.
+from bisect import bisect_left, bisect_right, insort
+
+# Numero tipico di voci per blocco
+CHUNK_SIZE = 512
+
+
+class _After:
+    """Valore maggiore di qualsiasi id, per le sonde delle ricerche per chiave."""
+
+    __slots__ = ()
+
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+
+_AFTER = _After()
+
+
+class SortedIndex:
+    """Lista ordinata di voci (chiave, id) divisa in blocchi."""
+
+    __slots__ = ('_chunks', '_maxes', '_len', '_owned')
+
+    def __init__(self, entries=()):
+        """Indice con le voci date, che devono essere già in ordine."""
+        entries = list(entries)
+        self._chunks = [entries[start:start + CHUNK_SIZE] for start in range(0, len(entries), CHUNK_SIZE)]
+        self._maxes = [chunk[-1] for chunk in self._chunks]
+        self._len = len(entries)
+        self._owned = None      # id dei blocchi modificabili; None se lo sono tutti
+
+    def copy(self):
+        """Copia che condivide i blocchi: ognuno viene copiato alla prima modifica."""
+        index = SortedIndex.__new__(SortedIndex)
+        index._chunks = list(self._chunks)
+        index._maxes = list(self._maxes)
+        index._len = self._len
+        index._owned = set()
+        return index
+
+    def merged(self, entries):
+        """Nuovo indice con anche le voci date (in ordine), per i caricamenti in blocco."""
+        merged = list(self)
+        merged.extend(entries)
+        # sort() riconosce le due sequenze già ordinate e le fonde in tempo lineare
+        merged.sort()
+        return SortedIndex(merged)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            yield from chunk
+
+    # --- Modifiche ---
+    def add(self, entry):
+        chunks = self._chunks
+        if not chunks:
+            chunks.append([entry])
+            self._maxes.append(entry)
+            self._len = 1
+            return
+        position = min(bisect_left(self._maxes, entry), len(chunks) - 1)
+        chunk = self._own(position)
+        insort(chunk, entry)
+        self._maxes[position] = chunk[-1]
+        self._len += 1
+        if len(chunk) > 2 * CHUNK_SIZE:
+            self._split(position)
+
+    def discard(self, entry):
+        """Toglie la voce se presente."""
+        position = bisect_left(self._maxes, entry)
+        if position == len(self._chunks):
+            return
+        offset = bisect_left(self._chunks[position], entry)
+        if self._chunks[position][offset] != entry:
+            return
+        chunk = self._own(position)
+        del chunk[offset]
+        self._len -= 1
+        if not chunk:
+            del self._chunks[position]
+            del self._maxes[position]
+            return
+        self._maxes[position] = chunk[-1]
+        if len(chunk) < CHUNK_SIZE // 2 and len(self._chunks) > 1:
+            # Blocco troppo piccolo: si unisce a un vicino (e si divide di nuovo se serve)
+            first = position if position + 1 < len(self._chunks) else position - 1
+            merged = self._chunks[first] + self._chunks[first + 1]
+            self._chunks[first:first + 2] = [merged]
+            self._maxes[first:first + 2] = [merged[-1]]
+            if self._owned is not None:
+                self._owned.add(id(merged))
+            if len(merged) > 2 * CHUNK_SIZE:
+                self._split(first)
+
+    def _own(self, position):
+        """Blocco in posizione position, copiato se è ancora condiviso."""
+        chunk = self._chunks[position]
+        if self._owned is not None and id(chunk) not in self._owned:
+            chunk = self._chunks[position] = list(chunk)
+            self._owned.add(id(chunk))
+        return chunk
+
+    def _split(self, position):
+        chunk = self._chunks[position]
+        half = len(chunk) // 2
+        first, second = chunk[:half], chunk[half:]
+        self._chunks[position:position + 1] = [first, second]
+        self._maxes[position:position + 1] = [first[-1], second[-1]]
+        if self._owned is not None:
+            self._owned.update((id(first), id(second)))
+
+    # --- Ricerca e scansione ---
+    @property
+    def end(self):
+        """Posizione successiva all'ultima voce."""
+        return (len(self._chunks), 0)
+
+    def bisect_left(self, entry):
+        """Posizione della prima voce non minore di entry."""
+        position = bisect_left(self._maxes, entry)
+        if position == len(self._chunks):
+            return self.end
+        return (position, bisect_left(self._chunks[position], entry))
+
+    def bisect_right(self, entry):
+        """Posizione della prima voce maggiore di entry."""
+        position = bisect_right(self._maxes, entry)
+        if position == len(self._chunks):
+            return self.end
+        return (position, bisect_right(self._chunks[position], entry))
+
+    def bisect_key_left(self, key):
+        """Posizione della prima voce con chiave non minore di key."""
+        return self.bisect_left((key,))
+
+    def bisect_key_right(self, key):
+        """Posizione della prima voce con chiave maggiore di key."""
+        return self.bisect_right((key, _AFTER))
+
+    def irange(self, start, stop, reverse=False):
+        """Voci dalla posizione start (inclusa) a stop (esclusa); all'indietro con reverse."""
+        if start >= stop:
+            return
+        chunks = self._chunks
+        (first, first_offset), (last, last_offset) = start, stop
+        if reverse:
+            if last_offset:
+                yield from reversed(chunks[last][first_offset if first == last else 0:last_offset])
+            for position in range(last - 1, first - 1, -1):
+                chunk = chunks[position]
+                yield from reversed(chunk[first_offset:] if position == first else chunk)
+        else:
+            if first == last:
+                yield from chunks[first][first_offset:last_offset]
+                return
+            yield from chunks[first][first_offset:]
+            for position in range(first + 1, last):
+                yield from chunks[position]
+            if last_offset:
+                yield from chunks[last][:last_offset]
@@ -0,0 +1,943 @@
+# Backend SQLite del CRM, basato sullo schema normalizzato di instance/crm.db
+# (clienti, servizi, contratti, pagamenti, ore_lavorate, ore_lavorate_previste).
+# Espone la stessa interfaccia del Repository in memoria (snapshot(), transaction(),
+# get/all/insert/update/delete...), quindi le rotte non sanno quale backend stanno usando.
+#
+# - Modalità WAL: i lettori non bloccano lo scrittore e viceversa.
+# - Una connessione per thread, riutilizzata tra le richieste.
+# - Query parametrizzate costanti: sqlite3 le mantiene nella cache delle istruzioni preparate.
+# - I dettagli mensili dei contratti vivono in pagamenti (importo e note),
+#   ore_lavorate (registrazioni delle ore) e ore_lavorate_previste.
+# - La ricerca testuale usa una tabella FTS5 con tokenizer a trigrammi,
+#   mantenuta allineata da trigger su clienti e potenziali_clienti.
+# - I duplicati dei clienti si cercano con indici sulle espressioni che
+#   normalizzano partita IVA ed email e, per i nomi simili, con la tabella FTS.
+# - Le faccette dell'elenco clienti sono GROUP BY sulle espressioni indicizzate
+#   dei valori (stesse regole di facets.facet_value).
+# - Gli id restano i rowid interi di SQLite (in decimale negli URL, vedi ids.py).
+from contextlib import contextmanager
+from datetime import date, datetime
+from itertools import groupby
+from operator import itemgetter
+import sqlite3
+import threading
+
+from duplicates import (DUPLICATE_LIMIT, NAME_SIMILARITY, exact_keys, name_grams, probe_size,
+                        required_overlap, similarity)
+from facets import FACETS, ZIP_PREFIX_LENGTH
+from ids import parse_id
+from ledger import MonthlyLedger
+from months import month_index, months_between
+from records import RECORD_TYPES, Service, as_record
+from repository import AUTOCOMPLETE_LIMIT, FACET_LIMIT, ORDERED_INDEXES, PAGE_SIZE, IntegrityError
+from search import SEARCH_FIELDS, SEARCH_LIMIT, SEARCH_TABLES
+
+# Tabella del repository -> (tabella SQLite, {campo del record: colonna})
+TABLE_MAP = {
+    'clients': ('clienti', {
+        'name': 'nome',
+        'contact': 'referente_aziendale',
+        'email': 'email',
+        'phone': 'telefono',
+        'vat_id': 'partita_iva',
+        'address': 'indirizzo',
+        'city': 'citta',
+        'zip': 'cap',
+        'sdi_code': 'codice_sdi',
+        'agent': 'agente',
+        'call_center': 'call_center',
+        'created_at': 'data_creazione',
+    }),
+    'prospects': ('potenziali_clienti', {
+        'name': 'nome',
+        'contact': 'referente_aziendale',
+        'email': 'email',
+        'phone': 'telefono',
+        'notes': 'note',
+        'preventivo': 'preventivo',
+        'graphic_quote_link': 'link_preventivo_grafico',
+        'created_at': 'data_creazione',
+    }),
+    'services': ('servizi', {
+        'name': 'nome',
+        'price': 'prezzo_base',
+        'description': 'descrizione',
+    }),
+    'collaborators': ('collaboratori', {
+        'name': 'nome',
+        'role': 'ruolo',
+        'email': 'email',
+        'phone': 'telefono',
+    }),
+    'client_services': ('contratti', {
+        'client_id': 'client_id',
+        'service_id': 'service_id',
+        'subscribed_price': 'costo_concordato',
+        'start_date': 'data_inizio',
+        'end_date': 'data_fine',
+        'notes': 'note_contratto',
+    }),
+}
+
+# Righe lette per volta dalle iterazioni complete (esportazioni)
+ITER_BATCH_SIZE = 500
+
+# Campi salvati come testo ISO e riconvertiti in datetime in lettura
+DATETIME_FIELDS = ('created_at', 'start_date', 'end_date')
+
+# Campi che contengono id di altri record
+REFERENCE_FIELDS = ('client_id', 'service_id')
+
+# I rowid di SQLite sono interi con segno a 64 bit
+ROWID_LIMIT = 1 << 63
+
+# Colonne aggiunte allo schema originale per i campi gestiti dall'applicazione
+ADDED_COLUMNS = {
+    'clienti': ('referente_aziendale', 'partita_iva', 'citta', 'cap', 'codice_sdi', 'agente', 'call_center'),
+    'pagamenti': ('note',),
+}
+
+
+
+def _sort_expression(column):
+    """Espressione di ordinamento delle pagine elenco, identica a quella degli indici."""
+    return f"COALESCE({column}, '') COLLATE NOCASE"
+
+
+# Indici sulle espressioni di ordinamento delle pagine elenco (vedi SQLiteSession.page)
+ORDERED_INDEXES_SQL = ''.join(
+    f'CREATE INDEX IF NOT EXISTS idx_{TABLE_MAP[table][0]}_{field} '
+    f'ON {TABLE_MAP[table][0]} ({_sort_expression(TABLE_MAP[table][1][field])}, id);\n'
+    for table, fields in ORDERED_INDEXES.items() for field in fields)
+
+
+def _facet_expression(table, field):
+    """Espressione SQL del valore di una faccetta, come facets.facet_value()."""
+    columns = TABLE_MAP[table][1]
+    if field == 'zip_prefix':
+        return f"substr(TRIM(COALESCE({columns['zip']}, '')), 1, {ZIP_PREFIX_LENGTH})"
+    return f"TRIM(COALESCE({columns[field]}, ''))"
+
+
+def _facet_conditions(table, selection):
+    """Condizioni WHERE e parametri di una selezione di faccette {campo: [valori]}."""
+    where = []
+    params = []
+    for field, values in (selection or {}).items():
+        if values:
+            where.append(f"{_facet_expression(table, field)} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+    return where, params
+
+
+# Indici sulle espressioni delle faccette: i conteggi leggono solo l'indice
+FACET_INDEXES_SQL = ''.join(
+    f'CREATE INDEX IF NOT EXISTS idx_{TABLE_MAP[table][0]}_facet_{field} '
+    f'ON {TABLE_MAP[table][0]} ({_facet_expression(table, field)});\n'
+    for table, fields in FACETS.items() for field in fields)
+
+# Ricerca testuale: il rowid della tabella FTS è id * 2 per i clienti e
+# id * 2 + 1 per i potenziali clienti, così i trigger aggiornano una sola riga.
+SEARCH_ROWID_OFFSET = {'clients': 0, 'prospects': 1}
+
+
+def _search_text(table, prefix):
+    """Espressione SQL con il testo indicizzato di un record (prefix è new., old. o vuoto)."""
+    columns = TABLE_MAP[table][1]
+    return " || ' ' || ".join(f"COALESCE({prefix}{columns[field]}, '')"
+                              for field in SEARCH_FIELDS if field in columns)
+
+
+def _search_triggers(table):
+    sql_table = TABLE_MAP[table][0]
+    offset = SEARCH_ROWID_OFFSET[table]
+    insert = (f'INSERT INTO ricerca (rowid, testo) '
+              f'VALUES (new.id * 2 + {offset}, {_search_text(table, "new.")});')
+    delete = f'DELETE FROM ricerca WHERE rowid = old.id * 2 + {offset};'
+    return (f'CREATE TRIGGER IF NOT EXISTS {sql_table}_ricerca_ai AFTER INSERT ON {sql_table} BEGIN {insert} END;\n'
+            f'CREATE TRIGGER IF NOT EXISTS {sql_table}_ricerca_au AFTER UPDATE ON {sql_table} BEGIN {delete} {insert} END;\n'
+            f'CREATE TRIGGER IF NOT EXISTS {sql_table}_ricerca_ad AFTER DELETE ON {sql_table} BEGIN {delete} END;\n')
+
+
+SEARCH_SCHEMA = ("CREATE VIRTUAL TABLE IF NOT EXISTS ricerca USING fts5(testo, tokenize='trigram');\n"
+                 "CREATE VIRTUAL TABLE IF NOT EXISTS ricerca_vocab USING fts5vocab(ricerca, 'row');\n"
+                 + ''.join(_search_triggers(table) for table in SEARCH_TABLES))
+
+
+def _period_day(expression):
+    """Giorno (intero) di una data per l'indice dei periodi dei contratti, arrotondato per difetto."""
+    return f'CAST(julianday({expression}) AS INTEGER)'
+
+
+# Fine dei contratti aperti nell'indice dei periodi
+OPEN_END_DAY = 2 ** 31 - 1
+
+# Indice dei periodi dei contratti: R*Tree a una dimensione con coordinate intere
+# (giorni). La fine è arrotondata per eccesso, così l'indice non scarta mai un
+# contratto che si sovrappone davvero al periodo cercato.
+_PERIOD_VALUES = (f"{_period_day('new.data_inizio')}, "
+                  f"COALESCE({_period_day('new.data_fine')} + 1, {OPEN_END_DAY})")
+PERIOD_SCHEMA = (
+    'CREATE VIRTUAL TABLE IF NOT EXISTS contratti_periodo USING rtree_i32(id, inizio, fine);\n'
+    'CREATE TRIGGER IF NOT EXISTS contratti_periodo_ai AFTER INSERT ON contratti BEGIN '
+    f'INSERT INTO contratti_periodo VALUES (new.id, {_PERIOD_VALUES}); END;\n'
+    'CREATE TRIGGER IF NOT EXISTS contratti_periodo_au AFTER UPDATE OF data_inizio, data_fine ON contratti BEGIN '
+    f'INSERT OR REPLACE INTO contratti_periodo VALUES (new.id, {_PERIOD_VALUES}); END;\n'
+    'CREATE TRIGGER IF NOT EXISTS contratti_periodo_ad AFTER DELETE ON contratti BEGIN '
+    'DELETE FROM contratti_periodo WHERE id = old.id; END;\n'
+)
+
+
+def _vat_expression(column):
+    """Partita IVA normalizzata in SQL, con le stesse regole di duplicates.normalize_vat."""
+    value = f"UPPER(TRIM(COALESCE({column}, '')))"
+    for char in ' .-/':
+        value = f"REPLACE({value}, '{char}', '')"
+    return (f"CASE WHEN {value} GLOB 'IT{'[0-9]' * 11}' THEN SUBSTR({value}, 3) "
+            f"ELSE {value} END")
+
+
+# Espressioni dei valori che identificano un cliente (vedi duplicates.exact_keys)
+EXACT_KEY_EXPRESSIONS = {
+    'vat_id': _vat_expression('partita_iva'),
+    'email': "LOWER(TRIM(COALESCE(email, '')))",
+}
+
+DUPLICATE_INDEXES_SQL = ''.join(
+    f'CREATE INDEX IF NOT EXISTS idx_clienti_{field}_normalizzato ON clienti ({expression});\n'
+    for field, expression in EXACT_KEY_EXPRESSIONS.items())
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS potenziali_clienti (
+    id INTEGER NOT NULL,
+    nome VARCHAR(100) NOT NULL,
+    referente_aziendale VARCHAR(100),
+    email VARCHAR(100),
+    telefono VARCHAR(20),
+    note TEXT,
+    preventivo TEXT,
+    link_preventivo_grafico TEXT,
+    data_creazione DATETIME,
+    PRIMARY KEY (id)
+);
+CREATE TABLE IF NOT EXISTS collaboratori (
+    id INTEGER NOT NULL,
+    nome VARCHAR(100) NOT NULL,
+    ruolo VARCHAR(100),
+    email VARCHAR(100),
+    telefono VARCHAR(20),
+    PRIMARY KEY (id)
+);
+CREATE INDEX IF NOT EXISTS idx_contratti_client_id ON contratti (client_id);
+CREATE INDEX IF NOT EXISTS idx_contratti_service_id ON contratti (service_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_pagamenti_contratto_mese ON pagamenti (contract_id, mese_riferimento);
+CREATE INDEX IF NOT EXISTS idx_ore_lavorate_pagamento ON ore_lavorate (pagamento_id);
+CREATE INDEX IF NOT EXISTS idx_ore_previste_pagamento ON ore_lavorate_previste (pagamento_id);
+""" + ORDERED_INDEXES_SQL + FACET_INDEXES_SQL + DUPLICATE_INDEXES_SQL + SEARCH_SCHEMA + PERIOD_SCHEMA
+
+# Contratti e relativi mesi in una sola query: le ore sono sommate con sottoquery
+# correlate che usano gli indici su pagamento_id.
+CONTRACTS_WITH_MONTHS_SQL = """
+SELECT c.id, c.client_id, c.service_id, c.costo_concordato, c.data_inizio, c.data_fine, c.note_contratto,
+       p.mese_riferimento, p.importo_pagato, p.note,
+       (SELECT SUM(o.ore_lavorate) FROM ore_lavorate o WHERE o.pagamento_id = p.id) AS ore_lavorate,
+       (SELECT SUM(op.ore_previste) FROM ore_lavorate_previste op WHERE op.pagamento_id = p.id) AS ore_previste
+FROM contratti c
+LEFT JOIN pagamenti p ON p.contract_id = c.id
+WHERE {where}
+ORDER BY c.id, p.mese_riferimento
+"""
+
+CONTRACT_WITH_MONTHS_SQL = CONTRACTS_WITH_MONTHS_SQL.format(where='c.id = ?')
+
+ALL_CONTRACTS_WITH_MONTHS_SQL = CONTRACTS_WITH_MONTHS_SQL.format(where='1')
+
+# Contratti il cui periodo si sovrappone a [?, ?]: l'indice R*Tree seleziona i
+# candidati per giorno, la condizione sulle date originali li verifica.
+# Parametri: fine del periodo, inizio del periodo (due volte).
+ACTIVE_CONTRACTS_SQL = CONTRACTS_WITH_MONTHS_SQL.format(where=f"""
+c.id IN (SELECT id FROM contratti_periodo WHERE inizio <= {_period_day('?1')} AND fine >= {_period_day('?2')})
+AND julianday(c.data_inizio) <= julianday(?1) AND (c.data_fine IS NULL OR julianday(c.data_fine) >= julianday(?2))""")
+
+# Contratti con data di fine in [?1, ?2], tramite la fine nell'indice R*Tree
+# (arrotondata per eccesso di un giorno) e poi sulle date originali.
+ENDING_CONTRACTS_SQL = CONTRACTS_WITH_MONTHS_SQL.format(where=f"""
+c.id IN (SELECT id FROM contratti_periodo WHERE fine >= {_period_day('?1')} AND fine <= {_period_day('?2')} + 1)
+AND julianday(c.data_fine) BETWEEN julianday(?1) AND julianday(?2)""")
+
+# Vista piatta contratto-mese per le esportazioni: scorre pagamenti
+# sull'indice (contract_id, mese_riferimento), quindi senza ordinamenti temporanei
+CONTRACT_MONTHS_SQL = """
+SELECT c.id AS contract_id, c.client_id, cl.nome AS client_name, c.service_id, s.nome AS service_name,
+       c.data_inizio, c.data_fine, p.mese_riferimento, p.importo_pagato, p.note,
+       (SELECT SUM(o.ore_lavorate) FROM ore_lavorate o WHERE o.pagamento_id = p.id) AS ore_lavorate,
+       (SELECT SUM(op.ore_previste) FROM ore_lavorate_previste op WHERE op.pagamento_id = p.id) AS ore_previste
+FROM contratti c
+LEFT JOIN pagamenti p ON p.contract_id = c.id
+LEFT JOIN clienti cl ON cl.id = c.client_id
+LEFT JOIN servizi s ON s.id = c.service_id
+ORDER BY c.id, p.mese_riferimento
+"""
+
+# Servizi di un cliente con i dati del servizio di catalogo, tramite l'indice su contratti(client_id)
+CLIENT_SUBSCRIPTIONS_SQL = """
+SELECT c.id, c.client_id, c.service_id, c.costo_concordato, c.data_inizio, c.data_fine, c.note_contratto,
+       s.nome AS servizio_nome, s.prezzo_base AS servizio_prezzo, s.descrizione AS servizio_descrizione
+FROM contratti c
+JOIN servizi s ON s.id = c.service_id
+WHERE c.client_id = ?
+ORDER BY c.id
+"""
+
+
+def _to_db(field, value):
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    if field in REFERENCE_FIELDS and value is not None:
+        return _parse_id(value)
+    return value
+
+
+def _from_db(field, value):
+    if field in DATETIME_FIELDS and isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def _contract_month(row, year, month, notes='', hours_worked=0.0, amount_paid=0.0, estimated_hours=0.0):
+    """Riga di un mese di contratto per iter_contract_months."""
+    return {
+        'contract_id': row['contract_id'],
+        'client_id': row['client_id'],
+        'client_name': row['client_name'] or '',
+        'service_id': row['service_id'],
+        'service_name': row['service_name'] or '',
+        'year': year,
+        'month': month,
+        'notes': notes,
+        'hours_worked': hours_worked,
+        'amount_paid': amount_paid,
+        'estimated_hours': estimated_hours,
+    }
+
+
+def _parse_id(record_id):
+    """Id come intero di SQLite (anche dalla forma testuale degli URL); None se non è una riga valida."""
+    row_id = parse_id(record_id)
+    return row_id if row_id is not None and row_id < ROWID_LIMIT else None
+
+
+class SQLiteSession:
+    """Letture e scritture su una connessione; usata sia per gli snapshot che per le transazioni."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        # Funzioni da chiamare alla conferma di una transazione (vedi on_commit)
+        self._on_commit = []
+
+    def on_commit(self, callback, *args):
+        """
+        Registra callback(*args) da chiamare alla conferma della transazione,
+        nell'ordine dei commit di questo processo (come Transaction.on_commit).
+        """
+        self._on_commit.append((callback, args))
+
+    # --- Letture ---
+    def get(self, table, record_id):
+        """Restituisce il record con l'id indicato oppure None."""
+        row_id = _parse_id(record_id)
+        if row_id is None:
+            return None
+        if table == 'client_services':
+            return self._contract_with_months(row_id)
+        sql_table, columns = TABLE_MAP[table]
+        row = self._conn.execute(f'SELECT * FROM {sql_table} WHERE id = ?', (row_id,)).fetchone()
+        return self._record(table, row) if row else None
+
+    def all(self, table):
+        """
+        Restituisce tutti i record di una tabella in ordine di inserimento.
+        I servizi cliente sono restituiti senza i dettagli mensili.
+        """
+        sql_table, columns = TABLE_MAP[table]
+        return [self._record(table, row) for row in self._conn.execute(f'SELECT * FROM {sql_table} ORDER BY id')]
+
+    def iter_all(self, table, batch_size=ITER_BATCH_SIZE):
+        """
+        Scorre i record di una tabella in ordine di inserimento, leggendoli a
+        blocchi con fetchmany. La lettura aperta vede sempre lo stesso stato
+        del database (WAL). I servizi cliente sono restituiti senza i dettagli mensili.
+        """
+        for row in self._iter_rows(f'SELECT * FROM {TABLE_MAP[table][0]} ORDER BY id', batch_size):
+            yield self._record(table, row)
+
+    def iter_client_services(self):
+        """Scorre tutti i servizi cliente con i dettagli mensili, in ordine di id."""
+        return self._contracts_with_months(ALL_CONTRACTS_WITH_MONTHS_SQL, ())
+
+    def iter_contract_months(self, batch_size=ITER_BATCH_SIZE):
+        """
+        Una riga per ogni mese di ogni servizio cliente (vista piatta per le
+        esportazioni). I contratti senza data di fine arrivano fino al mese
+        attuale, con i mesi non ancora salvati a zero (come current_monthly_details).
+        """
+        current = month_index(datetime.now())
+        for _, rows in groupby(self._iter_rows(CONTRACT_MONTHS_SQL, batch_size), key=itemgetter('contract_id')):
+            last = None
+            for row in rows:
+                if row['mese_riferimento'] is None:
+                    continue
+                month = date.fromisoformat(row['mese_riferimento'])
+                last = month_index(month)
+                yield _contract_month(row, month.year, month.month, row['note'] or '', row['ore_lavorate'] or 0.0,
+                                      row['importo_pagato'] or 0.0, row['ore_previste'] or 0.0)
+            if row['data_fine'] is not None or (last is None and not row['data_inizio']):
+                continue
+            first = last + 1 if last is not None else month_index(_from_db('start_date', row['data_inizio']))
+            for entry in months_between(first, current):
+                yield _contract_month(row, entry.year, entry.month)
+
+    def count(self, table):
+        """Numero di record presenti in una tabella."""
+        return self._conn.execute(f'SELECT COUNT(*) FROM {TABLE_MAP[table][0]}').fetchone()[0]
+
+    def client_services_for_client(self, client_id):
+        """Servizi sottoscritti da un cliente, tramite l'indice su contratti(client_id)."""
+        rows = self._conn.execute('SELECT * FROM contratti WHERE client_id = ? ORDER BY id', (_parse_id(client_id),))
+        return [self._record('client_services', row) for row in rows]
+
+    def client_services_for_service(self, service_id):
+        """Sottoscrizioni di un servizio di catalogo, tramite l'indice su contratti(service_id)."""
+        rows = self._conn.execute('SELECT * FROM contratti WHERE service_id = ? ORDER BY id', (_parse_id(service_id),))
+        return [self._record('client_services', row) for row in rows]
+
+    def client_services_active(self, start, end):
+        """
+        Servizi cliente il cui periodo si sovrappone a [start, end] (estremi
+        inclusi), con i dettagli mensili, tramite l'indice R*Tree dei periodi.
+        """
+        return list(self._contracts_with_months(ACTIVE_CONTRACTS_SQL, (_to_db(None, end), _to_db(None, start))))
+
+    def client_services_ending(self, start, end):
+        """Servizi cliente con data di fine in [start, end], in ordine di scadenza."""
+        records = list(self._contracts_with_months(ENDING_CONTRACTS_SQL, (_to_db(None, start), _to_db(None, end))))
+        records.sort(key=lambda record: (record['end_date'], record['id']))
+        return records
+
+    def find_client_service(self, client_id, service_id):
+        """Cerca la sottoscrizione di un servizio da parte di un cliente."""
+        row = self._conn.execute('SELECT * FROM contratti WHERE client_id = ? AND service_id = ? LIMIT 1',
+                                 (_parse_id(client_id), _parse_id(service_id))).fetchone()
+        return self._record('client_services', row) if row else None
+
+    def subscriptions_for_client(self, client_id):
+        """Coppie (servizio cliente, servizio di catalogo) di un cliente, con una sola query."""
+        result = []
+        for row in self._conn.execute(CLIENT_SUBSCRIPTIONS_SQL, (_parse_id(client_id),)):
+            service = Service(id=row['service_id'], name=row['servizio_nome'], price=row['servizio_prezzo'],
+                              description=row['servizio_descrizione'])
+            result.append((self._record('client_services', row), service))
+        return result
+
+    def page(self, table, order_by, after=None, descending=False, filters=None, facets=None, limit=PAGE_SIZE,
+             ranges=None):
+        """
+        Una pagina di record ordinati per order_by con paginazione per chiave:
+        la query riparte dal cursore (valore, id) usando l'indice sull'espressione
+        di ordinamento, senza OFFSET. Le faccette diventano condizioni IN, gli
+        intervalli (campo -> (minimo, massimo)) condizioni BETWEEN.
+        Restituisce (record, cursore successivo o None).
+        """
+        sql_table, columns = TABLE_MAP[table]
+        expression = _sort_expression(columns[order_by])
+        filters = filters or {}
+        where, params = _facet_conditions(table, facets)
+        for field, value in filters.items():
+            where.append(f'{_sort_expression(columns[field])} = ?')
+            params.append(value or '')
+        for field, (start, end) in (ranges or {}).items():
+            where.append(f'{_sort_expression(columns[field])} BETWEEN ? AND ?')
+            params.extend((_to_db(field, start), _to_db(field, end)))
+        comparison = '<' if descending else '>'
+        direction = 'DESC' if descending else 'ASC'
+        try:
+            value, row_id = after
+            row_id = _parse_id(row_id)
+            if row_id is None:
+                raise ValueError
+        except (TypeError, ValueError):
+            value = None
+        if order_by in filters:
+            # Il valore di ordinamento è fisso: basta l'id, che è già nell'indice
+            order = f'id {direction}'
+            if value is not None:
+                where.append(f'id {comparison} ?')
+                params.append(row_id)
+        else:
+            order = f'{expression} {direction}, id {direction}'
+            if value is not None:
+                # Il primo confronto permette a SQLite di posizionarsi nell'indice,
+                # il secondo risolve i valori uguali tramite l'id
+                where.append(f'{expression} {comparison}= ? AND ({expression}, id) {comparison} (?, ?)')
+                params.extend((value, value, row_id))
+        sql = (f'SELECT *, {expression} AS chiave FROM {sql_table}'
+               f"{' WHERE ' + ' AND '.join(where) if where else ''}"
+               f' ORDER BY {order} LIMIT ?')
+        rows = self._conn.execute(sql, (*params, limit + 1)).fetchall()
+        records = [self._record(table, row) for row in rows[:limit]]
+        if len(rows) <= limit:
+            return records, None
+        last = rows[limit - 1]
+        return records, [last['chiave'], last['id']]
+
+    def facet_counts(self, table, selection=None, limit=FACET_LIMIT):
+        """
+        Conteggi delle faccette per la selezione corrente, con le stesse regole
+        del Repository in memoria: ogni campo è contato con i filtri degli altri
+        campi. Restituisce ({campo: [(valore, conteggio, selezionato)]}, totale).
+        """
+        sql_table = TABLE_MAP[table][0]
+        selection = {field: values for field, values in (selection or {}).items() if values}
+        counts = {}
+        for field in FACETS[table]:
+            chosen = set(selection.get(field, ()))
+            where, params = _facet_conditions(
+                table, {other: values for other, values in selection.items() if other != field})
+            rows = self._conn.execute(
+                f'SELECT {_facet_expression(table, field)} AS valore, COUNT(*) AS n FROM {sql_table}'
+                f"{' WHERE ' + ' AND '.join(where) if where else ''} GROUP BY valore", params)
+            found = {row['valore']: row['n'] for row in rows if row['valore']}
+            values = [(value, count, value in chosen) for value, count in found.items()]
+            values.extend((value, 0, True) for value in chosen if value not in found)
+            values.sort(key=lambda item: (-item[1], item[0].casefold()))
+            counts[field] = values[:limit] + [item for item in values[limit:] if item[2]]
+        where, params = _facet_conditions(table, selection)
+        total = self._conn.execute(
+            f"SELECT COUNT(*) FROM {sql_table}{' WHERE ' + ' AND '.join(where) if where else ''}",
+            params).fetchone()[0]
+        return counts, total
+
+    def prefix_search(self, table, prefix, field='name', limit=AUTOCOMPLETE_LIMIT):
+        """
+        Record il cui campo inizia con prefix, in ordine alfabetico: intervallo
+        [prefix, prefix + carattere massimo) sull'indice dell'espressione di ordinamento.
+        """
+        if not prefix:
+            return []
+        sql_table, columns = TABLE_MAP[table]
+        expression = _sort_expression(columns[field])
+        rows = self._conn.execute(
+            f'SELECT * FROM {sql_table} WHERE {expression} >= ? AND {expression} < ? '
+            f'ORDER BY {expression}, id LIMIT ?', (prefix, prefix + '\U0010ffff', limit))
+        return [self._record(table, row) for row in rows]
+
+    def search(self, query, tables=SEARCH_TABLES, limit=SEARCH_LIMIT):
+        """
+        Ricerca testuale con la tabella FTS a trigrammi: le parole di almeno tre
+        caratteri sono cercate come sottostringhe con MATCH, quelle di due come
+        inizio di parola con LIKE. Le maiuscole sono ignorate ma, a differenza
+        dell'indice in memoria, gli accenti no: il tokenizer di questa versione
+        di SQLite non li rimuove. Restituisce coppie (tabella, record).
+        """
+        terms = query.split()
+        phrases = ['"' + term.replace('"', '""') + '"' for term in terms if len(term) >= 3]
+        prefixes = ['% ' + term.replace('%', '').replace('_', '') + '%' for term in terms if len(term) == 2]
+        if not phrases and not prefixes:
+            return []
+        where = []
+        params = []
+        if phrases:
+            where.append('ricerca MATCH ?')
+            params.append(' AND '.join(phrases))
+        for prefix in prefixes:
+            where.append("(' ' || testo) LIKE ?")
+            params.append(prefix)
+        offsets = [SEARCH_ROWID_OFFSET[table] for table in tables]
+        where.append(f"rowid % 2 IN ({', '.join('?' for _ in offsets)})")
+        params.extend(offsets)
+        sql = f"SELECT rowid FROM ricerca WHERE {' AND '.join(where)} ORDER BY rowid DESC LIMIT ?"
+        found = []
+        for (rowid,) in self._conn.execute(sql, (*params, limit)):
+            record_id, offset = divmod(rowid, 2)
+            table = 'clients' if offset == SEARCH_ROWID_OFFSET['clients'] else 'prospects'
+            record = self.get(table, record_id)
+            if record is not None:
+                found.append((table, record))
+        return found
+
+    def find_duplicates(self, record, exclude_id=None, limit=DUPLICATE_LIMIT):
+        """
+        Clienti che potrebbero coincidere con record, come Repository.find_duplicates:
+        terne (cliente, motivo, similarità). Partita IVA ed email usano gli indici
+        sulle espressioni normalizzate; i candidati per nome sono i clienti che
+        contengono almeno due dei trigrammi più rari del nome (frequenze da
+        ricerca_vocab), verificati poi con la similarità. Il tokenizer non
+        rimuove accenti e punteggiatura, quindi un nome che differisce solo per
+        questi può sfuggire.
+        """
+        exclude = _parse_id(exclude_id)
+        found = {}
+        for field, value in exact_keys(record):
+            rows = self._conn.execute(
+                f'SELECT * FROM clienti WHERE {EXACT_KEY_EXPRESSIONS[field]} = ? LIMIT ?', (value, limit + 1))
+            for row in rows:
+                if row['id'] != exclude and row['id'] not in found:
+                    found[row['id']] = (self._record('clients', row), field, 1.0)
+        grams = name_grams(record.get('name'))
+        names = []
+        if grams:
+            placeholders = ', '.join('?' * len(grams))
+            frequency = dict(self._conn.execute(
+                f'SELECT term, doc FROM ricerca_vocab WHERE term IN ({placeholders})', tuple(grams)))
+            probe = sorted(grams, key=lambda gram: frequency.get(gram, 0))[:probe_size(len(grams))]
+            # I trigrammi assenti dall'indice non hanno candidati
+            phrases = ['"' + gram.replace('"', '""') + '"' for gram in probe if gram in frequency]
+            if required_overlap(len(grams)) > 1:
+                # Un nome simile contiene almeno due dei trigrammi scelti
+                phrases = [f'({phrase} AND {other})' for position, phrase in enumerate(phrases)
+                           for other in phrases[position + 1:]]
+            if phrases:
+                query = ' OR '.join(phrases)
+                rows = self._conn.execute(
+                    'SELECT id, nome FROM clienti WHERE id IN (SELECT rowid / 2 FROM ricerca '
+                    f"WHERE ricerca MATCH ? AND rowid % 2 = {SEARCH_ROWID_OFFSET['clients']})", (query,))
+                for row_id, name in rows:
+                    if row_id == exclude or row_id in found:
+                        continue
+                    score = similarity(grams, name_grams(name))
+                    if score >= NAME_SIMILARITY:
+                        names.append((row_id, score))
+        names.sort(key=lambda match: -match[1])
+        matches = list(found.values())
+        for row_id, score in names[:max(limit - len(matches), 0)]:
+            matches.append((self.get('clients', row_id), 'name', score))
+        return matches[:limit]
+
+    # --- Scritture ---
+    def insert(self, table, record):
+        """
+        Aggiunge un record. L'id è assegnato da SQLite: quello eventualmente
+        presente nel record viene ignorato. Restituisce il record salvato.
+        """
+        sql_table, columns = TABLE_MAP[table]
+        values = {column: _to_db(field, record.get(field)) for field, column in columns.items()}
+        if table == 'services':
+            values['data_creazione'] = _to_db(None, datetime.now())
+        if table == 'client_services':
+            values['frequenza_pagamento'] = 'mensile'
+        names = ', '.join(values)
+        placeholders = ', '.join('?' for _ in values)
+        cursor = self._execute(f'INSERT INTO {sql_table} ({names}) VALUES ({placeholders})', tuple(values.values()))
+        stored = as_record(table, record).replace(id=cursor.lastrowid)
+        if table == 'client_services' and record.get('monthly_details'):
+            self._write_monthly_details(cursor.lastrowid, record['monthly_details'], record.get('subscribed_price'))
+        return stored
+
+    def insert_many(self, table, records):
+        """Aggiunge più record nella transazione corrente. Restituisce i record salvati."""
+        return [self.insert(table, record) for record in records]
+
+    def update(self, table, record_id, **fields):
+        """
+        Modifica i campi di un record esistente.
+        Restituisce il record aggiornato oppure None se non esiste.
+        """
+        row_id = _parse_id(record_id)
+        sql_table, columns = TABLE_MAP[table]
+        assignments = {columns[field]: _to_db(field, value) for field, value in fields.items() if field in columns}
+        if assignments:
+            sql = f"UPDATE {sql_table} SET {', '.join(f'{column} = ?' for column in assignments)} WHERE id = ?"
+            cursor = self._execute(sql, (*assignments.values(), row_id))
+            if cursor.rowcount == 0:
+                return None
+        elif row_id is None or self.get(table, record_id) is None:
+            return None
+        if table == 'client_services' and 'monthly_details' in fields:
+            price = fields.get('subscribed_price')
+            if price is None:
+                price = self._conn.execute('SELECT costo_concordato FROM contratti WHERE id = ?', (row_id,)).fetchone()[0]
+            self._write_monthly_details(row_id, fields['monthly_details'], price)
+        return self.get(table, record_id)
+
+    def update_months(self, client_service_id, details, cells):
+        """
+        Salva nel servizio cliente il ledger details con le celle indicate
+        (posizione, campo, valore) modificate. Vengono scritti solo i mesi
+        delle celle, non l'intero contratto. Restituisce il ledger aggiornato
+        oppure None se il servizio cliente non esiste.
+        """
+        row_id = _parse_id(client_service_id)
+        row = self._conn.execute('SELECT costo_concordato FROM contratti WHERE id = ?', (row_id,)).fetchone()
+        if row is None:
+            return None
+        updated = details.updated(cells)
+        now = _to_db(None, datetime.now())
+        for offset in sorted({offset for offset, _, _ in cells}):
+            month_data = updated[offset]
+            month = date(month_data.year, month_data.month, 1).isoformat()
+            existing = self._conn.execute(
+                'SELECT p.id, (SELECT SUM(o.ore_lavorate) FROM ore_lavorate o WHERE o.pagamento_id = p.id) '
+                'FROM pagamenti p WHERE p.contract_id = ? AND p.mese_riferimento = ?', (row_id, month)).fetchone()
+            if existing is not None:
+                existing = (existing[0], existing[1] or 0)
+            self._write_month(row_id, month, month_data, row[0], existing, now)
+        return updated
+
+    def delete(self, table, record_id):
+        """
+        Elimina un record. Restituisce il record rimosso oppure None.
+        Clienti e servizi di catalogo vengono eliminati a cascata con i loro
+        contratti, pagamenti e ore.
+        """
+        record = self.get(table, record_id)
+        if record is None:
+            return None
+        row_id = _parse_id(record_id)
+        if table == 'clients':
+            self._delete_contracts('SELECT id FROM contratti WHERE client_id = ?', row_id)
+        elif table == 'services':
+            self._delete_contracts('SELECT id FROM contratti WHERE service_id = ?', row_id)
+        elif table == 'client_services':
+            self._delete_contracts('SELECT ?', row_id)
+            return record
+        self._execute(f'DELETE FROM {TABLE_MAP[table][0]} WHERE id = ?', (row_id,))
+        return record
+
+    def delete_many(self, table, record_ids):
+        """Elimina più record in un solo passaggio. Restituisce i record rimossi."""
+        removed = []
+        for record_id in record_ids:
+            record = self.delete(table, record_id)
+            if record is not None:
+                removed.append(record)
+        return removed
+
+    # --- Supporto ---
+    def _iter_rows(self, sql, batch_size):
+        cursor = self._conn.execute(sql)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cursor.close()
+
+    def _execute(self, sql, params):
+        try:
+            return self._conn.execute(sql, params)
+        except sqlite3.IntegrityError as e:
+            raise IntegrityError(str(e)) from e
+
+    def _record(self, table, row, **fields):
+        columns = TABLE_MAP[table][1]
+        for field, column in columns.items():
+            fields[field] = _from_db(field, row[column])
+        return RECORD_TYPES[table](id=row['id'], **fields)
+
+    def _contract_with_months(self, row_id):
+        contracts = list(self._contracts_with_months(CONTRACT_WITH_MONTHS_SQL, (row_id,)))
+        return contracts[0] if contracts else None
+
+    def _contracts_with_months(self, sql, params):
+        """Contratti con i dettagli mensili da una query su CONTRACTS_WITH_MONTHS_SQL, uno alla volta."""
+        for _, rows in groupby(self._conn.execute(sql, params), key=itemgetter('id')):
+            rows = list(rows)
+            months = []
+            for row in rows:
+                if row['mese_riferimento'] is None:
+                    continue
+                month = date.fromisoformat(row['mese_riferimento'])
+                months.append({
+                    'month': month.month,
+                    'year': month.year,
+                    'notes': row['note'] or '',
+                    'hours_worked': row['ore_lavorate'],
+                    'amount_paid': row['importo_pagato'],
+                    'estimated_hours': row['ore_previste'],
+                })
+            yield self._record('client_services', rows[0], monthly_details=MonthlyLedger.from_rows(months))
+
+    def _write_monthly_details(self, contract_id, details, price):
+        """
+        Allinea le righe di pagamenti/ore al nuovo elenco di mesi. Le ore lavorate
+        sono registrate come differenza rispetto al totale già salvato, così lo
+        storico delle registrazioni resta intatto.
+        """
+        existing = {}
+        for row in self._conn.execute(
+                'SELECT p.id, p.mese_riferimento, '
+                '(SELECT SUM(o.ore_lavorate) FROM ore_lavorate o WHERE o.pagamento_id = p.id) AS ore '
+                'FROM pagamenti p WHERE p.contract_id = ?', (contract_id,)):
+            existing[row['mese_riferimento']] = (row['id'], row['ore'] or 0)
+
+        now = _to_db(None, datetime.now())
+        for month_data in details:
+            month = date(month_data['year'], month_data['month'], 1).isoformat()
+            self._write_month(contract_id, month, month_data, price, existing.pop(month, None), now)
+
+        # Mesi non più coperti dal contratto (es. date modificate)
+        for payment_id, _ in existing.values():
+            self._delete_payments('SELECT ?', payment_id)
+
+    def _write_month(self, contract_id, month, month_data, price, existing, now):
+        """Scrive un mese del contratto; existing è (id del pagamento, ore salvate) oppure None."""
+        hours = float(month_data.get('hours_worked') or 0)
+        estimated = float(month_data.get('estimated_hours') or 0)
+        if existing is not None:
+            payment_id, stored_hours = existing
+            self._execute('UPDATE pagamenti SET importo_previsto = ?, importo_pagato = ?, note = ? WHERE id = ?',
+                          (price, month_data.get('amount_paid'), month_data.get('notes'), payment_id))
+        else:
+            payment_id = self._execute(
+                'INSERT INTO pagamenti (contract_id, mese_riferimento, importo_previsto, importo_pagato, note) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (contract_id, month, price, month_data.get('amount_paid'), month_data.get('notes'))).lastrowid
+            stored_hours = 0
+        if hours != stored_hours:
+            self._execute('INSERT INTO ore_lavorate (pagamento_id, ore_lavorate, data_registrazione) VALUES (?, ?, ?)',
+                          (payment_id, hours - stored_hours, now))
+        self._execute('DELETE FROM ore_lavorate_previste WHERE pagamento_id = ?', (payment_id,))
+        if estimated:
+            self._execute('INSERT INTO ore_lavorate_previste (pagamento_id, ore_previste) VALUES (?, ?)',
+                          (payment_id, estimated))
+
+    def _delete_contracts(self, select_contracts, param):
+        payments = f'SELECT id FROM pagamenti WHERE contract_id IN ({select_contracts})'
+        self._delete_payments(payments, param)
+        self._execute(f'DELETE FROM contratti WHERE id IN ({select_contracts})', (param,))
+
+    def _delete_payments(self, select_payments, param):
+        self._execute(f'DELETE FROM ore_lavorate WHERE pagamento_id IN ({select_payments})', (param,))
+        self._execute(f'DELETE FROM ore_lavorate_previste WHERE pagamento_id IN ({select_payments})', (param,))
+        self._execute(f'DELETE FROM pagamenti WHERE id IN ({select_payments})', (param,))
+
+
+class SQLiteRepository:
+    """
+    Repository persistente su SQLite con la stessa interfaccia del Repository in memoria.
+    Ogni thread riusa la propria connessione; le scritture avvengono in transazioni
+    BEGIN IMMEDIATE, i lettori leggono l'ultimo stato confermato grazie al WAL.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        # COMMIT e funzioni di on_commit di un processo avvengono uno alla volta,
+        # così le funzioni sono chiamate nello stesso ordine dei commit
+        self._commit_lock = threading.Lock()
+        self._migrate()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute('PRAGMA foreign_keys = ON')
+            self._local.conn = conn
+        return conn
+
+    def _migrate(self):
+        """Aggiunge allo schema esistente colonne, tabelle e indici mancanti."""
+        conn = self._connection()
+        for table, columns in ADDED_COLUMNS.items():
+            present = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+            for column in columns:
+                if column not in present:
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} TEXT')
+        new_search = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'ricerca'").fetchone() is None
+        new_periods = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'contratti_periodo'").fetchone() is None
+        conn.executescript(SCHEMA)
+        if new_periods:
+            conn.execute(f"INSERT INTO contratti_periodo SELECT id, {_PERIOD_VALUES.replace('new.', '')} FROM contratti")
+        if new_search:
+            # Primo avvio con la ricerca: indicizza i record già presenti
+            for table in SEARCH_TABLES:
+                conn.execute(f'INSERT INTO ricerca (rowid, testo) '
+                             f'SELECT id * 2 + {SEARCH_ROWID_OFFSET[table]}, {_search_text(table, "")} '
+                             f'FROM {TABLE_MAP[table][0]}')
+
+    def snapshot(self):
+        """Sessione di sola lettura sulla connessione del thread corrente."""
+        return SQLiteSession(self._connection())
+
+    @contextmanager
+    def transaction(self):
+        """Transazione di scrittura: commit all'uscita dal blocco, rollback in caso di eccezione."""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        session = SQLiteSession(conn)
+        try:
+            yield session
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        # Un altro scrittore non può confermare prima che le funzioni di questo
+        # commit siano state chiamate: ha bisogno dello stesso lock per il COMMIT
+        with self._commit_lock:
+            conn.execute('COMMIT')
+            for callback, args in session._on_commit:
+                callback(*args)
+
+    # --- Letture e scritture singole ---
+    def get(self, table, record_id):
+        return self.snapshot().get(table, record_id)
+
+    def all(self, table):
+        return self.snapshot().all(table)
+
+    def count(self, table):
+        return self.snapshot().count(table)
+
+    def client_services_for_client(self, client_id):
+        return self.snapshot().client_services_for_client(client_id)
+
+    def client_services_for_service(self, service_id):
+        return self.snapshot().client_services_for_service(service_id)
+
+    def client_services_active(self, start, end):
+        return self.snapshot().client_services_active(start, end)
+
+    def client_services_ending(self, start, end):
+        return self.snapshot().client_services_ending(start, end)
+
+    def find_client_service(self, client_id, service_id):
+        return self.snapshot().find_client_service(client_id, service_id)
+
+    def subscriptions_for_client(self, client_id):
+        return self.snapshot().subscriptions_for_client(client_id)
+
+    def page(self, table, order_by, after=None, descending=False, filters=None, facets=None, limit=PAGE_SIZE,
+             ranges=None):
+        return self.snapshot().page(table, order_by, after, descending, filters, facets, limit, ranges)
+
+    def facet_counts(self, table, selection=None, limit=FACET_LIMIT):
+        return self.snapshot().facet_counts(table, selection, limit)
+
+    def prefix_search(self, table, prefix, field='name', limit=AUTOCOMPLETE_LIMIT):
+        return self.snapshot().prefix_search(table, prefix, field, limit)
+
+    def search(self, query, tables=SEARCH_TABLES, limit=SEARCH_LIMIT):
+        return self.snapshot().search(query, tables, limit)
+
+    def find_duplicates(self, record, exclude_id=None, limit=DUPLICATE_LIMIT):
+        return self.snapshot().find_duplicates(record, exclude_id, limit)
+
+    def insert(self, table, record):
+        with self.transaction() as tx:
+            return tx.insert(table, record)
+
+    def update(self, table, record_id, **fields):
+        with self.transaction() as tx:
+            return tx.update(table, record_id, **fields)
+
+    def delete(self, table, record_id):
+        with self.transaction() as tx:
+            return tx.delete(table, record_id)
+
+    def delete_many(self, table, record_ids):
+        with self.transaction() as tx:
+            return tx.delete_many(table, record_ids)
@@ -0,0 +1,5 @@
+# I moduli del CRM stanno nella radice del progetto, accanto ad app.py
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,108 @@
+# Analisi vettoriale dei mesi-contratto: ogni raggruppamento coincide con il
+# calcolo mese per mese in Python puro, quantili compresi.
+from datetime import datetime
+import math
+import random
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import analytics
+from ledger import MonthlyLedger
+
+
+@pytest.fixture
+def contracts():
+    rng = random.Random(5)
+    contracts = []
+    for record_id in range(1, 41):
+        start = datetime(2023, rng.randrange(1, 13), 1)
+        end = datetime(start.year + 1, rng.randrange(1, 13), 1)
+        details = MonthlyLedger.for_range(start, end)
+        changes = []
+        for offset in range(len(details)):
+            changes.append((offset, 'estimated_hours', float(rng.randrange(0, 10))))
+            changes.append((offset, 'hours_worked', float(rng.choice((0, rng.randrange(1, 12))))))
+            changes.append((offset, 'amount_paid', float(rng.randrange(0, 500))))
+        contracts.append({'id': record_id, 'client_id': rng.randrange(5), 'service_id': rng.randrange(3),
+                          'subscribed_price': float(rng.choice((0, 100, 250))),
+                          'monthly_details': details.updated(changes)})
+    contracts.append({'id': 99, 'client_id': 0, 'service_id': 0, 'monthly_details': MonthlyLedger.empty(0, 0)})
+    return contracts
+
+
+def _months(contracts, first, last):
+    for contract in contracts:
+        details = contract['monthly_details']
+        for offset in range(len(details)):
+            month = details.start + offset
+            if first <= month <= last:
+                yield contract, month, details[offset]
+
+
+def _percentile(values, quantile):
+    return float(np.percentile(values, quantile)) if values else math.nan
+
+
+def _same(actual, expected):
+    return math.isnan(expected) if math.isnan(actual) else actual == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('by', ['client', 'service', 'agent', 'month', 'contract'])
+def test_grouped_matches_a_month_by_month_sum(contracts, by):
+    agents = {0: 'Rossi', 1: 'Rossi', 2: 'Bianchi'}
+    packed = analytics.ContractMonths(contracts, agents)
+    first, last = 2023 * 12 + 5, 2024 * 12 + 2
+    expected = {}
+    for contract, month, data in _months(contracts, first, last):
+        key = {'client': contract['client_id'], 'service': contract['service_id'], 'month': month,
+               'agent': agents.get(contract['client_id'], ''), 'contract': contract['id']}[by]
+        group = expected.setdefault(key, {'months': 0, 'hours_worked': 0.0, 'amount_paid': 0.0, 'overrun': 0.0,
+                                          'overrun_months': 0, 'billed': 0.0, 'rates': []})
+        overrun = data['hours_worked'] - data['estimated_hours']
+        group['months'] += 1
+        group['hours_worked'] += data['hours_worked']
+        group['amount_paid'] += data['amount_paid']
+        group['overrun'] += overrun
+        group['overrun_months'] += overrun > 0
+        group['billed'] += contract['subscribed_price']
+        if data['hours_worked'] > 0:
+            group['rates'].append(data['amount_paid'] / data['hours_worked'])
+
+    grouped = packed.grouped(by, first, last)
+    assert sorted(grouped['key']) == sorted(expected)
+    for position, key in enumerate(grouped['key']):
+        group = expected[key]
+        for measure in ('months', 'hours_worked', 'amount_paid', 'overrun', 'overrun_months', 'billed'):
+            assert grouped[measure][position] == pytest.approx(group[measure])
+        rate = group['amount_paid'] / group['hours_worked'] if group['hours_worked'] else math.nan
+        assert _same(grouped['hourly_rate'][position], rate)
+        for quantile in analytics.QUANTILES:
+            assert _same(grouped[f'p{quantile}'][position], _percentile(group['rates'], quantile))
+
+
+def test_totals_and_unknown_dimension(contracts):
+    packed = analytics.ContractMonths(contracts)
+    assert len(packed) == sum(len(contract['monthly_details']) for contract in contracts)
+    totals = packed.totals()
+    rows = list(_months(contracts, 0, 10 ** 6))
+    assert totals['months'] == len(rows)
+    assert totals['amount_paid'] == pytest.approx(sum(data['amount_paid'] for _, _, data in rows))
+    rates = [data['amount_paid'] / data['hours_worked'] for _, _, data in rows if data['hours_worked'] > 0]
+    assert totals['p50'] == pytest.approx(_percentile(rates, 50))
+    assert packed.totals(first=0, last=0)['p50'] is None
+    with pytest.raises(ValueError):
+        packed.grouped('city')
+
+
+def test_grouped_percentiles_and_top():
+    codes = np.array([0, 2, 0, 0, 2])
+    values = np.array([3.0, 1.0, 1.0, 2.0, 5.0])
+    result = analytics.grouped_percentiles(codes, values, 3, (0, 50, 100))
+    assert result[:, 0].tolist() == [1.0, 2.0, 3.0]
+    assert np.isnan(result[:, 1]).all()
+    assert result[:, 2].tolist() == [1.0, 3.0, 5.0]
+    grouped = {'overrun': np.array([1.0, np.nan, 7.0, 3.0])}
+    assert analytics.top(grouped, 'overrun', 2) == [2, 3]
+    assert analytics.top(grouped, 'overrun', 10, descending=False) == [0, 3, 2, 1]
@@ -0,0 +1,308 @@
+# Prove delle rotte con il client di test di Flask, sul backend in memoria con
+# i dati di esempio.
+from datetime import datetime, timedelta
+import sys
+import threading
+import uuid
+
+import pytest
+
+import app as app_module
+from ids import format_id, new_id
+from ledger import MonthlyLedger
+
+repo = app_module.repo
+
+
+@pytest.fixture
+def client():
+    app_module.app.config['TESTING'] = True
+    return app_module.app.test_client()
+
+
+def test_concurrent_edits_cannot_share_an_email():
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for trial in range(30):
+            client_ids = [repo.insert('clients', {'id': new_id(), 'name': f'Gara {trial}-{k}',
+                                                  'email': f'gara{trial}-{k}@example.it'})['id']
+                          for k in range(2)]
+            email = f'condivisa{trial}@example.it'
+            barrier = threading.Barrier(len(client_ids))
+
+            def edit(client_id):
+                test_client = app_module.app.test_client()
+                barrier.wait()
+                test_client.post(f'/edit_client/{format_id(client_id)}',
+                                 data={'name': 'Gara', 'email': email, 'vat_id': ''})
+
+            threads = [threading.Thread(target=edit, args=(client_id,)) for client_id in client_ids]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert sum(repo.get('clients', client_id)['email'] == email for client_id in client_ids) == 1
+    finally:
+        sys.setswitchinterval(interval)
+
+
+def test_reports_after_deleting_a_client(client):
+    alpha = next(record for record in repo.all('clients') if record['name'] == 'Azienda Alpha')
+    assert repo.client_services_for_client(alpha['id'])
+    response = client.get(f"/delete_client/{format_id(alpha['id'])}")
+    assert response.status_code == 302
+    response = client.get('/reports?from=2023-01-01&to=2023-12-31')
+    assert response.status_code == 200
+
+
+def test_dashboard_totals_follow_concurrent_saves():
+    client_id, service_id = repo.all('clients')[0]['id'], repo.all('services')[0]['id']
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for _ in range(150):
+            contract = repo.insert('client_services', {
+                'id': new_id(), 'client_id': client_id, 'service_id': service_id, 'subscribed_price': 100.0,
+                'start_date': datetime(2023, 1, 1), 'end_date': datetime(2023, 12, 31), 'notes': '',
+                'monthly_details': MonthlyLedger.for_range(datetime(2023, 1, 1), datetime(2023, 12, 31))})
+            app_module.rollups.contract_saved(contract)
+            url = f"/clients/{format_id(client_id)}/monthly_details/{format_id(contract['id'])}"
+            barrier = threading.Barrier(2)
+
+            def save(hours):
+                test_client = app_module.app.test_client()
+                barrier.wait()
+                test_client.patch(url, json={'cells': [{'year': 2023, 'month': 1, 'field': 'hours_worked',
+                                                        'value': hours}]})
+
+            threads = [threading.Thread(target=save, args=(hours,)) for hours in (10, 20)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            # L'ultima versione vista dagli aggregati è quella confermata per ultima
+            stored = repo.get('client_services', contract['id'])['monthly_details']
+            _, client_services, _ = app_module.rollups.contracts()
+            seen = next(cs for cs in client_services if cs['id'] == contract['id'])
+            assert seen['monthly_details'].hours_worked[0] == stored.hours_worked[0]
+    finally:
+        sys.setswitchinterval(interval)
+
+
+def _future_contract(client_id, service_id, days):
+    start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    end = start + timedelta(days=days)
+    return {'id': new_id(), 'client_id': client_id, 'service_id': service_id, 'subscribed_price': 50.0,
+            'start_date': start, 'end_date': end, 'notes': '',
+            'monthly_details': MonthlyLedger.for_range(start, end)}
+
+
+def test_deleting_a_client_cancels_its_renewals(client):
+    renewals = app_module.renewals
+    client_id = repo.insert('clients', {'id': new_id(), 'name': 'Rinnovi Srl'})['id']
+    service_id = repo.all('services')[0]['id']
+    contract = repo.insert('client_services', _future_contract(client_id, service_id, 300))
+    renewals.schedule(contract)
+    assert any(record_id == contract['id'] for _, record_id in renewals.expiring(datetime.now(), 366))
+    client.get(f'/delete_client/{format_id(client_id)}')
+    assert all(record_id != contract['id'] for _, record_id in renewals.expiring(datetime.now(), 366))
+
+
+def test_bulk_deleting_services_cancels_their_renewals(client):
+    renewals = app_module.renewals
+    client_id = repo.all('clients')[0]['id']
+    service_id = repo.insert('services', {'id': new_id(), 'name': 'Da eliminare', 'price': 1.0})['id']
+    contract = repo.insert('client_services', _future_contract(client_id, service_id, 5))
+    renewals.schedule(contract)
+    client.post('/bulk_delete/services', data={'ids': [format_id(service_id)]})
+    assert renewals.tick(datetime.now()) == []
+    assert all(record_id != contract['id'] for _, record_id in renewals.pending())
+
+
+def test_editing_a_contract_to_a_past_end_date_leaves_the_queue(client):
+    renewals = app_module.renewals
+    client_id, service_id = repo.all('clients')[0]['id'], repo.all('services')[0]['id']
+    contract = repo.insert('client_services', _future_contract(client_id, service_id, 200))
+    renewals.schedule(contract)
+    client.post(f"/clients/{format_id(client_id)}/edit_service/{format_id(contract['id'])}",
+                data={'service_id': format_id(service_id), 'subscribed_price': '50', 'notes': '',
+                      'start_date': '2020-01-01', 'end_date': '2020-12-31'})
+    assert repo.get('client_services', contract['id'])['end_date'] == datetime(2020, 12, 31)
+    assert renewals.tick(datetime.now()) == []
+    assert all(record_id != contract['id'] for _, record_id in renewals.pending())
+
+
+def test_rollups_load_keeps_commits_made_after_the_snapshot(monkeypatch):
+    client_id, service_id = repo.all('clients')[0]['id'], repo.all('services')[0]['id']
+    contract = _future_contract(client_id, service_id, 40)
+    take_snapshot = repo.snapshot
+
+    def snapshot_then_commit():
+        # Un salvataggio confermato subito dopo lo snapshot letto dal caricamento
+        snapshot = take_snapshot()
+        with repo.transaction() as tx:
+            tx.on_commit(app_module.rollups.contract_saved, tx.insert('client_services', contract))
+        return snapshot
+
+    monkeypatch.setattr(repo, 'snapshot', snapshot_then_commit)
+    app_module.load_rollups()
+    monkeypatch.undo()
+    _, client_services, _ = app_module.rollups.contracts()
+    assert any(cs['id'] == contract['id'] for cs in client_services)
+
+
+def test_import_data_refuses_a_memory_backend_without_data_directory(tmp_path):
+    path = tmp_path / 'clients.json'
+    path.write_text('[{"nome": "Da importare"}]', encoding='utf-8')
+    result = app_module.app.test_cli_runner().invoke(args=['import-data', str(path)])
+    assert result.exit_code != 0
+    assert 'CRM_DATA_DIR' in result.output
+    assert not any(record['name'] == 'Da importare' for record in repo.all('clients'))
+
+
+def test_client_urls_accept_base32_and_legacy_uuid_ids(client):
+    legacy = uuid.uuid4()
+    repo.insert('clients', {'id': legacy.int, 'name': 'Cliente con uuid', 'created_at': datetime(2022, 5, 1)})
+    for text in (format_id(legacy.int), format_id(legacy.int).lower(), str(legacy)):
+        response = client.get(f'/clients/{text}')
+        assert response.status_code == 200
+        assert 'Cliente con uuid' in response.get_data(as_text=True)
+    assert client.get('/clients/non-un-id').status_code == 404
+
+
+def test_bulk_delete_removes_clients_with_their_contracts(client):
+    client_ids = [repo.insert('clients', {'id': new_id(), 'name': f'Massivo {k}'})['id'] for k in range(3)]
+    service_id = repo.all('services')[0]['id']
+    contract = repo.insert('client_services', _future_contract(client_ids[0], service_id, 30))
+    response = client.post('/bulk_delete/clients', data={'ids': [format_id(client_id) for client_id in client_ids[:2]]
+                                                         + ['non-un-id']})
+    assert response.status_code == 302
+    assert [repo.get('clients', client_id) is None for client_id in client_ids] == [True, True, False]
+    assert repo.get('client_services', contract['id']) is None
+    assert client.post('/bulk_delete/client_services', data={'ids': ['1']}).status_code == 302
+
+
+def _saved_contract(start=datetime(2023, 1, 1), end=datetime(2023, 3, 31)):
+    client_id, service_id = repo.all('clients')[0]['id'], repo.all('services')[0]['id']
+    contract = repo.insert('client_services', {
+        'id': new_id(), 'client_id': client_id, 'service_id': service_id, 'subscribed_price': 100.0,
+        'start_date': start, 'end_date': end, 'notes': '', 'monthly_details': MonthlyLedger.for_range(start, end)})
+    return client_id, contract
+
+
+def test_monthly_form_saves_into_the_ledger(client):
+    client_id, contract = _saved_contract()
+    url = f"/clients/{format_id(client_id)}/save_monthly_notes/{format_id(contract['id'])}"
+    response = client.post(url, data={'hours_2023_2': '7,5', 'amount_paid_2023_2': '300', 'note_2023_3': 'Saldo',
+                                      'estimated_hours_2023_1': 'molte'})
+    assert response.status_code == 302
+    details = repo.get('client_services', contract['id'])['monthly_details']
+    # '7,5' e 'molte' non sono numeri: le altre celle vengono salvate comunque
+    assert list(details.hours_worked) == [0.0, 0.0, 0.0]
+    assert list(details.amount_paid) == [0.0, 300.0, 0.0]
+    assert details.notes == {2: 'Saldo'}
+    assert contract['monthly_details'].notes == {}
+    page = client.get(f"/clients/{format_id(client_id)}/view_service/{format_id(contract['id'])}")
+    assert page.status_code == 200 and 'Saldo' in page.get_data(as_text=True)
+
+
+def test_patch_saves_only_the_sent_cells(client):
+    client_id, contract = _saved_contract()
+    url = f"/clients/{format_id(client_id)}/monthly_details/{format_id(contract['id'])}"
+    response = client.patch(url, json={'cells': [
+        {'year': 2023, 'month': 2, 'field': 'hours_worked', 'value': '7,5'},
+        {'year': 2023, 'month': 3, 'field': 'notes', 'value': 'Saldo'}]})
+    assert response.status_code == 200 and response.get_json() == {'saved': 2}
+    details = repo.get('client_services', contract['id'])['monthly_details']
+    assert list(details.hours_worked) == [0.0, 7.5, 0.0]
+    assert details.notes == {2: 'Saldo'}
+
+
+def test_patch_rejects_every_invalid_cell_and_saves_nothing(client):
+    client_id, contract = _saved_contract()
+    url = f"/clients/{format_id(client_id)}/monthly_details/{format_id(contract['id'])}"
+    response = client.patch(url, json={'cells': [
+        {'year': 2023, 'month': 1, 'field': 'amount_paid', 'value': 100},
+        {'year': 2023, 'month': 1, 'field': 'price', 'value': 1},
+        {'year': 2023, 'month': 7, 'field': 'hours_worked', 'value': 1},
+        {'year': 2023, 'month': 2, 'field': 'hours_worked', 'value': 'molte'},
+        {'year': 2023, 'month': 2, 'field': 'hours_worked', 'value': float('inf')},
+        {'year': 2023, 'month': 3, 'field': 'notes', 'value': 5},
+        'cella']})
+    assert response.status_code == 422
+    assert [error['index'] for error in response.get_json()['errors']] == [1, 2, 3, 4, 5, 6]
+    assert repo.get('client_services', contract['id'])['monthly_details'] == contract['monthly_details']
+
+
+def test_patch_requires_cells_and_an_existing_contract(client):
+    client_id, contract = _saved_contract()
+    url = f"/clients/{format_id(client_id)}/monthly_details/{format_id(contract['id'])}"
+    assert client.patch(url, json={}).status_code == 400
+    assert client.patch(url, json={'cells': []}).status_code == 400
+    assert client.patch(url, data='non json').status_code == 400
+    too_many = [{'year': 2023, 'month': 1, 'field': 'notes', 'value': ''}] * (app_module.MONTH_CELLS_LIMIT + 1)
+    assert client.patch(url, json={'cells': too_many}).status_code == 400
+    missing = f"/clients/{format_id(client_id)}/monthly_details/{format_id(new_id())}"
+    cell = {'year': 2023, 'month': 1, 'field': 'notes', 'value': 'x'}
+    assert client.patch(missing, json={'cells': [cell]}).status_code == 404
+
+
+def test_month_close_saves_the_whole_grid_or_nothing(client):
+    _, contract = _saved_contract(datetime(2019, 5, 1), datetime(2019, 6, 30))
+    names = {field: f"{field}-{format_id(contract['id'])}" for field, _ in app_module.MONTH_CLOSE_FIELDS}
+    page = client.get('/month_close/2019/6')
+    assert page.status_code == 200 and names['hours_worked'] in page.get_data(as_text=True)
+
+    response = client.post('/month_close/2019/6', data={names['hours_worked']: '4', names['amount_paid']: 'tanto'})
+    assert response.status_code == 200
+    assert repo.get('client_services', contract['id'])['monthly_details'] == contract['monthly_details']
+
+    response = client.post('/month_close/2019/6', data={names['hours_worked']: '4', names['amount_paid']: '150,5'})
+    assert response.status_code == 302
+    details = repo.get('client_services', contract['id'])['monthly_details']
+    assert list(details.hours_worked) == [0.0, 4.0] and list(details.amount_paid) == [0.0, 150.5]
+    assert client.get('/month_close/2019/13').status_code == 302
+
+
+@pytest.mark.parametrize('query', ['sort=created_at&dir=desc', 'sort=non_esiste', 'after=!!!', 'after=NQ==',
+                                   'after=WzEsMl0=', 'created_at_from=2023-01-01&created_at_to=ieri'])
+def test_client_list_accepts_any_query_string(client, query):
+    assert client.get(f'/clients?{query}').status_code == 200
+
+
+def test_search_page(client):
+    repo.insert('clients', {'id': new_id(), 'name': 'Tipografia Zanzibar', 'city': 'Asti',
+                            'created_at': datetime(2024, 1, 1)})
+    page = client.get('/search?q=zanzib').get_data(as_text=True)
+    assert 'Tipografia Zanzibar' in page
+    assert 'Tipografia Zanzibar' not in client.get('/search?q=zanzib&tipo=prospects').get_data(as_text=True)
+    assert client.get('/search').status_code == 200
+
+
+def test_autocomplete_endpoint(client):
+    service_id = repo.insert('services', {'id': new_id(), 'name': 'Quokka hosting', 'price': 12.5})['id']
+    items = client.get('/autocomplete/services?q=quok').get_json()
+    assert items == [{'id': format_id(service_id), 'name': 'Quokka hosting', 'label': 'Quokka hosting - 12.50 €',
+                      'price': 12.5}]
+    assert client.get('/autocomplete/services?q=quok&limit=abc').get_json() == items
+    assert client.get('/autocomplete/client_services?q=a').status_code == 404
+
+
+def test_export_route(client):
+    response = client.get('/export/services.csv')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert response.headers['Content-Disposition'].startswith('attachment; filename="services-')
+    assert response.get_data(as_text=True).splitlines()[0] == 'id,name,description,price'
+    assert client.get('/export/services.xlsx').status_code == 404
+    assert client.get('/export/collaborators.csv').status_code == 404
+
+
+@pytest.mark.parametrize('query', ['', 'by=service&sort=hourly_rate&order=asc', 'by=agent&from=2024-12&to=2023-01',
+                                   'by=città&sort=nulla&from=ieri'])
+def test_analytics_page(client, query):
+    app_module.load_rollups()
+    response = client.get(f'/analytics?{query}')
+    assert response.status_code == (200 if app_module.analytics.AVAILABLE else 302)
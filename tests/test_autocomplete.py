@@ -0,0 +1,27 @@
+# Completamento automatico: ricerca per prefisso sull'indice ordinato dei nomi,
+# senza distinzione di maiuscole, in ordine alfabetico e con un limite.
+from repository import Repository
+
+
+def _repo(names):
+    repo = Repository()
+    with repo.transaction() as tx:
+        for record_id, name in enumerate(names, 1):
+            tx.insert('services', {'id': record_id, 'name': name, 'price': 10.0})
+    return repo
+
+
+def test_prefix_search_is_case_insensitive_and_ordered():
+    repo = _repo(['consulenza fiscale', 'Assistenza', 'Consulenza', 'CONTABILITÀ', 'Corso base', None])
+    assert [record['name'] for record in repo.prefix_search('services', 'con')] == [
+        'Consulenza', 'consulenza fiscale', 'CONTABILITÀ']
+    assert [record['name'] for record in repo.prefix_search('services', 'CONS', limit=1)] == ['Consulenza']
+    assert repo.prefix_search('services', '') == []
+    assert repo.prefix_search('services', 'zz') == []
+
+
+def test_prefix_search_follows_renames():
+    repo = _repo(['Consulenza', 'Assistenza'])
+    repo.update('services', 1, name='Revisione')
+    assert repo.prefix_search('services', 'con') == []
+    assert [record['id'] for record in repo.prefix_search('services', 're')] == [1]
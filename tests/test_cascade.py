@@ -0,0 +1,73 @@
+# Eliminazioni a cascata: eliminando un cliente o un servizio di catalogo le
+# sottoscrizioni collegate spariscono dalla tabella e da tutti gli indici.
+from datetime import datetime
+
+import pytest
+
+from repository import Repository
+
+EVERYTHING = (datetime(2000, 1, 1), datetime(2100, 12, 31))
+
+
+@pytest.fixture
+def repo():
+    repo = Repository()
+    with repo.transaction() as tx:
+        for client_id in (1, 2):
+            tx.insert('clients', {'id': client_id, 'name': f'Cliente {client_id}'})
+        for service_id in (10, 20):
+            tx.insert('services', {'id': service_id, 'name': f'Servizio {service_id}'})
+        cs_id = 100
+        for client_id in (1, 2):
+            for service_id in (10, 20):
+                tx.insert('client_services', {'id': cs_id, 'client_id': client_id, 'service_id': service_id,
+                                              'start_date': datetime(2023, 1, 1),
+                                              'end_date': datetime(2023, 6, cs_id % 28 + 1)})
+                cs_id += 1
+    return repo
+
+
+def _assert_consistent(repo):
+    snapshot = repo.snapshot()
+    remaining = {cs['id'] for cs in snapshot.all('client_services')}
+    assert {cs['id'] for cs in snapshot.client_services_ending(*EVERYTHING)} == remaining
+    assert {cs['id'] for cs in snapshot.client_services_active(*EVERYTHING)} == remaining
+    for client in snapshot.all('clients'):
+        assert all(cs['id'] in remaining for cs in snapshot.client_services_for_client(client['id']))
+    for service in snapshot.all('services'):
+        assert all(cs['id'] in remaining for cs in snapshot.client_services_for_service(service['id']))
+    return remaining
+
+
+def test_delete_client(repo):
+    repo.delete('clients', 1)
+    remaining = _assert_consistent(repo)
+    assert {repo.get('client_services', cs_id)['client_id'] for cs_id in remaining} == {2}
+
+
+def test_delete_service(repo):
+    repo.delete('services', 20)
+    remaining = _assert_consistent(repo)
+    assert {repo.get('client_services', cs_id)['service_id'] for cs_id in remaining} == {10}
+
+
+def test_delete_many(repo):
+    repo.delete_many('clients', [1, 2])
+    assert _assert_consistent(repo) == set()
+
+
+def test_delete_many_returns_only_removed_records(repo):
+    removed = repo.delete_many('services', [10, 99, 10])
+    assert [record['id'] for record in removed] == [10]
+    assert {repo.get('client_services', cs_id)['service_id'] for cs_id in _assert_consistent(repo)} == {20}
+
+
+def test_failed_transaction_keeps_the_cascade_out(repo):
+    before = repo.snapshot()
+    with pytest.raises(RuntimeError):
+        with repo.transaction() as tx:
+            tx.delete('clients', 1)
+            assert tx.client_services_for_client(1) == []
+            raise RuntimeError('annullata')
+    assert repo.snapshot() is before
+    assert len(repo.client_services_for_client(1)) == 2
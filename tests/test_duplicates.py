@@ -0,0 +1,66 @@
+# Rilevamento dei clienti duplicati: chiavi esatte normalizzate e nomi simili.
+# Il filtro sui prefissi deve trovare tutte le coppie che il confronto
+# completo trova, anche dopo il ricalcolo dell'ordine dei trigrammi.
+import random
+
+import pytest
+
+import duplicates
+from duplicates import DuplicateIndex, name_grams, normalize_email, normalize_name, normalize_vat, similarity
+from repository import Repository
+
+WORDS = ('Alfa', 'Beta', 'Gamma', 'Delta', 'Impianti', 'Edilizia', 'Rossi', 'Bianchi', 'Verdi', 'Caffè',
+         'Studio', 'Tecnico', 'Nord', 'Sud', 'Trasporti', 'Logistica')
+SUFFIXES = ('', ' S.r.l.', ' srl', ' SPA', ' & C. snc')
+
+
+def test_normalization():
+    assert normalize_vat(' IT 012.345-678/90 ') == normalize_vat('01234567890') == '01234567890'
+    assert normalize_vat('DE123456789') == 'DE123456789'
+    assert normalize_email('  Info@Alpha.IT ') == 'info@alpha.it'
+    assert normalize_name('Beta S.r.l.') == normalize_name('BETA srl') == 'beta'
+    assert normalize_name('S.r.l.') == 'srl'
+    assert name_grams('Bè') == frozenset({'be'}) and name_grams('') == frozenset()
+    assert similarity(name_grams('Rossi Impianti'), name_grams('Rossi Impianti srl')) == 1.0
+
+
+def test_exact_matches_come_first():
+    repo = Repository()
+    repo.insert('clients', {'id': 1, 'name': 'Alfa Impianti', 'vat_id': 'IT01234567890'})
+    repo.insert('clients', {'id': 2, 'name': 'Qualcun Altro', 'email': 'info@alfa.it'})
+    repo.insert('clients', {'id': 3, 'name': 'Alfa Impianti Nord'})
+    found = [(client['id'], reason) for client, reason, _ in repo.find_duplicates(
+        {'name': 'Alfa Impianti srl', 'vat_id': '01234567890', 'email': 'INFO@alfa.it '})]
+    assert found == [(1, 'vat_id'), (2, 'email'), (3, 'name')]
+    assert repo.find_duplicates({'name': 'Alfa Impianti', 'vat_id': 'IT01234567890'}, exclude_id=1)[0][0]['id'] == 3
+    repo.update('clients', 1, vat_id='IT09999999999')
+    repo.delete('clients', 2)
+    assert [reason for _, reason, _ in repo.find_duplicates({'vat_id': '01234567890', 'email': 'info@alfa.it'})] == []
+
+
+@pytest.mark.parametrize('rerank_min', [1000, 20])
+def test_prefix_filter_finds_every_similar_name(monkeypatch, rerank_min):
+    monkeypatch.setattr(duplicates, 'RERANK_MIN', rerank_min)
+    rng = random.Random(rerank_min)
+    index = DuplicateIndex()
+    names = {}
+    for record_id in range(300):
+        name = ' '.join(rng.sample(WORDS, rng.randrange(1, 4))) + rng.choice(SUFFIXES)
+        if rng.random() < 0.3 and names:
+            # Variante di un nome esistente con un carattere cambiato
+            base = names[rng.choice(list(names))]
+            position = rng.randrange(len(base))
+            name = base[:position] + rng.choice('aeiou') + base[position + 1:]
+        names[record_id] = name
+        index.apply([('put', 'clients', {'id': record_id, 'name': name})])
+    for record_id in rng.sample(list(names), 50):
+        del names[record_id]
+        index.apply([('delete', 'clients', record_id)])
+
+    for probe in list(names.values())[:80] + ['Rossi Impianti', 'Studio Tecnico Verdi srl']:
+        grams = name_grams(probe)
+        expected = {record_id for record_id, name in names.items()
+                    if similarity(grams, name_grams(name)) >= duplicates.NAME_SIMILARITY}
+        found = index.find({'name': probe}, limit=len(names))
+        assert {record_id for record_id, _, _ in found} == expected
+        assert [score for _, _, score in found] == sorted((score for _, _, score in found), reverse=True)
@@ -0,0 +1,55 @@
+# Esportazioni in streaming: i blocchi ricompongono lo stesso file, le righe
+# si rileggono con csv e json, la vista contratto-mese ha una riga per mese.
+import csv
+from datetime import datetime
+import io
+import json
+
+import pytest
+
+from exports import csv_chunks, export_chunks, ndjson_chunks
+from ids import format_id, new_id
+from ledger import MonthlyLedger
+from repository import Repository
+
+
+@pytest.fixture
+def snapshot():
+    repo = Repository()
+    client_id, service_id = new_id(), new_id()
+    details = MonthlyLedger.for_range(datetime(2024, 1, 1), datetime(2024, 2, 1)).updated(
+        [(0, 'hours_worked', 3.5), (1, 'notes', 'Virgola, "virgolette"\ne a capo')])
+    with repo.transaction() as tx:
+        tx.insert('clients', {'id': client_id, 'name': 'Caffè Roma', 'city': 'Torino',
+                              'created_at': datetime(2024, 1, 5, 9, 30)})
+        tx.insert('services', {'id': service_id, 'name': 'Consulenza', 'price': 100.0})
+        tx.insert('client_services', {'id': new_id(), 'client_id': client_id, 'service_id': service_id,
+                                      'subscribed_price': 90.0, 'start_date': datetime(2024, 1, 1),
+                                      'end_date': datetime(2024, 2, 29), 'notes': '', 'monthly_details': details})
+    return repo.snapshot()
+
+
+def test_chunks_rebuild_the_same_file():
+    rows = [{'id': record_id, 'name': f'Cliente {record_id}'} for record_id in range(500)]
+    for writer in (csv_chunks, ndjson_chunks):
+        chunks = list(writer(rows, ('id', 'name'), chunk_size=100))
+        assert len(chunks) > 10
+        assert ''.join(chunks) == ''.join(writer(rows, ('id', 'name')))
+
+
+def test_csv_export(snapshot):
+    text = ''.join(export_chunks(snapshot, 'clients', 'csv'))
+    [row] = list(csv.DictReader(io.StringIO(text)))
+    client = snapshot.all('clients')[0]
+    assert row['id'] == format_id(client['id'])
+    assert row['name'] == 'Caffè Roma' and row['created_at'] == '2024-01-05T09:30:00'
+    assert row['email'] == ''
+
+
+def test_contract_months_export(snapshot):
+    rows = [json.loads(line) for line in ''.join(export_chunks(snapshot, 'contract_months', 'ndjson')).splitlines()]
+    assert [(row['year'], row['month']) for row in rows] == [(2024, 1), (2024, 2)]
+    assert rows[0]['hours_worked'] == 3.5 and rows[0]['client_name'] == 'Caffè Roma'
+    assert rows[1]['notes'] == 'Virgola, "virgolette"\ne a capo'
+    text = ''.join(export_chunks(snapshot, 'contract_months', 'csv'))
+    assert [row['notes'] for row in csv.DictReader(io.StringIO(text))] == ['', 'Virgola, "virgolette"\ne a capo']
@@ -0,0 +1,78 @@
+# Faccette dell'elenco clienti: conteggi e filtri delle bitmap confrontati con
+# una scansione dei record.
+import random
+
+from facets import bit_count, facet_value
+from repository import Repository
+
+CITIES = ('Torino', 'Milano', 'Roma', '')
+AGENTS = ('Anna', 'Luca', '')
+
+
+def _repo(rng):
+    repo = Repository()
+    with repo.transaction() as tx:
+        for record_id in range(1, 301):
+            tx.insert('clients', {'id': record_id, 'name': f'Cliente {record_id}', 'city': rng.choice(CITIES),
+                                  'agent': rng.choice(AGENTS), 'zip': rng.choice(('10100', '20100', ''))})
+    return repo
+
+
+def test_bit_count():
+    assert bit_count(0) == 0
+    assert bit_count(0b1011) == 3
+    assert bit_count((1 << 500) | 1) == 2
+
+
+def test_counts_match_a_scan():
+    rng = random.Random(5)
+    repo = _repo(rng)
+    # Qualche modifica e cancellazione per lasciare buchi nella numerazione delle righe
+    for record_id in rng.sample(range(1, 301), 40):
+        repo.update('clients', record_id, city=rng.choice(CITIES))
+    for record_id in rng.sample(range(1, 301), 30):
+        repo.delete('clients', record_id)
+    clients = repo.all('clients')
+
+    selection = {'city': ['Torino', 'Roma'], 'agent': ['Anna']}
+    counts, total = repo.facet_counts('clients', selection)
+    selected = [client for client in clients
+                if facet_value(client, 'city') in ('Torino', 'Roma') and facet_value(client, 'agent') == 'Anna']
+    assert total == len(selected)
+    # Per ogni campo si contano le righe che soddisfano gli altri filtri
+    city_counts = {value: count for value, count, _ in counts['city']}
+    for city in ('Torino', 'Milano', 'Roma'):
+        expected = sum(1 for client in clients
+                       if facet_value(client, 'city') == city and facet_value(client, 'agent') == 'Anna')
+        assert city_counts.get(city, 0) == expected
+
+    page, _ = repo.page('clients', 'name', facets=selection, limit=1000)
+    assert sorted(client['id'] for client in page) == sorted(client['id'] for client in selected)
+
+
+def test_row_numbers_are_compacted_after_many_deletes(monkeypatch):
+    monkeypatch.setattr('repository.FREE_ROWS_LIMIT', 16)
+    rng = random.Random(7)
+    repo = _repo(rng)
+    old = repo.snapshot()
+    old_counts = old.facet_counts('clients', {'city': ['Torino']})
+    old_page, _ = old.page('clients', 'name', facets={'city': ['Torino']}, limit=1000)
+    next_id = 301
+    for _ in range(20):
+        # Inserimenti ed eliminazioni ripetuti: i record presenti restano circa 300
+        with repo.transaction() as tx:
+            for record_id in rng.sample([client['id'] for client in tx.all('clients')], 25):
+                tx.delete('clients', record_id)
+            for _ in range(25):
+                tx.insert('clients', {'id': next_id, 'name': f'Cliente {next_id}', 'city': rng.choice(CITIES)})
+                next_id += 1
+    snapshot = repo.snapshot()
+    assert len(snapshot._rows['clients']) <= 2 * snapshot.count('clients')
+    clients = snapshot.all('clients')
+    counts, total = snapshot.facet_counts('clients', {'city': ['Torino']})
+    assert total == sum(1 for client in clients if facet_value(client, 'city') == 'Torino')
+    page, _ = snapshot.page('clients', 'name', facets={'city': ['Torino']}, limit=1000)
+    assert len(page) == total
+    # Lo snapshot preso prima della rinumerazione continua a vedere i suoi dati
+    assert old.facet_counts('clients', {'city': ['Torino']}) == old_counts
+    assert old.page('clients', 'name', facets={'city': ['Torino']}, limit=1000)[0] == old_page
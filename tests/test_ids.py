@@ -0,0 +1,67 @@
+# Id interi ordinati nel tempo: forma testuale per URL e form, lettura degli
+# id delle versioni precedenti (uuid e decimali) e migrazione dei dati salvati.
+import json
+import uuid
+
+from ids import ENCODED_LENGTH, format_id, migrate_record, new_id, parse_id
+from journal import Journal
+from repository import Repository
+
+
+def test_new_ids_follow_creation_order():
+    ids = [new_id() for _ in range(5000)]
+    assert ids == sorted(ids) and len(set(ids)) == len(ids)
+    # Versione 7 e variante RFC 4122, come un UUIDv7
+    value = uuid.UUID(int=ids[0])
+    assert value.version == 7 and value.variant == uuid.RFC_4122
+
+
+def test_format_and_parse_round_trip():
+    ids = [new_id() for _ in range(100)]
+    texts = [format_id(value) for value in ids]
+    assert all(len(text) == ENCODED_LENGTH for text in texts)
+    assert [parse_id(text) for text in texts] == ids
+    assert [parse_id(text.lower()) for text in texts] == ids
+    # Le stringhe hanno lo stesso ordine degli interi
+    assert sorted(texts) == texts
+    # Gli id delle righe SQLite restano decimali
+    assert format_id(42) == '42' and parse_id('42') == 42
+    assert format_id(None) == ''
+
+
+def test_crockford_aliases_and_invalid_values():
+    text = format_id(new_id())
+    assert parse_id(text.replace('1', 'I').replace('0', 'O')) == parse_id(text)
+    assert parse_id('U' * ENCODED_LENGTH) is None
+    assert parse_id('Z' * ENCODED_LENGTH) is None       # oltre i 128 bit
+    for value in (None, True, -1, 1 << 128, '', 'abc', '12a', '1' * 21, 3.0, '٣'):
+        assert parse_id(value) is None
+
+
+def test_legacy_uuids_are_parsed_and_migrated():
+    legacy = uuid.uuid4()
+    assert parse_id(str(legacy)) == legacy.int
+    assert parse_id('not-a-uuid-but-36-characters-long-xx') is None
+    record = migrate_record({'id': str(legacy), 'client_id': '7', 'service_id': 9, 'name': 'Invariato'})
+    assert record == {'id': legacy.int, 'client_id': 7, 'service_id': 9, 'name': 'Invariato'}
+
+
+def test_journal_restores_a_legacy_json_snapshot(tmp_path):
+    client_id, contract_id, service_id = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    (tmp_path / 'snapshot.json').write_text(json.dumps({'version': 4, 'tables': {
+        'clients': [{'id': str(client_id), 'name': 'Vecchio cliente'}],
+        'services': [{'id': str(service_id), 'name': 'Consulenza'}],
+        'client_services': [{'id': str(contract_id), 'client_id': str(client_id), 'service_id': str(service_id),
+                             'start_date': {'$dt': '2023-01-01T00:00:00'}, 'end_date': None}],
+    }}), encoding='utf-8')
+    (tmp_path / 'journal.jsonl').write_text(
+        json.dumps({'v': 5, 'ops': [['delete', 'services', str(service_id)]]}) + '\n', encoding='utf-8')
+    repo = Repository()
+    journal = Journal(str(tmp_path))
+    assert journal.restore(repo)
+    journal.close()
+    assert repo.snapshot().version == 5
+    assert repo.get('clients', client_id.int)['name'] == 'Vecchio cliente'
+    # Il vecchio delete con id stringa ha eliminato il servizio e, a cascata, il contratto
+    assert repo.get('services', service_id.int) is None
+    assert repo.get('client_services', contract_id.int) is None
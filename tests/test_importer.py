@@ -0,0 +1,56 @@
+# Importazione delle vecchie sorgenti: lettura in streaming dei file JSON,
+# conversione dei campi e conteggio degli errori riga per riga.
+import json
+import sqlite3
+
+from importer import Importer, iter_json_array
+from repository import Repository
+
+
+def _write_json(tmp_path, name, items):
+    path = tmp_path / name
+    path.write_text(json.dumps(items), encoding='utf-8')
+    return str(path)
+
+
+def test_json_array_is_read_across_chunk_boundaries(tmp_path):
+    items = [{'nome': f'Servizio {k}', 'prezzo': k + 0.25} for k in range(50)]
+    path = _write_json(tmp_path, 'services.json', items)
+    assert list(iter_json_array(path, chunk_size=7)) == items
+
+
+def test_malformed_row_is_counted_without_dropping_the_batch(tmp_path):
+    path = _write_json(tmp_path, 'services.json', [
+        {'id': 1, 'nome': 'Consulenza', 'prezzo': '120,50'},
+        {'id': 2, 'nome': 'Assistenza', 'prezzo': 'n/d'},
+        {'id': 3, 'nome': 'Formazione', 'prezzo': 80},
+    ])
+    repo = Repository()
+    [stats] = Importer(repo, batch_size=10).import_path(path)
+    assert (stats.read, stats.imported, stats.duplicates, stats.errors) == (3, 2, 0, 1)
+    prices = {service['name']: service['price'] for service in repo.snapshot().all('services')}
+    assert prices == {'Consulenza': 120.5, 'Formazione': 80.0}
+
+
+def test_contracts_with_bad_dates_are_errors(tmp_path):
+    path = tmp_path / 'manager.db'
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE clients (id INTEGER PRIMARY KEY, name TEXT, email TEXT);
+        CREATE TABLE services (id INTEGER PRIMARY KEY, name TEXT, price REAL);
+        CREATE TABLE client_service (id INTEGER PRIMARY KEY, client_id INTEGER, service_id INTEGER,
+                                     subscribed_price REAL, start_date TEXT, end_date TEXT);
+        INSERT INTO clients VALUES (1, 'Azienda Alpha', 'alpha@example.it');
+        INSERT INTO services VALUES (1, 'Consulenza', 100);
+        INSERT INTO client_service VALUES (1, 1, 1, 90, '2024-01-01', '2024-03-31');
+        INSERT INTO client_service VALUES (2, 1, 1, 90, 'ieri', NULL);
+        INSERT INTO client_service VALUES (3, 1, 1, 90, NULL, NULL);
+        INSERT INTO client_service VALUES (4, 1, 99, 90, '2024-01-01', NULL);
+    """)
+    conn.commit()
+    conn.close()
+    repo = Repository()
+    stats = {s.table: s for s in Importer(repo, batch_size=10).import_path(str(path))}
+    assert (stats['client_services'].imported, stats['client_services'].errors) == (1, 3)
+    [contract] = repo.snapshot().all('client_services')
+    assert len(contract['monthly_details']) == 3
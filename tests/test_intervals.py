@@ -0,0 +1,80 @@
+# Albero degli intervalli dei contratti: le ricerche coincidono con il
+# confronto di tutti gli intervalli, e le versioni precedenti non cambiano.
+from datetime import datetime, timedelta
+import random
+
+import pytest
+
+from intervals import OPEN_END, IntervalTree, contract_interval
+
+BASE = datetime(2020, 1, 1)
+
+
+def _random_interval(rng, record_id):
+    start = BASE + timedelta(days=rng.randrange(1500))
+    end = OPEN_END if rng.random() < 0.1 else start + timedelta(days=rng.randrange(0, 400))
+    return start, end, record_id
+
+
+def _expected(intervals, lo, hi):
+    # In ordine di inizio, a parità di inizio per id
+    ordered = sorted(intervals.values(), key=lambda interval: (interval[0], interval[2]))
+    return [record_id for start, end, record_id in ordered if start <= hi and end >= lo]
+
+
+def _queries(rng):
+    for _ in range(100):
+        lo = BASE + timedelta(days=rng.randrange(-50, 1600))
+        yield lo, lo + timedelta(days=rng.randrange(0, 90))
+    yield datetime.min, datetime.max
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_overlapping_matches_a_full_scan(bulk):
+    rng = random.Random(17)
+    intervals = {record_id: _random_interval(rng, record_id) for record_id in range(500)}
+    if bulk:
+        tree = IntervalTree.from_intervals(intervals.values())
+    else:
+        tree = IntervalTree()
+        for start, end, record_id in intervals.values():
+            tree = tree.inserted(start, end, record_id)
+    assert len(tree) == len(intervals)
+    for lo, hi in _queries(rng):
+        assert list(tree.overlapping(lo, hi)) == _expected(intervals, lo, hi)
+
+
+def test_old_versions_are_unchanged():
+    rng = random.Random(18)
+    intervals = {record_id: _random_interval(rng, record_id) for record_id in range(300)}
+    tree = IntervalTree.from_intervals(intervals.values())
+    versions = [(tree, dict(intervals))]
+    for step in range(400):
+        if step % 3 == 0:
+            record_id = rng.choice(list(intervals))
+            start, _, _ = intervals.pop(record_id)
+            tree = tree.removed(start, record_id)
+        else:
+            record_id = 1000 + step
+            intervals[record_id] = _random_interval(rng, record_id)
+            tree = tree.inserted(*intervals[record_id])
+        if step % 50 == 0:
+            versions.append((tree, dict(intervals)))
+    versions.append((tree, intervals))
+    for version, expected in versions:
+        assert len(version) == len(expected)
+        for lo, hi in _queries(rng):
+            assert list(version.overlapping(lo, hi)) == _expected(expected, lo, hi)
+
+
+def test_removing_a_missing_interval_returns_the_same_tree():
+    tree = IntervalTree().inserted(BASE, BASE, 1)
+    assert tree.removed(BASE, 2) is tree
+    assert tree.removed(BASE + timedelta(days=1), 1) is tree
+    assert len(tree.removed(BASE, 1)) == 0
+
+
+def test_contract_interval():
+    assert contract_interval({'start_date': BASE, 'end_date': None}) == (BASE, OPEN_END)
+    assert contract_interval({'start_date': BASE}) == (BASE, OPEN_END)
+    assert contract_interval({'start_date': BASE, 'end_date': BASE}) == (BASE, BASE)
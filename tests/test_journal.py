@@ -0,0 +1,70 @@
+# Journal del Repository in memoria: ripristino, compattazione e transazioni
+# che non si possono registrare.
+from datetime import datetime
+
+import pytest
+
+from ids import new_id
+from journal import Journal, JournalLockedError
+from repository import Repository
+
+
+def _boot(directory, compact_every=1000):
+    repo = Repository()
+    journal = Journal(str(directory), compact_every=compact_every)
+    journal.restore(repo)
+    repo.attach_journal(journal)
+    return repo, journal
+
+
+def test_restore_replays_snapshot_and_tail(tmp_path):
+    repo, journal = _boot(tmp_path, compact_every=5)
+    client_ids = [new_id() for _ in range(12)]
+    for client_id in client_ids:
+        repo.insert('clients', {'id': client_id, 'name': 'Cliente', 'created_at': datetime(2024, 1, 1)})
+    repo.update('clients', client_ids[0], name='Rinominato')
+    repo.delete('clients', client_ids[1])
+    journal.checkpoint()
+    repo.insert('clients', {'id': new_id(), 'name': 'Dopo lo snapshot'})
+    version = repo.snapshot().version
+    journal.close()
+
+    restored, journal = _boot(tmp_path)
+    snapshot = restored.snapshot()
+    assert snapshot.version == version
+    assert snapshot.count('clients') == 12
+    assert snapshot.get('clients', client_ids[0])['name'] == 'Rinominato'
+    assert snapshot.get('clients', client_ids[1]) is None
+    assert snapshot.get('clients', client_ids[2])['created_at'] == datetime(2024, 1, 1)
+    journal.close()
+
+
+def test_unserializable_change_is_not_published(tmp_path):
+    repo, journal = _boot(tmp_path)
+    client_id = new_id()
+    repo.insert('clients', {'id': client_id, 'name': 'Cliente'})
+    version = repo.snapshot().version
+
+    with pytest.raises(TypeError):
+        repo.update('clients', client_id, name=object())
+    assert repo.get('clients', client_id)['name'] == 'Cliente'
+    assert repo.snapshot().version == version
+
+    # Il repository resta utilizzabile e il journal coerente con ciò che si è visto
+    repo.update('clients', client_id, name='Aggiornato')
+    journal.close()
+    restored, journal = _boot(tmp_path)
+    assert restored.get('clients', client_id)['name'] == 'Aggiornato'
+    assert restored.snapshot().version == version + 1
+    journal.close()
+
+
+def test_data_directory_has_a_single_writer(tmp_path):
+    repo, journal = _boot(tmp_path)
+    with pytest.raises(JournalLockedError):
+        Journal(str(tmp_path))
+    repo.insert('clients', {'id': new_id(), 'name': 'Cliente'})
+    journal.close()
+    restored, journal = _boot(tmp_path)
+    assert restored.snapshot().count('clients') == 1
+    journal.close()
@@ -0,0 +1,55 @@
+# Dettagli mensili in forma colonnare: costruzione per intervallo di date,
+# copie con updated() e reframed(), righe con i campi dei vecchi dizionari.
+from datetime import datetime
+
+from ledger import MonthlyLedger, current_monthly_details
+from months import month_index
+
+
+def test_for_range_covers_both_ends():
+    ledger = MonthlyLedger.for_range(datetime(2023, 11, 15), datetime(2024, 2, 1))
+    assert [(row.year, row.month) for row in ledger] == [(2023, 11), (2023, 12), (2024, 1), (2024, 2)]
+    assert ledger[0].month_name == 'November'
+    assert ledger[-1].as_dict() == {'month': 2, 'year': 2024, 'month_name': 'February', 'hours_worked': 0.0,
+                                    'amount_paid': 0.0, 'estimated_hours': 0.0, 'notes': ''}
+
+
+def test_ledgers_for_the_same_range_do_not_share_columns():
+    first = MonthlyLedger.for_range(datetime(2024, 1, 1), datetime(2024, 12, 1))
+    second = MonthlyLedger.for_range(datetime(2024, 1, 1), datetime(2024, 12, 1))
+    assert first == second
+    for field in ('hours_worked', 'amount_paid', 'estimated_hours', 'notes'):
+        assert getattr(first, field) is not getattr(second, field)
+    first.hours_worked[0] = 8.0
+    first.notes[0] = 'scritto sul posto'
+    assert second.hours_worked[0] == 0.0 and second.notes == {}
+    assert MonthlyLedger.for_range(datetime(2024, 1, 1), datetime(2024, 12, 1)).hours_worked[0] == 0.0
+
+
+def test_updated_copies_only_the_touched_columns():
+    ledger = MonthlyLedger.for_range(datetime(2024, 1, 1), datetime(2024, 3, 1))
+    updated = ledger.updated([(1, 'hours_worked', 5.0), (2, 'notes', 'Marzo')])
+    assert ledger.hours_worked[1] == 0.0 and ledger.notes == {}
+    assert updated.hours_worked[1] == 5.0 and updated[2].notes == 'Marzo'
+    assert updated.amount_paid is ledger.amount_paid
+    assert updated.updated([(2, 'notes', '')]).notes == {}
+
+
+def test_reframed_keeps_the_months_in_common():
+    ledger = MonthlyLedger.for_range(datetime(2024, 1, 1), datetime(2024, 4, 1)).updated(
+        [(0, 'amount_paid', 100.0), (3, 'amount_paid', 400.0), (3, 'notes', 'Aprile')])
+    moved = ledger.reframed(month_index(datetime(2024, 3, 1)), month_index(datetime(2024, 6, 1)))
+    assert [row.amount_paid for row in moved] == [0.0, 400.0, 0.0, 0.0]
+    assert moved[1].notes == 'Aprile'
+    assert moved.total('amount_paid') == 400.0
+    assert ledger.reframed(ledger.start, ledger.end) is ledger
+
+
+def test_open_contracts_are_shown_up_to_the_current_month():
+    contract = {'start_date': datetime(2024, 1, 1), 'end_date': None,
+                'monthly_details': MonthlyLedger.for_range(datetime(2024, 1, 1), datetime(2024, 2, 1))}
+    details = current_monthly_details(contract, today=datetime(2024, 5, 10))
+    assert (details.start, details.end) == (month_index(datetime(2024, 1, 1)), month_index(datetime(2024, 5, 1)))
+    assert contract['monthly_details'].end == month_index(datetime(2024, 2, 1))
+    contract['end_date'] = datetime(2024, 2, 29)
+    assert current_monthly_details(contract, today=datetime(2024, 5, 10)) is contract['monthly_details']
@@ -0,0 +1,74 @@
+# Mesi dei contratti senza data di fine: ogni lettura li estende fino al mese
+# corrente (ledger.current_monthly_details), anche se il contratto è stato
+# salvato l'ultima volta mesi fa.
+from datetime import datetime
+
+from ledger import MonthlyLedger, current_monthly_details
+from months import month_index
+from repository import Repository
+from rollups import Rollups
+
+START = datetime(2024, 1, 1)
+
+
+def _repo_with_open_contract():
+    repo = Repository()
+    repo.insert('clients', {'id': 1, 'name': 'Cliente'})
+    repo.insert('services', {'id': 2, 'name': 'Servizio'})
+    # Ultimo salvataggio a febbraio 2024: i mesi successivi non sono nel ledger
+    details = MonthlyLedger.for_range(START, datetime(2024, 2, 1)).updated([(0, 'hours_worked', 3.0)])
+    repo.insert('client_services', {'id': 3, 'client_id': 1, 'service_id': 2, 'subscribed_price': 10.0,
+                                    'start_date': START, 'end_date': None, 'monthly_details': details})
+    return repo
+
+
+def _expected_months():
+    return month_index(datetime.now()) - month_index(START) + 1
+
+
+def test_current_monthly_details_extends_open_contracts_only():
+    repo = _repo_with_open_contract()
+    client_service = repo.get('client_services', 3)
+    details = current_monthly_details(client_service)
+    assert len(details) == _expected_months()
+    assert details.hours_worked[0] == 3.0
+    closed = client_service.replace(end_date=datetime(2024, 2, 29))
+    assert current_monthly_details(closed) is closed['monthly_details']
+
+
+def test_exports_and_rollups_see_the_same_months():
+    repo = _repo_with_open_contract()
+    snapshot = repo.snapshot()
+    rows = list(snapshot.iter_contract_months())
+    assert len(rows) == _expected_months()
+    assert (rows[-1]['year'], rows[-1]['month']) == (datetime.now().year, datetime.now().month)
+
+    rollups = Rollups()
+    rollups.load(snapshot.iter_all('clients'), snapshot.iter_client_services())
+    assert rollups.totals()['billed'] == 10.0 * _expected_months()
+    assert rollups.get('month', month_index(datetime.now()))['billed'] == 10.0
+    _, client_services, _ = rollups.contracts()
+    assert len(client_services[0]['monthly_details']) == _expected_months()
+
+    # La differenza toglie esattamente quanto era stato aggiunto
+    rollups.contract_deleted(3)
+    assert rollups.totals()['billed'] == 0.0
+    assert rollups.get('month', month_index(datetime.now())) is None
+
+
+def test_rollups_extend_open_contracts_when_the_month_changes():
+    repo = _repo_with_open_contract()
+    snapshot = repo.snapshot()
+    rollups = Rollups()
+    rollups.load(snapshot.iter_all('clients'), snapshot.iter_client_services())
+    current = month_index(datetime.now())
+    state = rollups._state
+    # Aggregati calcolati il mese scorso
+    state.month = current - 1
+    rollups.contract_saved(repo.get('client_services', 3))
+    assert state.totals['month'].get(current) is None
+
+    generation = rollups.contracts()[0]
+    assert rollups.get('month', current)['billed'] == 10.0
+    assert rollups.totals()['billed'] == 10.0 * _expected_months()
+    assert rollups.contracts()[0] == generation
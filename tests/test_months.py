@@ -0,0 +1,40 @@
+# Tabella precalcolata dei mesi: stesse voci calcolate al momento, anche ai
+# bordi della tabella e fuori dagli anni coperti.
+import calendar
+from datetime import datetime
+
+import pytest
+
+from months import FIRST_YEAR, LAST_YEAR, MONTHS, month_index, month_info, month_of, months_between, year_month
+
+
+@pytest.mark.parametrize('year, month', [(2024, 2), (2023, 2), (2000, 12), (FIRST_YEAR, 1), (LAST_YEAR, 12),
+                                         (FIRST_YEAR - 1, 12), (LAST_YEAR + 1, 1), (1900, 2)])
+def test_month_info_inside_and_outside_the_table(year, month):
+    entry = month_info(year * 12 + month - 1)
+    assert (entry.year, entry.month) == (year, month) == year_month(entry.index)
+    assert entry.name == calendar.month_name[month]
+    assert entry.first_day == datetime(year, month, 1)
+    assert entry.last_day == datetime(year, month, calendar.monthrange(year, month)[1])
+    assert entry.label.endswith(f' {year}')
+
+
+def test_month_of_a_date():
+    assert month_index(datetime(2024, 3, 31, 23, 59)) == 2024 * 12 + 2
+    entry = month_of(datetime(2024, 3, 31, 23, 59))
+    assert (entry.label, entry.last_day) == ('Marzo 2024', datetime(2024, 3, 31))
+    assert month_of(datetime(2024, 3, 1)) is entry
+
+
+@pytest.mark.parametrize('first, last', [((2023, 11), (2024, 2)), ((FIRST_YEAR - 1, 10), (FIRST_YEAR, 3)),
+                                         ((LAST_YEAR, 11), (LAST_YEAR + 1, 2)), ((2024, 5), (2024, 4))])
+def test_months_between(first, last):
+    first, last = first[0] * 12 + first[1] - 1, last[0] * 12 + last[1] - 1
+    entries = list(months_between(first, last))
+    assert [entry.index for entry in entries] == list(range(first, last + 1))
+    assert entries == [month_info(index) for index in range(first, last + 1)]
+
+
+def test_table_covers_every_year():
+    assert len(MONTHS) == (LAST_YEAR - FIRST_YEAR + 1) * 12
+    assert all(entry.index == MONTHS[0].index + position for position, entry in enumerate(MONTHS))
@@ -0,0 +1,69 @@
+# Paginazione per chiave sugli indici ordinati: le pagine sfogliate con il
+# cursore coincidono con l'ordinamento completo, anche con filtri e intervalli.
+from datetime import datetime, timedelta
+import random
+
+import pytest
+
+from repository import Repository, sort_key
+
+CITIES = ('Torino', 'milano', 'Milano', None, '')
+
+
+@pytest.fixture
+def repo():
+    rng = random.Random(11)
+    repo = Repository()
+    with repo.transaction() as tx:
+        for record_id in range(1, 238):
+            tx.insert('clients', {'id': record_id, 'name': rng.choice(('Alfa', 'beta', 'Gamma', 'delta', 'Èpsilon')),
+                                  'city': rng.choice(CITIES),
+                                  'created_at': datetime(2022, 1, 1) + timedelta(days=rng.randrange(900))})
+    return repo
+
+
+def _walk(repo, order_by, **options):
+    records, after = [], None
+    while True:
+        page, after = repo.page('clients', order_by, after=after, limit=20, **options)
+        assert len(page) <= 20
+        records.extend(page)
+        if after is None:
+            return records
+
+
+@pytest.mark.parametrize('order_by', ['name', 'created_at', 'city'])
+@pytest.mark.parametrize('descending', [False, True])
+def test_pages_follow_the_full_order(repo, order_by, descending):
+    expected = sorted(repo.all('clients'), key=lambda record: (sort_key(record.get(order_by)), record['id']),
+                      reverse=descending)
+    assert [record['id'] for record in _walk(repo, order_by, descending=descending)] == \
+        [record['id'] for record in expected]
+
+
+def test_filters_ignore_case(repo):
+    found = _walk(repo, 'name', filters={'city': 'MILANO'})
+    assert found and all(record['city'].casefold() == 'milano' for record in found)
+    assert len(found) == sum(1 for record in repo.all('clients') if (record['city'] or '').casefold() == 'milano')
+    # Il filtro sul campo di ordinamento restringe direttamente l'intervallo dell'indice
+    assert [record['id'] for record in _walk(repo, 'city', filters={'city': 'milano'})] == \
+        sorted(record['id'] for record in found)
+
+
+def test_date_range_on_the_sort_field(repo):
+    start, end = datetime(2023, 1, 1), datetime(2023, 12, 31, 23, 59, 59)
+    found = _walk(repo, 'created_at', ranges={'created_at': (start, end)})
+    assert [record['id'] for record in found] == [
+        record['id'] for record in sorted(repo.all('clients'), key=lambda record: (record['created_at'], record['id']))
+        if start <= record['created_at'] <= end]
+    by_name = _walk(repo, 'name', ranges={'created_at': (start, end)})
+    assert sorted(record['id'] for record in by_name) == sorted(record['id'] for record in found)
+
+
+def test_cursor_survives_concurrent_inserts(repo):
+    first, after = repo.page('clients', 'name', limit=10)
+    repo.insert('clients', {'id': 1000, 'name': 'Aaa', 'created_at': datetime(2024, 1, 1)})
+    second, _ = repo.page('clients', 'name', after=after, limit=10)
+    # Il nuovo record precede il cursore: la pagina successiva non si sposta
+    assert not {record['id'] for record in first} & {record['id'] for record in second}
+    assert 1000 not in {record['id'] for record in second}
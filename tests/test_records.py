@@ -0,0 +1,55 @@
+# Record con __slots__: stessa interfaccia in lettura dei dizionari, campi
+# assenti, campi fuori dallo schema e copie con replace().
+import pytest
+
+from records import Client, ClientService, Service, as_record
+
+
+def test_record_reads_like_a_dict():
+    client = Client(id=1, name='Azienda Alpha', city='Torino')
+    assert client['name'] == client.name == 'Azienda Alpha'
+    assert client.get('city') == 'Torino'
+    assert 'city' in client and 'email' not in client
+    assert list(client) == client.keys() == ['id', 'name', 'city']
+    assert dict(client) == {**client} == {'id': 1, 'name': 'Azienda Alpha', 'city': 'Torino'}
+    assert client == {'id': 1, 'name': 'Azienda Alpha', 'city': 'Torino'}
+    assert len(client) == 3
+
+
+def test_missing_fields_behave_like_missing_keys():
+    service = Service(id=2, name='Consulenza')
+    assert service.get('price') is None
+    assert service.get('price', 0.0) == 0.0
+    with pytest.raises(KeyError):
+        service['price']
+    with pytest.raises(KeyError):
+        service['non_esiste']
+    # None è un valore, non un campo assente
+    contract = ClientService(id=3, end_date=None)
+    assert 'end_date' in contract and contract['end_date'] is None
+
+
+def test_fields_outside_the_schema_are_kept():
+    client = Client(id=1, name='Vecchio', partita_iva_legacy='IT123')
+    assert client['partita_iva_legacy'] == 'IT123'
+    assert client.keys() == ['id', 'name', 'partita_iva_legacy']
+    assert client.replace(name='Nuovo')['partita_iva_legacy'] == 'IT123'
+
+
+def test_replace_returns_a_new_record():
+    client = Client(id=1, name='Azienda Alpha', city='Torino')
+    moved = client.replace(city='Milano', email='info@alpha.it')
+    assert client['city'] == 'Torino' and 'email' not in client
+    assert moved == {'id': 1, 'name': 'Azienda Alpha', 'city': 'Milano', 'email': 'info@alpha.it'}
+    assert type(moved) is Client
+    assert client.copy() == client and client.copy() is not client
+    with pytest.raises(AttributeError):
+        client.__dict__
+
+
+def test_as_record_converts_dicts_once():
+    record = as_record('clients', {'id': 1, 'name': 'Azienda Alpha'})
+    assert type(record) is Client
+    assert as_record('clients', record) is record
+    with pytest.raises(TypeError):
+        hash(record)
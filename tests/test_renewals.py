@@ -0,0 +1,67 @@
+# Coda delle scadenze: voci superate da modifiche ed eliminazioni, promemoria
+# scattati con tick() e contratti in scadenza letti da expiring().
+from datetime import datetime, timedelta
+
+from renewals import RenewalScheduler
+
+NOW = datetime(2024, 6, 1)
+
+
+def contract(record_id, days):
+    return {'id': record_id, 'end_date': NOW + timedelta(days=days)}
+
+
+def test_load_skips_contracts_already_ended():
+    renewals = RenewalScheduler(notice_days=30)
+    renewals.load([contract(1, -1), contract(2, 10), {'id': 3, 'end_date': None}], NOW)
+    assert len(renewals) == 1
+    assert renewals.tick(NOW) == [(NOW + timedelta(days=10), 2)]
+
+
+def test_schedule_ignores_an_end_date_in_the_past():
+    renewals = RenewalScheduler(notice_days=30)
+    renewals.schedule(contract(1, 90), now=NOW)
+    renewals.schedule(contract(1, -5), now=NOW)
+    assert len(renewals) == 0
+    assert renewals.tick(NOW) == []
+    assert renewals.pending() == []
+
+
+def test_edit_and_cancel_invalidate_old_entries():
+    fired = []
+    renewals = RenewalScheduler(task=lambda record_id, end: fired.append(record_id), notice_days=30)
+    renewals.schedule(contract(1, 10), now=NOW)
+    renewals.schedule(contract(2, 20), now=NOW)
+    renewals.schedule(contract(3, 25), now=NOW)
+    # Contratto 1 prorogato oltre il preavviso, contratto 2 eliminato
+    renewals.schedule(contract(1, 100), now=NOW)
+    renewals.cancel(2)
+    assert renewals.tick(NOW) == [(NOW + timedelta(days=25), 3)]
+    assert fired == [3]
+    assert renewals.pending() == [(NOW + timedelta(days=25), 3)]
+    # Una nuova data di fine chiude il promemoria e rimette il contratto in coda
+    renewals.schedule(contract(3, 400), now=NOW)
+    assert renewals.pending() == []
+    assert len(renewals) == 2
+
+
+def test_rescheduling_the_same_date_twice_fires_once():
+    renewals = RenewalScheduler(notice_days=30)
+    renewals.schedule(contract(1, 10), now=NOW)
+    renewals.schedule({'id': 1, 'end_date': None}, now=NOW)
+    renewals.schedule(contract(1, 10), now=NOW)
+    assert renewals.tick(NOW) == [(NOW + timedelta(days=10), 1)]
+    assert renewals.tick(NOW) == []
+
+
+def test_expiring_returns_valid_entries_in_order():
+    renewals = RenewalScheduler(notice_days=7)
+    renewals.load([contract(record_id, days) for record_id, days in
+                   ((1, 50), (2, 5), (3, 40), (4, 200), (5, 61), (6, 30))], NOW)
+    renewals.cancel(3)
+    renewals.schedule(contract(6, 90), now=NOW)
+    assert [record_id for _, record_id in renewals.expiring(NOW, 60)] == [2, 1]
+    # Il contratto 2 è entrato nel preavviso: resta tra i rinnovi da gestire
+    assert renewals.pending() == [(NOW + timedelta(days=5), 2)]
+    assert renewals.dismiss(2)
+    assert [record_id for _, record_id in renewals.expiring(NOW, 100)] == [1, 5, 6]
@@ -0,0 +1,65 @@
+# Repository in memoria: lettura per chiave primaria e indici secondari dei
+# servizi cliente, tenuti allineati da inserimenti, modifiche ed eliminazioni.
+from datetime import datetime
+
+import pytest
+
+from repository import Repository
+
+
+@pytest.fixture
+def repo():
+    repo = Repository()
+    with repo.transaction() as tx:
+        tx.insert('clients', {'id': 1, 'name': 'Azienda Alpha'})
+        tx.insert('clients', {'id': 2, 'name': 'Beta Srl'})
+        tx.insert('services', {'id': 10, 'name': 'Consulenza', 'price': 100.0})
+        tx.insert('services', {'id': 20, 'name': 'Assistenza', 'price': 50.0})
+        tx.insert('client_services', {'id': 100, 'client_id': 1, 'service_id': 10, 'subscribed_price': 90.0,
+                                      'start_date': datetime(2024, 1, 1), 'end_date': None})
+    return repo
+
+
+def test_get_all_and_count(repo):
+    assert repo.get('clients', 1)['name'] == 'Azienda Alpha'
+    assert repo.get('clients', 3) is None
+    assert [client['id'] for client in repo.all('clients')] == [1, 2]
+    assert repo.count('services') == 2
+
+
+def test_secondary_indexes_follow_updates(repo):
+    assert [cs['id'] for cs in repo.client_services_for_client(1)] == [100]
+    assert repo.find_client_service(1, 10)['id'] == 100
+    assert repo.find_client_service(1, 20) is None
+
+    repo.update('client_services', 100, client_id=2, service_id=20)
+    assert repo.client_services_for_client(1) == []
+    assert repo.client_services_for_service(10) == []
+    assert repo.find_client_service(2, 20)['subscribed_price'] == 90.0
+    assert [(cs['id'], service['name']) for cs, service in repo.subscriptions_for_client(2)] == [(100, 'Assistenza')]
+
+
+def test_update_returns_a_copy(repo):
+    before = repo.get('clients', 1)
+    after = repo.update('clients', 1, city='Torino')
+    assert after['city'] == 'Torino' and 'city' not in before
+    assert repo.get('clients', 1) is after
+    assert repo.update('clients', 99, city='Roma') is None
+
+
+def test_deleting_a_contract_updates_the_indexes(repo):
+    removed = repo.delete('client_services', 100)
+    assert removed['id'] == 100
+    assert repo.client_services_for_client(1) == [] and repo.client_services_for_service(10) == []
+    assert repo.subscriptions_for_client(1) == []
+    assert repo.delete('client_services', 100) is None
+
+
+def test_subscriptions_skip_deleted_catalog_services(repo):
+    with repo.transaction() as tx:
+        tx.insert('client_services', {'id': 101, 'client_id': 2, 'service_id': 20, 'start_date': datetime(2024, 1, 1)})
+    snapshot = repo.snapshot()
+    repo.delete('services', 20)
+    # Lo snapshot precedente vede ancora il servizio e la sottoscrizione
+    assert [cs['id'] for cs, _ in snapshot.subscriptions_for_client(2)] == [101]
+    assert repo.subscriptions_for_client(2) == []
@@ -0,0 +1,121 @@
+# Prova di carico del Repository MVCC: molti scrittori che leggono e
+# modificano lo stesso record, mentre altri thread leggono gli snapshot.
+import sys
+import threading
+
+from ids import new_id
+from repository import Repository
+
+WRITERS = 8
+INCREMENTS = 500
+READERS = 4
+
+
+def _increment(repo, first_id, second_id):
+    """Lettura e scrittura nella stessa transazione: i due prezzi crescono insieme."""
+    with repo.transaction() as tx:
+        price = tx.get('services', first_id)['price']
+        tx.update('services', first_id, price=price + 1)
+        tx.update('services', second_id, price=tx.get('services', second_id)['price'] + 1)
+
+
+def test_no_lost_updates_and_no_partial_snapshots():
+    repo = Repository()
+    first_id, second_id = new_id(), new_id()
+    with repo.transaction() as tx:
+        tx.insert('services', {'id': first_id, 'name': 'Primo', 'price': 0})
+        tx.insert('services', {'id': second_id, 'name': 'Secondo', 'price': 0})
+
+    errors = []
+    done = threading.Event()
+
+    def writer():
+        try:
+            for _ in range(INCREMENTS):
+                _increment(repo, first_id, second_id)
+        except Exception as exc:    # pragma: no cover - riportato dall'assert finale
+            errors.append(exc)
+
+    def reader():
+        last_version = 0
+        while not done.is_set():
+            snapshot = repo.snapshot()
+            first = snapshot.get('services', first_id)['price']
+            second = snapshot.get('services', second_id)['price']
+            if first != second:
+                errors.append(AssertionError(f'snapshot a metà: {first} != {second}'))
+            if snapshot.version < last_version:
+                errors.append(AssertionError(f'versione tornata indietro: {snapshot.version} < {last_version}'))
+            last_version = snapshot.version
+
+    # Cambi di thread frequenti, per mescolare il più possibile scrittori e lettori
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        readers = [threading.Thread(target=reader) for _ in range(READERS)]
+        writers = [threading.Thread(target=writer) for _ in range(WRITERS)]
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        done.set()
+        for thread in readers:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert not errors, errors[:3]
+    snapshot = repo.snapshot()
+    assert snapshot.get('services', first_id)['price'] == WRITERS * INCREMENTS
+    assert snapshot.get('services', second_id)['price'] == WRITERS * INCREMENTS
+    assert snapshot.version == 1 + WRITERS * INCREMENTS
+
+
+def test_failed_transaction_is_discarded():
+    repo = Repository()
+    service_id = new_id()
+    repo.insert('services', {'id': service_id, 'name': 'Servizio', 'price': 10})
+    version = repo.snapshot().version
+    try:
+        with repo.transaction() as tx:
+            tx.update('services', service_id, price=20)
+            raise RuntimeError('annullata')
+    except RuntimeError:
+        pass
+    assert repo.get('services', service_id)['price'] == 10
+    assert repo.snapshot().version == version
+
+
+def test_on_commit_runs_in_commit_order():
+    repo = Repository()
+    service_id = new_id()
+    repo.insert('services', {'id': service_id, 'name': 'Servizio', 'price': 0})
+    seen = []
+
+    def writer():
+        for _ in range(200):
+            with repo.transaction() as tx:
+                service = tx.update('services', service_id, price=tx.get('services', service_id)['price'] + 1)
+                tx.on_commit(seen.append, service['price'])
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=writer) for _ in range(WRITERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert seen == list(range(1, WRITERS * 200 + 1))
+
+    try:
+        with repo.transaction() as tx:
+            tx.on_commit(seen.append, 'annullata')
+            raise RuntimeError('annullata')
+    except RuntimeError:
+        pass
+    assert seen[-1] != 'annullata'
+
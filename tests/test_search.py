@@ -0,0 +1,77 @@
+# Ricerca testuale a trigrammi su clienti e potenziali clienti: sottostringhe,
+# inizi di parola, accenti, modifiche ed eliminazioni, ricompattazione.
+import random
+
+import pytest
+
+from repository import Repository
+from search import normalize
+
+
+@pytest.fixture
+def repo():
+    repo = Repository()
+    with repo.transaction() as tx:
+        tx.insert('clients', {'id': 1, 'name': 'Caffè Roma', 'city': 'Torino', 'vat_id': 'IT01234567890'})
+        tx.insert('clients', {'id': 2, 'name': 'Romano Impianti', 'email': 'info@romano.it', 'city': 'Milano'})
+        tx.insert('clients', {'id': 3, 'name': 'Ferramenta Bianchi', 'city': 'Roma'})
+        tx.insert('prospects', {'id': 4, 'name': 'Studio Romagnoli', 'contact': 'Anna Verdi'})
+    return repo
+
+
+def _found(repo, query, **options):
+    return [(table, record['id']) for table, record in repo.search(query, **options)]
+
+
+def test_normalize():
+    assert normalize('  Caffè   ROMA ') == 'caffe roma'
+    assert normalize('Straße') == 'strasse'
+
+
+def test_substrings_and_word_starts(repo):
+    assert _found(repo, '4567') == [('clients', 1)]
+    assert _found(repo, 'CAFFE') == [('clients', 1)]
+    assert _found(repo, 'roman') == [('clients', 2)]
+    # Dal record modificato più di recente
+    assert _found(repo, 'roma') == [('prospects', 4), ('clients', 3), ('clients', 2), ('clients', 1)]
+    # Due caratteri: solo le parole che iniziano così
+    assert sorted(_found(repo, 'ro')) == [('clients', 1), ('clients', 2), ('clients', 3), ('prospects', 4)]
+    assert _found(repo, 'ma') == []
+    assert _found(repo, 'x') == []
+
+
+def test_every_word_must_match(repo):
+    assert _found(repo, 'roma torino') == [('clients', 1)]
+    assert _found(repo, 'roma milano') == [('clients', 2)]
+    assert _found(repo, 'roma napoli') == []
+    assert _found(repo, 'roma', tables=('prospects',)) == [('prospects', 4)]
+
+
+def test_updates_and_deletes_are_visible(repo):
+    repo.update('clients', 3, name='Ferramenta Neri', city='Genova')
+    assert ('clients', 3) not in _found(repo, 'bianchi roma')
+    assert _found(repo, 'neri gen') == [('clients', 3)]
+    repo.delete('clients', 2)
+    assert _found(repo, 'romano') == []
+    assert _found(repo, 'info@romano') == []
+
+
+def test_results_survive_compaction(monkeypatch):
+    monkeypatch.setattr('search.COMPACT_MIN_DEAD', 10)
+    rng = random.Random(3)
+    repo = Repository()
+    names = {}
+    for record_id in range(1, 201):
+        names[record_id] = f"Cliente {rng.choice(('Alfa', 'Beta', 'Gamma'))} {record_id}"
+        repo.insert('clients', {'id': record_id, 'name': names[record_id]})
+    for _ in range(300):
+        record_id = rng.randrange(1, 201)
+        if record_id in names and rng.random() < 0.3:
+            repo.delete('clients', record_id)
+            del names[record_id]
+        elif record_id in names:
+            names[record_id] = f"Cliente {rng.choice(('Alfa', 'Beta', 'Gamma'))} {record_id}"
+            repo.update('clients', record_id, name=names[record_id])
+    for word in ('alfa', 'beta', 'gamma'):
+        expected = {record_id for record_id, name in names.items() if word in name.lower()}
+        assert {record_id for _, record_id in _found(repo, word, limit=1000)} == expected
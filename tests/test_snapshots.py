@@ -0,0 +1,68 @@
+# Snapshot msgpack del Repository: andata e ritorno di id, date, dettagli
+# mensili e campi assenti, lettura con mmap e snapshot delle versioni precedenti.
+from datetime import datetime
+import uuid
+
+import msgpack
+
+from ids import new_id
+from ledger import MonthlyLedger
+from repository import Repository
+from snapshots import load_snapshot, pack_tables, save_snapshot, unpack_tables
+
+
+def test_round_trip_keeps_ids_dates_and_ledgers():
+    client_id = new_id()
+    ledger = MonthlyLedger.for_range(datetime(2024, 1, 1), datetime(2024, 3, 1)).updated(
+        [(0, 'hours_worked', 7.5), (2, 'amount_paid', 1200.0), (1, 'notes', 'Fattura n. 12')])
+    tables = {
+        'clients': [{'id': client_id, 'name': 'Azienda Alpha', 'created_at': datetime(2024, 2, 29, 13, 45, 1, 123456)},
+                    {'id': 7, 'name': 'Riga SQLite'}],
+        'client_services': [{'id': new_id(), 'client_id': client_id, 'service_id': 42, 'end_date': None,
+                             'monthly_details': ledger}],
+    }
+    version, restored = unpack_tables(pack_tables(5, tables))
+    assert version == 5
+    assert restored == tables
+    assert restored['clients'][0]['id'] == client_id
+    details = restored['client_services'][0]['monthly_details']
+    assert details == ledger and details.hours_worked.typecode == 'd'
+
+
+def test_missing_fields_stay_missing():
+    tables = {'clients': [{'id': 1, 'name': 'Con email', 'email': 'a@example.it'},
+                          {'id': 2, 'name': 'Senza email'},
+                          {'id': 3, 'name': 'Email vuota', 'email': None}]}
+    _, restored = unpack_tables(pack_tables(1, tables))
+    assert 'email' not in restored['clients'][1]
+    assert restored['clients'][2]['email'] is None
+    assert restored == tables
+
+
+def test_save_and_load_through_mmap(tmp_path):
+    repo = Repository()
+    client_id = new_id()
+    repo.insert('clients', {'id': client_id, 'name': 'Azienda Alpha'})
+    repo.insert('services', {'id': new_id(), 'name': 'Consulenza', 'price': 100.0})
+    path = str(tmp_path / 'snapshot.msgpack')
+    save_snapshot(path, repo.snapshot())
+    for use_mmap in (True, False):
+        version, tables = load_snapshot(path, use_mmap=use_mmap)
+        assert version == repo.snapshot().version
+        assert [record['id'] for record in tables['clients']] == [client_id]
+    restored = Repository()
+    restored.load(*load_snapshot(path))
+    assert restored.get('clients', client_id)['name'] == 'Azienda Alpha'
+
+
+def test_legacy_uuid_ids_are_migrated():
+    client_id, contract_id = uuid.uuid4(), uuid.uuid4()
+    legacy = msgpack.packb({'format': 1, 'version': 3, 'tables': {
+        'clients': {'fields': ['id', 'name'], 'rows': [[str(client_id), 'Vecchio cliente']]},
+        'client_services': {'fields': ['id', 'client_id', 'service_id'],
+                            'rows': [[str(contract_id), str(client_id), '17']]},
+    }}, use_bin_type=True)
+    version, tables = unpack_tables(legacy)
+    assert version == 3
+    assert tables['clients'][0]['id'] == client_id.int
+    assert tables['client_services'][0] == {'id': contract_id.int, 'client_id': client_id.int, 'service_id': 17}
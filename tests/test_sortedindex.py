@@ -0,0 +1,59 @@
+# SortedIndex confrontato con una lista ordinata semplice, con blocchi piccoli
+# per esercitare divisioni e fusioni, e ricerche per chiave.
+import bisect
+import random
+
+import pytest
+
+import sortedindex
+from sortedindex import SortedIndex
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(sortedindex, 'CHUNK_SIZE', 8)
+
+
+def test_matches_sorted_list(small_chunks):
+    rng = random.Random(3)
+    reference, index = [], SortedIndex()
+    versions = []
+    for step in range(5000):
+        if step % 500 == 0:
+            # Copia copy-on-write: la versione precedente non deve cambiare
+            versions.append((list(reference), index))
+            index = index.copy()
+        if reference and rng.random() < 0.45:
+            entry = rng.choice(reference)
+            reference.remove(entry)
+            index.discard(entry)
+        else:
+            entry = ((1, rng.randint(0, 300)), rng.getrandbits(64))
+            if entry in reference:
+                continue
+            bisect.insort(reference, entry)
+            index.add(entry)
+        assert len(index) == len(reference)
+
+        if step % 97 == 0:
+            assert list(index) == reference
+            low, high = sorted((rng.randint(-5, 305), rng.randint(-5, 305)))
+            lo, hi = index.bisect_key_left((1, low)), index.bisect_key_right((1, high))
+            expected = [entry for entry in reference if low <= entry[0][1] <= high]
+            assert list(index.irange(lo, hi)) == expected
+            assert list(index.irange(lo, hi, reverse=True)) == expected[::-1]
+            if reference:
+                cursor = rng.choice(reference)
+                after = index.bisect_right(cursor)
+                assert list(index.irange(after, index.end)) == [entry for entry in reference if entry > cursor]
+
+    for expected, version in versions:
+        assert list(version) == expected
+
+
+def test_key_bounds_include_every_id_of_the_key():
+    index = SortedIndex([((1, 'a'), 5), ((1, 'b'), 1), ((1, 'b'), 2 ** 127), ((1, 'c'), 3)])
+    lo, hi = index.bisect_key_left((1, 'b')), index.bisect_key_right((1, 'b'))
+    assert [record_id for _, record_id in index.irange(lo, hi)] == [1, 2 ** 127]
+    assert index.bisect_key_left((1, 'z')) == index.end
+    assert index.bisect_key_right((0, '')) == (0, 0)
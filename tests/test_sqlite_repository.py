@@ -0,0 +1,85 @@
+# Backend SQLite sullo schema di instance/crm.db: stessa interfaccia del
+# Repository in memoria, dettagli mensili in pagamenti e ore_lavorate,
+# eliminazioni a cascata e transazioni. Ogni prova lavora su una copia.
+from datetime import datetime
+import os
+import shutil
+
+import pytest
+
+from ledger import MonthlyLedger
+from sqlite_repository import SQLiteRepository
+
+DATABASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'crm.db')
+
+
+@pytest.fixture
+def repo(tmp_path):
+    path = str(tmp_path / 'crm.db')
+    shutil.copyfile(DATABASE, path)
+    return SQLiteRepository(path)
+
+
+def _contract(repo, **fields):
+    client = repo.insert('clients', {'name': 'Azienda Alpha', 'email': 'info@alpha.it', 'city': 'Torino',
+                                     'created_at': datetime(2024, 1, 5)})
+    service = repo.insert('services', {'name': 'Consulenza', 'price': 100.0, 'description': ''})
+    details = MonthlyLedger.for_range(datetime(2024, 1, 1), datetime(2024, 3, 1)).updated(
+        [(0, 'hours_worked', 5.0), (1, 'amount_paid', 90.0), (2, 'notes', 'Saldo')])
+    record = {'client_id': client['id'], 'service_id': service['id'], 'subscribed_price': 90.0,
+              'start_date': datetime(2024, 1, 1), 'end_date': datetime(2024, 3, 31), 'notes': '',
+              'monthly_details': details, **fields}
+    return client, service, repo.insert('client_services', record)
+
+
+def test_monthly_details_round_trip(repo):
+    client, service, contract = _contract(repo)
+    stored = repo.get('client_services', contract['id'])
+    assert (stored['client_id'], stored['service_id']) == (client['id'], service['id'])
+    assert stored['monthly_details'] == contract['monthly_details']
+    assert repo.find_client_service(client['id'], service['id'])['id'] == contract['id']
+    assert [cs['id'] for cs, _ in repo.subscriptions_for_client(client['id'])] == [contract['id']]
+
+
+def test_update_months_writes_only_the_changed_cells(repo):
+    _, _, contract = _contract(repo)
+    with repo.transaction() as tx:
+        details = tx.get('client_services', contract['id'])['monthly_details']
+        tx.update_months(contract['id'], details, [(1, 'hours_worked', 12.5), (0, 'hours_worked', 0.0)])
+    details = repo.get('client_services', contract['id'])['monthly_details']
+    assert list(details.hours_worked) == [0.0, 12.5, 0.0]
+    assert list(details.amount_paid) == [0.0, 90.0, 0.0]
+    assert details.notes == {2: 'Saldo'}
+
+
+def test_deleting_a_client_cascades_to_its_contracts(repo):
+    client, service, contract = _contract(repo)
+    repo.delete('clients', client['id'])
+    assert repo.get('client_services', contract['id']) is None
+    assert repo.client_services_for_service(service['id']) == []
+    assert repo.client_services_active(datetime(2024, 1, 1), datetime(2024, 12, 31)) == []
+
+
+def test_failed_transaction_rolls_back_and_skips_callbacks(repo):
+    calls = []
+    with pytest.raises(RuntimeError):
+        with repo.transaction() as tx:
+            tx.insert('clients', {'name': 'Mai salvato', 'email': 'mai@example.it'})
+            tx.on_commit(calls.append, 'commit')
+            raise RuntimeError('annullata')
+    assert repo.count('clients') == 0 and calls == []
+    with repo.transaction() as tx:
+        tx.insert('clients', {'name': 'Salvato', 'email': 'salvato@example.it'})
+        tx.on_commit(calls.append, 'commit')
+    assert repo.count('clients') == 1 and calls == ['commit']
+
+
+def test_period_and_text_queries(repo):
+    client, _, contract = _contract(repo)
+    february = repo.client_services_active(datetime(2024, 2, 1), datetime(2024, 2, 1))
+    assert [cs['id'] for cs in february] == [contract['id']]
+    assert repo.client_services_active(datetime(2024, 4, 1), datetime(2024, 5, 1)) == []
+    ending = repo.client_services_ending(datetime(2024, 3, 1), datetime(2024, 4, 1))
+    assert [cs['id'] for cs in ending] == [contract['id']]
+    assert [(table, record['id']) for table, record in repo.search('alph')] == [('clients', client['id'])]
+    assert [record['id'] for record in repo.prefix_search('clients', 'azi')] == [client['id']]